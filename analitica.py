@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+import logging
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Colunas analíticas de bd mantidas em memória
+DIMENSOES = ['pt', 'localidade', 'criterio', 'anomalia', 'est_contr', 'desc_tp_cli']
+MEDIDAS = ['valor', 'qtd', 'lat', 'long']
+
+TAMANHO_LOTE = 250000
+
+# Diferença máxima de versões aplicada de forma incremental
+MAX_VERSOES_INCREMENTAIS = 1000
+# Linhas mantidas em alteracoes_estado: acima disto o registo é esvaziado e os snapshots recarregam
+MAX_LINHAS_ALTERACOES = 500000
+
+
+class SnapshotColunar:
+    """Cópia colunar e imutável das colunas analíticas de bd para uma versão dos dados.
+
+    Cada dimensão é codificada em dicionário (códigos int32 + categorias, -1 para vazio);
+    as medidas são arrays float64 e o estado 'prog' um array booleano. 'linhas' guarda o
+    num_linha de cada posição, para aplicar as mudanças de estado sem reler a tabela.
+    """
+
+    def __init__(self, versao, codigos, categorias, medidas, prog, linhas, versao_importacao, ordem=None):
+        self.versao = versao
+        self.versao_importacao = versao_importacao
+        self.codigos = codigos
+        self.categorias = categorias
+        self.medidas = medidas
+        self.prog = prog
+        self.linhas = linhas
+        self.ordem = np.argsort(linhas, kind='stable') if ordem is None else ordem
+        self.total_registros = len(prog)
+
+    def com_estado(self, versao, linhas, prog):
+        """Novo snapshot com o estado 'prog' das 'linhas' (num_linha) indicadas; este não é alterado."""
+        novo_prog = self.prog.copy()
+        posicoes = np.searchsorted(self.linhas, linhas, sorter=self.ordem)
+        encontradas = posicoes < len(self.ordem)
+        posicoes = self.ordem[posicoes[encontradas]]
+        validas = self.linhas[posicoes] == linhas[encontradas]
+        novo_prog[posicoes[validas]] = prog[encontradas][validas]
+        return SnapshotColunar(
+            versao, self.codigos, self.categorias, self.medidas, novo_prog,
+            self.linhas, self.versao_importacao, self.ordem
+        )
+
+    # --- Filtros e Agrupamentos Vetorizados ---
+    def mascara(self, filtros=None):
+        """Máscara booleana para filtros {dimensao: valor} (comparação por código)."""
+        mascara = np.ones(self.total_registros, dtype=bool)
+        for dimensao, valor in (filtros or {}).items():
+            categorias = self.categorias[dimensao]
+            posicao = np.searchsorted(categorias, valor)
+            if posicao >= len(categorias) or categorias[posicao] != valor:
+                return np.zeros(self.total_registros, dtype=bool)
+            mascara &= self.codigos[dimensao] == posicao
+        return mascara
+
+    def agrupar(self, dimensao, filtros=None):
+        """Agrega por dimensão: registros, em progresso, soma e média de valor."""
+        codigos = self.codigos[dimensao]
+        categorias = self.categorias[dimensao]
+        selecionados = self.mascara(filtros) & (codigos >= 0)
+        codigos_sel = codigos[selecionados]
+        valor = self.medidas['valor'][selecionados]
+        com_valor = ~np.isnan(valor)
+
+        n = len(categorias)
+        total = np.bincount(codigos_sel, minlength=n)
+        em_progresso = np.bincount(codigos_sel, weights=self.prog[selecionados], minlength=n)
+        valor_total = np.bincount(codigos_sel[com_valor], weights=valor[com_valor], minlength=n)
+        registros_com_valor = np.bincount(codigos_sel[com_valor], minlength=n)
+
+        df = pd.DataFrame({
+            dimensao: categorias,
+            'total_registros': total,
+            'em_progresso': em_progresso.astype(np.int64),
+            'valor_total': valor_total,
+            'valor_medio': np.divide(valor_total, registros_com_valor,
+                                     out=np.full(n, np.nan), where=registros_com_valor > 0)
+        })
+        return df[df['total_registros'] > 0].reset_index(drop=True)
+
+    # --- Consultas do Dashboard e Análise de Eficiência ---
+    def metricas_operacionais(self):
+        """Equivalente vetorizado de obter_metricas_operacionais."""
+        eficiencia_pt = self.agrupar('pt')
+        eficiencia_pt = eficiencia_pt[eficiencia_pt['total_registros'] > 10]
+        eficiencia_pt = eficiencia_pt.nlargest(15, 'total_registros')
+        eficiencia_pt['percentual_progresso'] = (
+            eficiencia_pt['em_progresso'] * 100.0 / eficiencia_pt['total_registros']
+        ).round(2)
+
+        top_localidades = self.agrupar('localidade').nlargest(15, 'valor_total')
+
+        return {
+            'eficiencia_pt': eficiencia_pt[[
+                'pt', 'total_registros', 'em_progresso', 'percentual_progresso', 'valor_total', 'valor_medio'
+            ]].to_dict('records'),
+            'top_localidades': top_localidades[[
+                'localidade', 'total_registros', 'valor_total', 'valor_medio'
+            ]].to_dict('records')
+        }
+
+    def distribuicao(self, dimensao, nome_saida, valor_filtro=None):
+        """Equivalente vetorizado de obter_dados_para_dashboard."""
+        filtros = {dimensao: valor_filtro} if valor_filtro else None
+        df = self.agrupar(dimensao, filtros).rename(columns={
+            dimensao: nome_saida,
+            'total_registros': 'quantidade',
+            'valor_total': 'total_valor'
+        })
+        df = df.sort_values(['quantidade', 'total_valor'], ascending=False)
+        return {
+            'distribuicao_criterio': df[[nome_saida, 'quantidade', 'total_valor', 'valor_medio']].to_dict('records')
+        }
+
+    def densidade_geografica(self, resolucao, limite):
+        """Equivalente vetorizado de obter_densidade_geografica (grelha de 'resolucao' graus)."""
+        lat = self.medidas['lat']
+        lon = self.medidas['long']
+        validos = ~np.isnan(lat) & ~np.isnan(lon) & (lat != 0) & (lon != 0)
+        df = pd.DataFrame({
+            'celula_lat': np.floor(lat[validos] / resolucao),
+            'celula_long': np.floor(lon[validos] / resolucao),
+            'valor': self.medidas['valor'][validos]
+        })
+        agrupado = df.groupby(['celula_lat', 'celula_long'], sort=False).agg(
+            densidade=('valor', 'size'),
+            valor_total=('valor', 'sum')
+        ).reset_index().nlargest(limite, 'densidade')
+        agrupado['lat'] = (agrupado['celula_lat'] + 0.5) * resolucao
+        agrupado['long'] = (agrupado['celula_long'] + 0.5) * resolucao
+        return agrupado[['lat', 'long', 'densidade', 'valor_total']].to_dict('records')
+
+
+def _transacao_consistente(engine):
+    """Conexão em REPEATABLE READ: versão e dados lidos do mesmo instantâneo da BD."""
+    return engine.connect().execution_options(isolation_level="REPEATABLE READ")
+
+def _ler_versoes(conn):
+    return tuple(conn.execute(text("SELECT versao, versao_importacao, versao_poda FROM controle_versao WHERE id = 1")).one())
+
+def carregar_snapshot(engine, tamanho_lote=TAMANHO_LOTE):
+    """Lê as colunas analíticas de bd em lotes (cursor no servidor) e monta o snapshot colunar."""
+    inicio = time.perf_counter()
+    normalizadas = ", ".join(f"NULLIF(UPPER(TRIM({d})), '') AS {d}" for d in DIMENSOES)
+    query = text(f"""
+        SELECT {normalizadas}, {', '.join(MEDIDAS)}, LOWER(TRIM(estado)) = 'prog' AS prog, num_linha
+        FROM bd
+    """)
+
+    lotes = []
+    with _transacao_consistente(engine) as conn, conn.begin():
+        versao, versao_importacao, _ = _ler_versoes(conn)
+        conn = conn.execution_options(stream_results=True)
+        for lote in pd.read_sql_query(query, conn, chunksize=tamanho_lote):
+            for dimensao in DIMENSOES:
+                lote[dimensao] = lote[dimensao].astype('category')
+            for medida in MEDIDAS:
+                lote[medida] = pd.to_numeric(lote[medida], errors='coerce').astype(np.float64)
+            lote['prog'] = lote['prog'].fillna(False).astype(bool)
+            lotes.append(lote)
+
+    codigos, categorias = {}, {}
+    for dimensao in DIMENSOES:
+        if lotes:
+            coluna = union_categoricals([l[dimensao] for l in lotes], sort_categories=True)
+            codigos[dimensao] = coluna.codes.astype(np.int32)
+            categorias[dimensao] = np.asarray(coluna.categories, dtype=object)
+        else:
+            codigos[dimensao] = np.empty(0, dtype=np.int32)
+            categorias[dimensao] = np.empty(0, dtype=object)
+
+    medidas = {
+        m: np.concatenate([l[m].to_numpy() for l in lotes]) if lotes else np.empty(0) for m in MEDIDAS
+    }
+    prog = np.concatenate([l['prog'].to_numpy() for l in lotes]) if lotes else np.empty(0, dtype=bool)
+    linhas = np.concatenate([l['num_linha'].to_numpy(np.int64) for l in lotes]) if lotes else np.empty(0, dtype=np.int64)
+
+    snapshot = SnapshotColunar(versao, codigos, categorias, medidas, prog, linhas, versao_importacao)
+    logger.info(f"Snapshot analítico carregado: {snapshot.total_registros} registros, "
+                f"versão {versao}, {time.perf_counter() - inicio:.2f}s")
+    return snapshot
+
+def atualizar_snapshot(engine, snapshot):
+    """Aplica ao snapshot as mudanças de estado registadas em alteracoes_estado desde a sua versão.
+    
+    Retorna None quando é preciso recarregar por completo (nova importação, registo podado
+    depois da versão do snapshot ou diferença de versões acima de MAX_VERSOES_INCREMENTAIS).
+    """
+    inicio = time.perf_counter()
+    with _transacao_consistente(engine) as conn, conn.begin():
+        versao, versao_importacao, versao_poda = _ler_versoes(conn)
+        # Alterações até versao_poda já não estão (todas) no registo
+        if (versao_importacao != snapshot.versao_importacao or snapshot.versao < versao_poda
+                or versao - snapshot.versao > MAX_VERSOES_INCREMENTAIS):
+            return None
+        if versao <= snapshot.versao:
+            return snapshot
+        # Estado atual (e não o registado) das linhas alteradas: várias mudanças da mesma linha resolvem-se sozinhas
+        df = pd.read_sql_query(text("""
+            SELECT num_linha, LOWER(TRIM(estado)) = 'prog' AS prog
+            FROM bd
+            WHERE num_linha IN (
+                SELECT num_linha FROM alteracoes_estado WHERE versao > :desde AND versao <= :ate
+            )
+        """), conn, params={'desde': snapshot.versao, 'ate': versao})
+
+    novo = snapshot.com_estado(
+        versao, df['num_linha'].to_numpy(np.int64), df['prog'].fillna(False).to_numpy(dtype=bool)
+    )
+    logger.info(f"Snapshot analítico atualizado: {len(df)} registros alterados, "
+                f"versão {snapshot.versao} -> {versao}, {time.perf_counter() - inicio:.3f}s")
+    return novo
+
+
+class MotorAnalitico:
+    """Mantém o snapshot colunar do processo.
+    
+    Mudanças de estado (geração e reset) são aplicadas de forma incremental; só uma
+    importação obriga a recarregar a tabela bd.
+    """
+
+    def __init__(self, tamanho_lote=TAMANHO_LOTE):
+        self.tamanho_lote = tamanho_lote
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def snapshot(self, engine, versao):
+        atual = self._snapshot
+        if atual is not None and atual.versao >= versao:
+            return atual
+        # Apenas uma thread atualiza; as demais aguardam e reutilizam o resultado
+        with self._lock:
+            atual = self._snapshot
+            if atual is not None and atual.versao >= versao:
+                return atual
+            novo = atualizar_snapshot(engine, atual) if atual is not None else None
+            if novo is None:
+                novo = carregar_snapshot(engine, self.tamanho_lote)
+            self._snapshot = novo
+            return novo
+
+_motor_global = None
+_motor_global_lock = threading.Lock()
+
+def obter_motor(config=None):
+    """Retorna o motor analítico do processo, ou None se não estiver ativo na configuração."""
+    global _motor_global
+    config = dict(config or {})
+    if not config.get('ativo', False):
+        return None
+    with _motor_global_lock:
+        if _motor_global is None:
+            _motor_global = MotorAnalitico(int(config.get('tamanho_lote', TAMANHO_LOTE)))
+    return _motor_global
@@ -0,0 +1,459 @@
+# -*- coding: utf-8 -*-
+"""API HTTP JSON para geração de folhas em lote e consulta de estado (apenas biblioteca padrão).
+
+Autenticação HTTP Basic com os utilizadores da aplicação. Rotas:
+    GET  /api/saude                      estado do serviço (sem autenticação)
+    GET  /api/contagens?coluna=PT        registros disponíveis por PT ou LOCALIDADE
+    GET  /api/historico                  últimas gerações
+    POST /api/simular                    estimativa da geração (JSON)
+    POST /api/gerar                      gera e devolve o ZIP das folhas (?formato=json para os registros)
+    POST /api/gerar/lote                 gera para vários PTs/localidades num único ZIP
+    GET  /api/relatorio?pt=&estado=      relatório detalhado completo em CSV gzip (&comprimir=0 para CSV)
+
+O relatório exige a função Administrador; as restantes rotas, qualquer função da app (403 caso contrário).
+Corpos acima de [api] max_corpo_kb (1024 por padrão) são recusados com 413.
+
+Corpo de /api/simular e /api/gerar:
+    {"tipo": "PT", "valor": "PT12", "folhas": 5, "nibs": 20,
+     "criterio_tipo": null, "criterio_valor": null, "cils": null}
+Corpo de /api/gerar/lote: igual, com "valores": [...] em vez de "valor".
+
+Uso:
+    DATABASE_URL=postgresql+psycopg2://postgres@localhost/vf_perda python api.py --porta 8080
+    curl -u AssAdm:senha -X POST localhost:8080/api/gerar -d '{"tipo":"PT","valor":"PT12","folhas":2,"nibs":20}' -o folhas.zip
+"""
+import json
+import time
+import base64
+import hashlib
+import argparse
+import datetime
+import threading
+import logging
+from zipfile import ZipFile
+from urllib.parse import urlparse, parse_qs, urlencode
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Secção opcional [api] da configuração
+API_CONFIG = config.secao("api")
+HOST_PADRAO = API_CONFIG.get('host', '127.0.0.1')
+PORTA_PADRAO = int(API_CONFIG.get('porta', 8080))
+# Endereço da API visto pelos browsers (ligação para as exportações grandes na app);
+# sem ele, a app serve a API no próprio processo, em HOST_PADRAO:PORTA_PADRAO
+URL_PUBLICA = API_CONFIG.get('url_publica')
+# Senhas já verificadas contra o hash atual reutilizadas durante este tempo (evita um bcrypt por pedido)
+TTL_CREDENCIAIS = float(API_CONFIG.get('ttl_credenciais', 300))
+MAX_VALORES_LOTE = int(API_CONFIG.get('max_valores_lote', 200))
+MAX_CORPO_BYTES = int(API_CONFIG.get('max_corpo_kb', 1024)) * 1024
+TAMANHO_BLOCO_RESPOSTA = 64 * 1024
+
+TIPOS_FOLHA = ("PT", "LOCALIDADE", "AVULSO")
+# Funções com acesso a cada grupo de rotas, como nas abas da app (views/admin.py)
+FUNCOES_GERACAO = ("Administrador", "Assistente Administrativo", "Técnico")
+FUNCOES_RELATORIO = ("Administrador",)
+COLUNAS_FILTRO_RELATORIO = ("pt", "localidade", "criterio", "estado")
+# SQLSTATE de conflito com outra transação: serialização, deadlock, bloqueio indisponível
+CODIGOS_CONFLITO = ("40001", "40P01", "55P03")
+
+
+class ErroPedido(Exception):
+    """Erro a devolver ao cliente com o código HTTP indicado."""
+
+    def __init__(self, status, mensagem):
+        super().__init__(mensagem)
+        self.status = status
+        self.mensagem = mensagem
+
+
+class CacheCredenciais:
+    """Verificações bcrypt bem-sucedidas recentes, por resumo (SHA-256) de utilizador, senha e hash guardado.
+
+    Só evita o bcrypt: a linha do utilizador é relida em cada pedido, pelo que uma senha
+    alterada (outro hash), a exclusão ou a mudança de função têm efeito imediato.
+    """
+
+    def __init__(self, ttl=TTL_CREDENCIAIS):
+        self.ttl = ttl
+        self._itens = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _chave(username, password, password_hash):
+        return hashlib.sha256(f"{username}\0{password}\0{password_hash}".encode('utf-8')).hexdigest()
+
+    def contem(self, username, password, password_hash):
+        chave = self._chave(username, password, password_hash)
+        with self._lock:
+            expira = self._itens.get(chave)
+            if expira is None or expira < time.time():
+                self._itens.pop(chave, None)
+                return False
+            return True
+
+    def gravar(self, username, password, password_hash):
+        agora = time.time()
+        with self._lock:
+            # Descarta as entradas expiradas (hashes antigos deixam de ser usados)
+            for chave in [c for c, expira in self._itens.items() if expira < agora]:
+                del self._itens[chave]
+            self._itens[self._chave(username, password, password_hash)] = agora + self.ttl
+
+
+class FluxoChunked:
+    """Ficheiro só de escrita que envia os dados na resposta com Transfer-Encoding: chunked."""
+
+    def __init__(self, saida, tamanho_bloco=TAMANHO_BLOCO_RESPOSTA):
+        self.saida = saida
+        self.tamanho_bloco = tamanho_bloco
+        self._buffer = bytearray()
+
+    def write(self, dados):
+        self._buffer += dados
+        if len(self._buffer) >= self.tamanho_bloco:
+            self.flush()
+        return len(dados)
+
+    def flush(self):
+        if self._buffer:
+            self.saida.write(f"{len(self._buffer):X}\r\n".encode('ascii') + bytes(self._buffer) + b"\r\n")
+            self._buffer.clear()
+
+    def fechar(self):
+        self.flush()
+        self.saida.write(b"0\r\n\r\n")
+        self.saida.flush()
+
+
+# --- Validação dos Pedidos ---
+def _inteiro_positivo(corpo, nome):
+    try:
+        valor = int(corpo.get(nome))
+    except (TypeError, ValueError):
+        raise ErroPedido(400, f"'{nome}' deve ser um inteiro")
+    if valor <= 0:
+        raise ErroPedido(400, f"'{nome}' deve ser maior que zero")
+    return valor
+
+def erro_geracao(e):
+    """ErroPedido correspondente a uma falha da BD na geração, ou None se a falha for inesperada."""
+    from sqlalchemy.exc import InterfaceError, OperationalError
+    if getattr(getattr(e, 'orig', None), 'pgcode', None) in CODIGOS_CONFLITO:
+        return ErroPedido(409, "Conflito com outra geração em curso: tente novamente")
+    if isinstance(e, (OperationalError, InterfaceError)):
+        return ErroPedido(503, "Base de dados indisponível: tente novamente mais tarde")
+    return None
+
+def parametros_geracao(corpo, exigir_valor=True):
+    """Argumentos posicionais de simular/gerar_folhas_trabalho a partir do corpo JSON."""
+    tipo = str(corpo.get('tipo', '')).upper()
+    if tipo not in TIPOS_FOLHA:
+        raise ErroPedido(400, f"'tipo' deve ser um de {', '.join(TIPOS_FOLHA)}")
+    valor = corpo.get('valor')
+    if exigir_valor and tipo != "AVULSO" and not valor:
+        raise ErroPedido(400, "'valor' é obrigatório para os tipos PT e LOCALIDADE")
+    cils = corpo.get('cils')
+    if tipo == "AVULSO" and not cils:
+        raise ErroPedido(400, "'cils' é obrigatório para o tipo AVULSO")
+    if cils is not None and not isinstance(cils, list):
+        raise ErroPedido(400, "'cils' deve ser uma lista")
+    return (
+        tipo, valor, _inteiro_positivo(corpo, 'folhas'), _inteiro_positivo(corpo, 'nibs'),
+        cils, corpo.get('criterio_tipo'), corpo.get('criterio_valor')
+    )
+
+def url_relatorio(filtros, comprimir=True):
+    """Ligação para GET /api/relatorio com os filtros indicados (url_publica ou o servidor local)."""
+    parametros = {coluna: valor for coluna, valor in filtros.items() if coluna in COLUNAS_FILTRO_RELATORIO}
+    if not comprimir:
+        parametros['comprimir'] = '0'
+    base = URL_PUBLICA or f"http://{'localhost' if HOST_PADRAO in ('', '0.0.0.0', '127.0.0.1') else HOST_PADRAO}:{PORTA_PADRAO}"
+    return f"{base.rstrip('/')}/api/relatorio?{urlencode(parametros)}"
+
+def _registros(df):
+    """DataFrame em lista de dicionários serializáveis em JSON."""
+    if df is None or df.empty:
+        return []
+    return json.loads(df.to_json(orient='records', date_format='iso', force_ascii=False))
+
+
+# --- Manipulador HTTP ---
+class ManipuladorAPI(BaseHTTPRequestHandler):
+    """Encaminha os pedidos para o PostgresDatabaseManager partilhado pelo servidor."""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "vf_perda_api/1.0"
+
+    ROTAS = {
+        ('GET', '/api/saude'): ('saude', None),
+        ('GET', '/api/contagens'): ('contagens', FUNCOES_GERACAO),
+        ('GET', '/api/historico'): ('historico', FUNCOES_GERACAO),
+        ('POST', '/api/simular'): ('simular', FUNCOES_GERACAO),
+        ('POST', '/api/gerar'): ('gerar', FUNCOES_GERACAO),
+        ('POST', '/api/gerar/lote'): ('gerar_lote', FUNCOES_GERACAO),
+        ('GET', '/api/relatorio'): ('relatorio', FUNCOES_RELATORIO),
+    }
+
+    def do_GET(self):
+        self._despachar('GET')
+
+    def do_POST(self):
+        self._despachar('POST')
+
+    def log_message(self, formato, *args):
+        logger.info(f"API {self.address_string()} - {formato % args}")
+
+    def _despachar(self, metodo):
+        self._resposta_iniciada = False
+        url = urlparse(self.path)
+        rota = self.ROTAS.get((metodo, url.path.rstrip('/') or '/'))
+        try:
+            if rota is None:
+                raise ErroPedido(404, "Rota não encontrada")
+            nome, funcoes = rota
+            usuario = self._autenticar() if funcoes else None
+            if usuario is not None and usuario['role'] not in funcoes:
+                raise ErroPedido(403, "Acesso negado para a função do utilizador")
+            consulta = {chave: valores[-1] for chave, valores in parse_qs(url.query).items()}
+            corpo = self._ler_json() if metodo == 'POST' else {}
+            getattr(self, f"_rota_{nome}")(usuario, consulta, corpo)
+        except ErroPedido as e:
+            self._responder_json(e.status, {'erro': e.mensagem})
+        except Exception as e:
+            logger.error(f"Erro na API ({metodo} {url.path}): {e}")
+            if self._resposta_iniciada:
+                # Anexo já em envio: só resta interromper a ligação (o cliente recebe um ficheiro incompleto)
+                self.close_connection = True
+            else:
+                self._responder_json(500, {'erro': "Erro interno"})
+
+    # --- Utilitários de Pedido e Resposta ---
+    def _autenticar(self):
+        cabecalho = self.headers.get('Authorization', '')
+        if not cabecalho.startswith('Basic '):
+            raise ErroPedido(401, "Autenticação necessária")
+        try:
+            username, password = base64.b64decode(cabecalho[6:]).decode('utf-8').split(':', 1)
+        except (ValueError, UnicodeDecodeError):
+            raise ErroPedido(401, "Credenciais inválidas")
+
+        usuario = self.server.db_manager.autenticar_usuario(
+            username, password, verificacoes_recentes=self.server.credenciais
+        )
+        if usuario is None:
+            raise ErroPedido(401, "Credenciais inválidas")
+        return usuario
+
+    def _ler_json(self):
+        try:
+            tamanho = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            raise ErroPedido(400, "Content-Length inválido")
+        if not tamanho:
+            return {}
+        if tamanho > MAX_CORPO_BYTES:
+            # O corpo não é lido: a ligação fecha-se depois da resposta
+            self.close_connection = True
+            raise ErroPedido(413, f"Corpo acima do máximo de {MAX_CORPO_BYTES // 1024} KB")
+        try:
+            corpo = json.loads(self.rfile.read(tamanho).decode('utf-8'))
+        except (ValueError, UnicodeDecodeError):
+            raise ErroPedido(400, "Corpo JSON inválido")
+        if not isinstance(corpo, dict):
+            raise ErroPedido(400, "O corpo deve ser um objeto JSON")
+        return corpo
+
+    def _responder_json(self, status, dados):
+        conteudo = json.dumps(dados, default=str, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(conteudo)))
+        if status == 401:
+            self.send_header('WWW-Authenticate', 'Basic realm="vf_perda"')
+        self.end_headers()
+        self.wfile.write(conteudo)
+
+    def _iniciar_zip(self, nome_arquivo, cabecalhos=None):
+        """Envia os cabeçalhos da resposta ZIP e devolve o fluxo chunked para o ZipFile."""
+        return self._iniciar_fluxo(nome_arquivo, 'application/zip', cabecalhos)
+
+    def _iniciar_fluxo(self, nome_arquivo, tipo_conteudo, cabecalhos=None):
+        """Envia os cabeçalhos de um anexo em Transfer-Encoding: chunked e devolve o fluxo."""
+        self.send_response(200)
+        self.send_header('Content-Type', tipo_conteudo)
+        self.send_header('Content-Disposition', f'attachment; filename="{nome_arquivo}"')
+        self.send_header('Transfer-Encoding', 'chunked')
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, str(valor))
+        self.end_headers()
+        self._resposta_iniciada = True
+        return FluxoChunked(self.wfile)
+
+    # --- Rotas ---
+    def _rota_saude(self, usuario, consulta, corpo):
+        self._responder_json(200, {'estado': 'ok', 'versao_dados': self.server.db_manager.obter_versao_dados()})
+
+    def _rota_contagens(self, usuario, consulta, corpo):
+        coluna = consulta.get('coluna', 'PT').upper()
+        if coluna not in ("PT", "LOCALIDADE"):
+            raise ErroPedido(400, "'coluna' deve ser PT ou LOCALIDADE")
+        contagens = self.server.db_manager.obter_valores_unicos_com_contagem(coluna)
+        self._responder_json(200, {
+            'coluna': coluna,
+            'valores': [{'valor': valor, 'disponiveis': int(qtd)} for valor, qtd in contagens.items()]
+        })
+
+    def _rota_historico(self, usuario, consulta, corpo):
+        self._responder_json(200, {'historico': _registros(self.server.db_manager.obter_historico_geracao())})
+
+    def _rota_simular(self, usuario, consulta, corpo):
+        resultado = self.server.db_manager.simular_folhas_trabalho(*parametros_geracao(corpo))
+        if resultado is None:
+            raise ErroPedido(500, "Falha na simulação")
+        resultado['preview'] = _registros(resultado.pop('preview_df'))
+        self._responder_json(200, resultado)
+
+    def _rota_gerar(self, usuario, consulta, corpo):
+        import utils
+        parametros = parametros_geracao(corpo)
+        try:
+            df_folhas, cils_nao_encontrados = self.server.db_manager.gerar_folhas_trabalho(
+                *parametros, user_name=usuario['nome'], propagar_erros=True
+            )
+        except Exception as e:
+            # Bloqueio/BD indisponível: 409/503; o resto segue para o 500 de _despachar
+            raise erro_geracao(e) or e
+        if df_folhas is None or df_folhas.empty:
+            raise ErroPedido(404, "Nenhuma folha gerada: sem registros disponíveis para os critérios indicados")
+
+        tipo, valor, _, _, _, criterio_tipo, criterio_valor = parametros
+        rotulo_tipo, rotulo_valor = criterio_tipo or tipo, criterio_valor or valor or "avulso"
+        if consulta.get('formato') == 'json':
+            self._responder_json(200, {
+                'folhas': int(df_folhas['FOLHA'].max()),
+                'registros': _registros(df_folhas),
+                'cils_nao_encontrados': cils_nao_encontrados
+            })
+            return
+
+        nome_zip = (
+            f"Folhas_{rotulo_tipo}_{utils.sanitizar_nome_arquivo(rotulo_valor)}_"
+            f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+        )
+        fluxo = self._iniciar_zip(nome_zip, {
+            'X-Folhas': int(df_folhas['FOLHA'].max()),
+            'X-Registros': len(df_folhas),
+            'X-Cils-Nao-Encontrados': len(cils_nao_encontrados or [])
+        })
+        with ZipFile(fluxo, 'w') as zip_file:
+            utils.escrever_folhas_zip(zip_file, df_folhas, rotulo_tipo, rotulo_valor)
+        fluxo.fechar()
+
+    def _rota_gerar_lote(self, usuario, consulta, corpo):
+        """Gera para cada valor em sequência; o ZIP tem uma pasta por valor e um resumo.json."""
+        import utils
+        tipo, _, folhas, nibs, cils, criterio_tipo, criterio_valor = parametros_geracao(corpo, exigir_valor=False)
+        valores = corpo.get('valores')
+        if tipo == "AVULSO" or not isinstance(valores, list) or not valores:
+            raise ErroPedido(400, "'valores' deve ser uma lista de PTs ou localidades (tipos PT e LOCALIDADE)")
+        if len(valores) > MAX_VALORES_LOTE:
+            raise ErroPedido(400, f"No máximo {MAX_VALORES_LOTE} valores por pedido")
+
+        # Os cabeçalhos seguem antes das gerações: o resultado de cada valor vai no resumo.json
+        fluxo = self._iniciar_zip(f"Folhas_{tipo}_lote_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.zip")
+        resumo = []
+        with ZipFile(fluxo, 'w') as zip_file:
+            for valor in valores:
+                try:
+                    df_folhas, _ = self.server.db_manager.gerar_folhas_trabalho(
+                        tipo, valor, folhas, nibs, None, criterio_tipo, criterio_valor,
+                        user_name=usuario['nome'], propagar_erros=True
+                    )
+                except Exception as e:
+                    # Cabeçalhos já enviados: a falha fica no resumo e o lote continua
+                    erro = erro_geracao(e)
+                    resumo.append({'valor': valor, 'estado': 'erro', 'status': erro.status if erro else 500})
+                    continue
+                if df_folhas is None or df_folhas.empty:
+                    resumo.append({'valor': valor, 'estado': 'sem_folhas'})
+                else:
+                    rotulo_tipo, rotulo_valor = criterio_tipo or tipo, criterio_valor or valor
+                    pasta = f"{utils.sanitizar_nome_arquivo(str(valor))}/"
+                    utils.escrever_folhas_zip(zip_file, df_folhas, rotulo_tipo, rotulo_valor, pasta=pasta)
+                    resumo.append({
+                        'valor': valor,
+                        'estado': 'gerado',
+                        'folhas': int(df_folhas['FOLHA'].max()),
+                        'registros': len(df_folhas)
+                    })
+                fluxo.flush()
+            zip_file.writestr("resumo.json", json.dumps(resumo, ensure_ascii=False, indent=2))
+        fluxo.fechar()
+
+
+    def _rota_relatorio(self, usuario, consulta, corpo):
+        """Relatório detalhado completo em CSV (gzip por padrão), em fluxo do COPY para a resposta."""
+        filtros = {coluna: consulta.get(coluna) for coluna in COLUNAS_FILTRO_RELATORIO if consulta.get(coluna)}
+        comprimir = consulta.get('comprimir', '1') != '0'
+        nome_arquivo = f"relatorio_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv{'.gz' if comprimir else ''}"
+        fluxo = self._iniciar_fluxo(nome_arquivo, 'application/gzip' if comprimir else 'text/csv; charset=utf-8')
+        if self.server.db_manager.exportar_relatorio_detalhado(filtros, fluxo, comprimir=comprimir) is None:
+            # Erro registado no log; a ligação é interrompida para o cliente não aceitar um CSV truncado
+            self.close_connection = True
+            return
+        fluxo.fechar()
+
+
+def criar_servidor(db_manager, host=HOST_PADRAO, porta=PORTA_PADRAO):
+    """Servidor HTTP com uma thread por pedido, partilhando o gestor (e o pool de conexões)."""
+    servidor = ThreadingHTTPServer((host, porta), ManipuladorAPI)
+    servidor.daemon_threads = True
+    servidor.db_manager = db_manager
+    servidor.credenciais = CacheCredenciais()
+    return servidor
+
+
+_servidor_local = None
+_lock_servidor_local = threading.Lock()
+
+def iniciar_servidor_local(db_manager):
+    """Serve a API numa thread do processo atual (uma vez), para as exportações grandes da app.
+    
+    Com a porta ocupada assume-se que a API já corre noutro processo (ex.: python api.py).
+    """
+    global _servidor_local
+    with _lock_servidor_local:
+        if _servidor_local is not None:
+            return
+        try:
+            _servidor_local = criar_servidor(db_manager)
+        except OSError as e:
+            logger.info(f"API local não iniciada em {HOST_PADRAO}:{PORTA_PADRAO} (já em uso?): {e}")
+            _servidor_local = False
+            return
+        threading.Thread(target=_servidor_local.serve_forever, daemon=True, name="api-local").start()
+        logger.info(f"API local disponível em http://{HOST_PADRAO}:{PORTA_PADRAO}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API HTTP JSON para geração de folhas.")
+    parser.add_argument("--host", default=HOST_PADRAO)
+    parser.add_argument("--porta", type=int, default=PORTA_PADRAO)
+    args = parser.parse_args()
+
+    from database import obter_gestor_bd, POSTGRES_URL
+    servidor = criar_servidor(obter_gestor_bd(POSTGRES_URL), args.host, args.porta)
+    logger.info(f"API disponível em http://{args.host}:{args.porta}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -9,9 +9,9 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.append(current_dir)
 
-from database import PostgresDatabaseManager, POSTGRES_URL
+from database import obter_gestor_bd, POSTGRES_URL
+from utils import notificar_streamlit
 from views.login import login_page
-from views.admin import manager_page
 
 # Configuração da página - DEVE SER A PRIMEIRA CHAMADA STREAMLIT
 st.set_page_config(
@@ -35,19 +35,18 @@ def main():
 
     # Configuração do DB
     try:
-        db_manager = PostgresDatabaseManager(POSTGRES_URL)
+        # Gestor partilhado pelo processo: o pool, o schema e as conexões aquecidas sobrevivem às reexecuções
+        db_manager = obter_gestor_bd(POSTGRES_URL, notificador=notificar_streamlit)
         
         # Mostrar status da conexão no sidebar apenas se autenticado
         if st.session_state['authenticated']:
-            try:
-                with db_manager.engine.connect() as conn:
-                    from sqlalchemy import text
-                    count_result = conn.execute(text("SELECT COUNT(*) FROM bd"))
-                    record_count = count_result.scalar()
-                    st.sidebar.success(f"✅ Conectado ao Banco de Dados")
-                    st.sidebar.info(f"📊 Registros na BD: {record_count:,}")
-            except Exception as e:
-                st.sidebar.error(f"⚠️ Aviso de conexão: {e}")
+            # Contador mantido pelas importações, em cache pela versão dos dados (sem COUNT(*) por execução)
+            record_count = db_manager.contar_registros_bd()
+            if record_count is None:
+                st.sidebar.error("⚠️ Aviso de conexão: não foi possível obter o número de registros")
+            else:
+                st.sidebar.success(f"✅ Conectado ao Banco de Dados")
+                st.sidebar.info(f"📊 Registros na BD: {record_count:,}")
             
     except Exception as e:
         st.error(f"O aplicativo não pôde se conectar ao banco de dados. Verifique os Secrets.")
@@ -56,6 +55,8 @@ def main():
 
     # Roteamento Principal
     if st.session_state['authenticated']:
+        # Importado só após o login: a página de login não carrega dashboards nem relatórios
+        from views.admin import manager_page
         manager_page(db_manager)
     else:
         login_page(db_manager)
@@ -0,0 +1,3 @@
+"""
+Benchmarks do sistema (dados sintéticos contra um PostgreSQL local).
+"""
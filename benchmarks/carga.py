@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""Teste de carga: N operadores concorrentes a gerar folhas de trabalho.
+
+Cada sessão simula o percurso de um assistente no início do turno: login,
+carregamento das listas, simulação, geração e download do ZIP. A BD deve ter
+sido preparada antes (por exemplo com benchmarks.executar) e é usada em exclusivo:
+o estado 'prog' é reposto no início do teste.
+
+Uso:
+    DATABASE_URL=postgresql+psycopg2://postgres@localhost/vf_bench \\
+        python -m benchmarks.carga --sessoes 30 --rondas 3
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from benchmarks.executar import DIRETORIO_RESULTADOS, salvar, _commit_atual
+
+
+class Medicoes:
+    """Latências por etapa e tempos de espera pelo pool, partilhados entre as sessões."""
+
+    def __init__(self):
+        self.etapas = defaultdict(list)
+        self.espera_pool = []
+        self.erros = Counter()
+        self.nibs_atribuidos = Counter()
+        self._lock = threading.Lock()
+
+    def registrar(self, etapa, duracao):
+        with self._lock:
+            self.etapas[etapa].append(duracao)
+
+    def registrar_espera(self, duracao):
+        with self._lock:
+            self.espera_pool.append(duracao)
+
+    def registrar_erro(self, etapa):
+        with self._lock:
+            self.erros[etapa] += 1
+
+    def registrar_nibs(self, nibs):
+        with self._lock:
+            self.nibs_atribuidos.update(nibs)
+
+
+def medir_espera_pool(engine, medicoes):
+    """Mede o tempo de obtenção de cada conexão do pool (inclui abrir conexões novas)."""
+    pool = engine.pool
+    obter_original = pool._do_get
+
+    def _do_get():
+        inicio = time.perf_counter()
+        try:
+            return obter_original()
+        finally:
+            medicoes.registrar_espera(time.perf_counter() - inicio)
+
+    pool._do_get = _do_get
+
+
+class MonitorBloqueios(threading.Thread):
+    """Amostra periodicamente pg_stat_activity à procura de sessões à espera de bloqueios."""
+
+    def __init__(self, url, intervalo=0.05):
+        super().__init__(daemon=True)
+        self.engine = create_engine(url, pool_size=1)
+        self.intervalo = intervalo
+        self.amostras = 0
+        self.amostras_com_espera = 0
+        self.max_em_espera = 0
+        self.deadlocks = 0
+        self._parar = threading.Event()
+
+    def _contar_deadlocks(self, conn):
+        return conn.execute(text(
+            "SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()"
+        )).scalar() or 0
+
+    def run(self):
+        consulta = text("""
+            SELECT COUNT(*) FROM pg_stat_activity
+            WHERE datname = current_database() AND wait_event_type = 'Lock'
+        """)
+        with self.engine.connect() as conn:
+            deadlocks_inicio = self._contar_deadlocks(conn)
+            while not self._parar.is_set():
+                em_espera = conn.execute(consulta).scalar()
+                conn.rollback()
+                self.amostras += 1
+                if em_espera:
+                    self.amostras_com_espera += 1
+                    self.max_em_espera = max(self.max_em_espera, em_espera)
+                self._parar.wait(self.intervalo)
+            # As estatísticas do servidor são atualizadas com algum atraso
+            time.sleep(1)
+            conn.execute(text("SELECT pg_stat_clear_snapshot()"))
+            self.deadlocks = self._contar_deadlocks(conn) - deadlocks_inicio
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+        self.engine.dispose()
+
+
+def sessao_operador(db_manager_fabrica, medicoes, pts, args, numero):
+    """Percurso completo de um operador; repete 'rondas' gerações."""
+    import utils
+    gerador = random.Random(args.seed + numero)
+
+    def etapa(nome, funcao):
+        inicio = time.perf_counter()
+        try:
+            return funcao()
+        except Exception:
+            medicoes.registrar_erro(nome)
+            raise
+        finally:
+            medicoes.registrar(nome, time.perf_counter() - inicio)
+
+    db_manager = db_manager_fabrica()
+    usuario = etapa('login', lambda: db_manager.autenticar_usuario(args.usuario, args.senha))
+    if not usuario:
+        medicoes.registrar_erro('login')
+        return
+
+    for _ in range(args.rondas):
+        contagem = etapa('listas', lambda: db_manager.obter_valores_unicos_com_contagem('PT'))
+        etapa('listas_criterio', lambda: db_manager.obter_valores_unicos('criterio'))
+
+        # Operadores concentrados nos PTs mais volumosos (maior contenção)
+        pt = gerador.choice(pts)
+        if not contagem.get(pt):
+            continue
+        parametros = ('PT', pt, args.folhas, args.nibs, None, None, None)
+        etapa('simular', lambda: db_manager.simular_folhas_trabalho(*parametros))
+        df_folhas, _ = etapa('gerar', lambda: db_manager.gerar_folhas_trabalho(*parametros, user_name=f"carga_{numero}"))
+        if df_folhas is None:
+            # gerar_folhas_trabalho captura o erro (ex.: deadlock) e devolve None
+            medicoes.registrar_erro('gerar')
+            continue
+        if df_folhas.empty:
+            continue
+        medicoes.registrar_nibs(df_folhas['nib'].unique().tolist())
+        etapa('download', lambda: utils.generate_csv_zip(df_folhas, args.nibs, 'PT', pt))
+
+
+def percentis(duracoes):
+    valores = np.array(duracoes) * 1000
+    if len(valores) == 0:
+        return {}
+    return {
+        'chamadas': int(len(valores)),
+        'p50_ms': float(np.percentile(valores, 50)),
+        'p95_ms': float(np.percentile(valores, 95)),
+        'p99_ms': float(np.percentile(valores, 99)),
+        'max_ms': float(valores.max())
+    }
+
+
+def executar(args):
+    import database
+    medicoes = Medicoes()
+
+    # Estado inicial conhecido: nenhum registro em 'prog'
+    preparacao = database.PostgresDatabaseManager(database.POSTGRES_URL)
+    preparacao.resetar_estado('AVULSO', '')
+    contagem = preparacao.obter_valores_unicos_com_contagem('PT')
+    pts = sorted(contagem, key=contagem.get, reverse=True)[:args.pts]
+
+    if args.engine_por_sessao:
+        # Comportamento anterior da app: cada sessão cria o seu gestor (e o seu pool)
+        def fabrica():
+            db_manager = database.PostgresDatabaseManager(database.POSTGRES_URL)
+            medir_espera_pool(db_manager.engine, medicoes)
+            return db_manager
+    else:
+        medir_espera_pool(preparacao.engine, medicoes)
+        fabrica = lambda: preparacao
+
+    monitor = MonitorBloqueios(database.POSTGRES_URL)
+    monitor.start()
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessoes, thread_name_prefix="operador") as executor:
+        futuros = [executor.submit(sessao_operador, fabrica, medicoes, pts, args, i) for i in range(args.sessoes)]
+        falhas = sum(1 for f in futuros if f.exception() is not None)
+    duracao_total = time.perf_counter() - inicio
+    monitor.parar()
+
+    duplicados = {nib: n for nib, n in medicoes.nibs_atribuidos.items() if n > 1}
+    geracoes = len(medicoes.etapas['gerar'])
+    resultado = {
+        'data': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit_atual(),
+        'linhas': int(sum(contagem.values())),
+        'sessoes': args.sessoes,
+        'rondas': args.rondas,
+        'engine_por_sessao': args.engine_por_sessao,
+        'duracao_s': duracao_total,
+        'geracoes_por_segundo': geracoes / duracao_total if duracao_total else 0.0,
+        'sessoes_com_falha': falhas,
+        'erros_por_etapa': dict(medicoes.erros),
+        'espera_pool': percentis(medicoes.espera_pool),
+        'bloqueios': {
+            'amostras': monitor.amostras,
+            'percentual_amostras_com_espera': 100.0 * monitor.amostras_com_espera / max(monitor.amostras, 1),
+            'max_sessoes_em_espera': monitor.max_em_espera,
+            'deadlocks': monitor.deadlocks
+        },
+        'nibs_atribuidos': len(medicoes.nibs_atribuidos),
+        'nibs_duplicados': len(duplicados),
+        'exemplos_duplicados': dict(list(duplicados.items())[:10]),
+        'cenarios': {etapa: percentis(duracoes) for etapa, duracoes in medicoes.etapas.items()}
+    }
+    return resultado
+
+
+def imprimir(resultado):
+    print(f"Sessões: {resultado['sessoes']} x {resultado['rondas']} rondas em {resultado['duracao_s']:.1f}s "
+          f"({resultado['geracoes_por_segundo']:.2f} gerações/s)")
+    for etapa, valores in resultado['cenarios'].items():
+        print(f"  {etapa:<16} n={valores['chamadas']:<5} p50 {valores['p50_ms']:8.1f} ms  "
+              f"p95 {valores['p95_ms']:8.1f} ms  p99 {valores['p99_ms']:8.1f} ms")
+    espera = resultado['espera_pool']
+    if espera:
+        print(f"  espera do pool   p50 {espera['p50_ms']:.2f} ms  p99 {espera['p99_ms']:.2f} ms  max {espera['max_ms']:.2f} ms")
+    bloqueios = resultado['bloqueios']
+    print(f"  bloqueios: {bloqueios['percentual_amostras_com_espera']:.1f}% das amostras com espera "
+          f"(máx. {bloqueios['max_sessoes_em_espera']} sessões), {bloqueios['deadlocks']} deadlocks")
+    print(f"  NIBs atribuídos: {resultado['nibs_atribuidos']}, duplicados: {resultado['nibs_duplicados']}")
+    if resultado['erros_por_etapa']:
+        print(f"  erros: {resultado['erros_por_etapa']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga com operadores concorrentes.")
+    parser.add_argument("--sessoes", type=int, default=20)
+    parser.add_argument("--rondas", type=int, default=3, help="Gerações por sessão")
+    parser.add_argument("--pts", type=int, default=5, help="PTs mais volumosos disputados pelas sessões")
+    parser.add_argument("--folhas", type=int, default=2)
+    parser.add_argument("--nibs", type=int, default=20)
+    parser.add_argument("--usuario", default="AssAdm")
+    parser.add_argument("--senha", default="adm123")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--engine-por-sessao", action="store_true",
+                        help="Um gestor (e pool) por sessão, como app.main fazia antes de obter_gestor_bd")
+    parser.add_argument("--url", help="URL do PostgreSQL (por padrão, a variável DATABASE_URL)")
+    parser.add_argument("--saida", help="Ficheiro JSON de resultados")
+    args = parser.parse_args()
+
+    if args.url:
+        os.environ["DATABASE_URL"] = args.url
+    if not os.environ.get("DATABASE_URL"):
+        sys.exit("Indique a BD de teste com --url ou DATABASE_URL")
+
+    resultado = executar(args)
+    imprimir(resultado)
+    if args.saida is None:
+        data = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        args.saida = os.path.join(DIRETORIO_RESULTADOS, f"carga_{data}_{resultado['commit'] or 'local'}_{args.sessoes}.json")
+    print(f"Resultados salvos em {salvar(resultado, args.saida)}")
+
+
+if __name__ == "__main__":
+    main()
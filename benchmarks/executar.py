@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""Executa os cenários de benchmark contra um PostgreSQL local com dados sintéticos.
+
+A BD indicada é usada em exclusivo: a tabela bd é substituída pela importação.
+
+Uso:
+    DATABASE_URL=postgresql+psycopg2://postgres@localhost/vf_bench \\
+        python -m benchmarks.executar --linhas 100000 --iteracoes 5
+    python -m benchmarks.executar --comparar benchmarks/resultados/a.json benchmarks/resultados/b.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import datetime
+import resource
+import tracemalloc
+import subprocess
+import numpy as np
+
+from benchmarks import gerador_bd
+
+DIRETORIO_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIRETORIO_RESULTADOS = os.path.join(DIRETORIO_RAIZ, "benchmarks", "resultados")
+
+# Módulos cujo tempo de importação (processo novo) é medido, e dependências que não devem carregar
+MODULOS_IMPORTACAO = {
+    'database': "import database",
+    'cli': "import cli",
+    'api': "import api",
+    'pagina_login': "import streamlit; import app",
+    'pagina_gestao': "import streamlit; import app; import views.admin",
+}
+DEPENDENCIAS_PESADAS = ['streamlit', 'plotly.express', 'chardet', 'openpyxl']
+
+
+# --- Medição ---
+def medir(funcao, iteracoes=5, linhas=None, preparar=None, memoria=True):
+    """Executa 'funcao' várias vezes e devolve latências (ms), vazão e pico de memória.
+    
+    O tracemalloc abranda muito código Python (ex.: to_sql); com memoria=False o pico não é medido.
+    """
+    duracoes = []
+    pico = None
+    if memoria:
+        tracemalloc.start()
+    try:
+        for _ in range(iteracoes):
+            if preparar:
+                preparar()
+            inicio = time.perf_counter()
+            funcao()
+            duracoes.append(time.perf_counter() - inicio)
+        if memoria:
+            _, pico = tracemalloc.get_traced_memory()
+    finally:
+        if memoria:
+            tracemalloc.stop()
+
+    duracoes_ms = np.array(duracoes) * 1000
+    resultado = {
+        'iteracoes': iteracoes,
+        'media_ms': float(duracoes_ms.mean()),
+        'p50_ms': float(np.percentile(duracoes_ms, 50)),
+        'p95_ms': float(np.percentile(duracoes_ms, 95)),
+        'p99_ms': float(np.percentile(duracoes_ms, 99)),
+        'max_ms': float(duracoes_ms.max()),
+        'pico_memoria_mb': pico / (1024 * 1024) if pico is not None else None
+    }
+    if linhas:
+        resultado['linhas_por_segundo'] = linhas / (duracoes_ms.mean() / 1000)
+    return resultado
+
+
+def limpar_caches(db_manager):
+    """Força o cálculo a partir da BD: esvazia st.cache_data e o cache em camadas (mantido ativo)."""
+    import streamlit as st
+    st.cache_data.clear()
+    if db_manager.cache_consultas is not None:
+        db_manager.cache_consultas.limpar()
+
+
+def medir_importacoes(iteracoes=5):
+    """Tempo de importação de cada módulo num processo Python novo (arranque a frio).
+    
+    Regista também as dependências pesadas carregadas, para detetar importações que deixaram de ser preguiçosas.
+    """
+    resultados = {}
+    for nome, instrucao in MODULOS_IMPORTACAO.items():
+        codigo = (
+            "import sys, json, time\n"
+            "inicio = time.perf_counter()\n"
+            f"{instrucao}\n"
+            "duracao = time.perf_counter() - inicio\n"
+            f"print(json.dumps([duracao, [m for m in {DEPENDENCIAS_PESADAS!r} if m in sys.modules]]))"
+        )
+        duracoes, carregadas = [], []
+        for _ in range(iteracoes):
+            saida = subprocess.run(
+                [sys.executable, "-c", codigo], cwd=DIRETORIO_RAIZ, capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+            duracao, carregadas = json.loads(saida)
+            duracoes.append(duracao)
+        duracoes_ms = np.array(duracoes) * 1000
+        resultados[f"importacao_{nome}"] = {
+            'iteracoes': iteracoes,
+            'media_ms': float(duracoes_ms.mean()),
+            'p50_ms': float(np.percentile(duracoes_ms, 50)),
+            'max_ms': float(duracoes_ms.max()),
+            'dependencias_carregadas': carregadas
+        }
+        print(f"  importação {nome}: p50 {resultados[f'importacao_{nome}']['p50_ms']:.0f} ms "
+              f"(carrega: {', '.join(carregadas) or 'nenhuma'})")
+    return resultados
+
+
+# --- Cenários ---
+def cenarios(db_manager, pt_exemplo, iteracoes):
+    """Cenários de leitura e escrita sobre a BD já importada: {nome: resultado de medir()}."""
+    resultados = {}
+    frio = lambda: limpar_caches(db_manager)
+
+    leituras = {
+        'valores_unicos_com_contagem_pt': lambda: db_manager.obter_valores_unicos_com_contagem('PT'),
+        'catalogo_filtros': lambda: db_manager.obter_catalogo_filtros(),
+        'estatisticas_gerais': lambda: db_manager.obter_estatisticas_gerais(),
+        'metricas_operacionais': lambda: db_manager.obter_metricas_operacionais(),
+        'dashboard_criterio': lambda: db_manager.obter_dados_para_dashboard('Criterio', None),
+        'dashboard_anomalia': lambda: db_manager.obter_dados_para_dashboard('Anomalia', None),
+        'densidade_geografica': lambda: db_manager.obter_densidade_geografica(0.01),
+        'cubo_pt_criterio': lambda: db_manager.consultar_cubo(['pt', 'criterio']),
+        'relatorio_resumo': lambda: db_manager.resumir_relatorio({'pt': pt_exemplo}),
+        'relatorio_pagina': lambda: db_manager.obter_pagina_relatorio({}, 'valor_desc', 100),
+    }
+    for nome, funcao in leituras.items():
+        resultados[f"{nome}_frio"] = medir(funcao, iteracoes, preparar=frio)
+        resultados[f"{nome}_quente"] = medir(funcao, iteracoes)
+        print(f"  {nome}: frio p50 {resultados[f'{nome}_frio']['p50_ms']:.1f} ms, "
+              f"quente p50 {resultados[f'{nome}_quente']['p50_ms']:.2f} ms")
+
+    relatorio = db_manager.gerar_relatorio_detalhado({'pt': pt_exemplo})
+    resultados['relatorio_detalhado_pt'] = medir(
+        lambda: db_manager.gerar_relatorio_detalhado({'pt': pt_exemplo}), iteracoes, linhas=len(relatorio)
+    )
+    destino = os.path.join(tempfile.gettempdir(), "vf_perda_exportacao_benchmark.csv.gz")
+    resultados['exportacao_completa'] = medir(
+        lambda: db_manager.exportar_relatorio_detalhado({}, destino), max(1, iteracoes // 2)
+    )
+    os.remove(destino)
+
+    parametros = ('PT', pt_exemplo, 5, 20, None, None, None)
+    resultados['simular_folhas'] = medir(lambda: db_manager.simular_folhas_trabalho(*parametros), iteracoes)
+    # O PT é reposto antes de cada geração, para que todas as iterações partam do mesmo estado
+    resultados['gerar_folhas'] = medir(
+        lambda: db_manager.gerar_folhas_trabalho(*parametros, user_name='benchmark'),
+        iteracoes,
+        preparar=lambda: db_manager.resetar_estado('PT', pt_exemplo)
+    )
+    resultados['resetar_estado_pt'] = medir(lambda: db_manager.resetar_estado('PT', pt_exemplo), iteracoes)
+    return resultados
+
+
+def executar(args):
+    print("Medindo tempos de importação...")
+    importacoes = medir_importacoes(args.iteracoes)
+    if args.so_importacoes:
+        return {
+            'data': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': _commit_atual(),
+            'linhas': 0,
+            'cenarios': importacoes
+        }
+
+    import streamlit as st  # noqa: F401 (como na app: os métodos de leitura usam st.cache_data)
+    import database
+
+    print(f"Gerando {args.linhas} linhas (seed {args.seed})...")
+    buffer = io.BytesIO()
+    gerador_bd.gerar_csv(buffer, args.linhas, seed=args.seed, num_pts=args.pts, fracao_prog=args.fracao_prog)
+
+    db_manager = database.PostgresDatabaseManager(database.POSTGRES_URL)
+    resultados = dict(importacoes)
+
+    print("Importando...")
+    def importar():
+        buffer.seek(0)
+        if not db_manager.importar_csv(buffer, 'BD'):
+            raise RuntimeError("Falha na importação do CSV sintético")
+    # A memória da importação vem do perfil por fases (RSS)
+    resultados['importar_csv'] = medir(importar, iteracoes=1, linhas=args.linhas, memoria=False)
+    print(f"  importar_csv: {resultados['importar_csv']['linhas_por_segundo']:,.0f} linhas/s")
+    fases = db_manager.obter_execucoes_importacao(1).iloc[0]['fases']
+    resultados['importar_csv']['fases'] = fases
+    for fase in fases:
+        print(f"    {fase['fase']:<18} {fase['duracao_s']:8.2f} s  cpu {fase['cpu_s']:7.2f} s")
+    buffer = None
+
+    # PT mais frequente (o pior caso para geração e relatório)
+    contagem = db_manager.obter_valores_unicos_com_contagem('PT')
+    pt_exemplo = max(contagem, key=contagem.get)
+    resultados.update(cenarios(db_manager, pt_exemplo, args.iteracoes))
+
+    return {
+        'data': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit_atual(),
+        'linhas': args.linhas,
+        'seed': args.seed,
+        'iteracoes': args.iteracoes,
+        'pico_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'cenarios': resultados
+    }
+
+
+# --- Persistência e Comparação ---
+def _commit_atual():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def salvar(resultado, caminho=None):
+    os.makedirs(DIRETORIO_RESULTADOS, exist_ok=True)
+    if caminho is None:
+        data = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        caminho = os.path.join(DIRETORIO_RESULTADOS, f"{data}_{resultado['commit'] or 'local'}_{resultado['linhas']}.json")
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        json.dump(resultado, arquivo, indent=2, ensure_ascii=False)
+    return caminho
+
+
+def comparar(caminho_base, caminho_novo, metrica='p50_ms'):
+    """Imprime a variação de 'metrica' por cenário entre dois resultados."""
+    with open(caminho_base, encoding='utf-8') as arquivo:
+        base = json.load(arquivo)
+    with open(caminho_novo, encoding='utf-8') as arquivo:
+        novo = json.load(arquivo)
+
+    print(f"{'cenário':<40} {'base':>12} {'novo':>12} {'variação':>10}")
+    for nome, valores in novo['cenarios'].items():
+        anterior = base['cenarios'].get(nome, {}).get(metrica)
+        atual = valores.get(metrica)
+        if anterior is None or atual is None:
+            print(f"{nome:<40} {'-':>12} {atual or 0:>12.2f} {'novo':>10}")
+            continue
+        variacao = (atual - anterior) / anterior * 100 if anterior else 0.0
+        print(f"{nome:<40} {anterior:>12.2f} {atual:>12.2f} {variacao:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de importação, geração e dashboard.")
+    parser.add_argument("--linhas", type=int, default=100000, help="Linhas do ficheiro sintético (10k a 10M)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--pts", type=int, default=400)
+    parser.add_argument("--fracao-prog", type=float, default=0.1)
+    parser.add_argument("--iteracoes", type=int, default=5)
+    parser.add_argument("--url", help="URL do PostgreSQL (por padrão, a variável DATABASE_URL)")
+    parser.add_argument("--saida", help="Ficheiro JSON de resultados")
+    parser.add_argument("--comparar", nargs=2, metavar=("BASE", "NOVO"), help="Compara dois resultados salvos")
+    parser.add_argument("--so-importacoes", action="store_true", help="Mede apenas os tempos de importação (sem BD)")
+    args = parser.parse_args()
+
+    if args.comparar:
+        comparar(*args.comparar)
+        return
+
+    if args.url:
+        os.environ["DATABASE_URL"] = args.url
+    if not os.environ.get("DATABASE_URL") and not args.so_importacoes:
+        sys.exit("Indique a BD de benchmark com --url ou DATABASE_URL")
+
+    resultado = executar(args)
+    print(f"Resultados salvos em {salvar(resultado, args.saida)}")
+
+
+if __name__ == "__main__":
+    main()
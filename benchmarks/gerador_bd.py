@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Gerador determinístico de ficheiros BD sintéticos (31 colunas, sem cabeçalho, separador ';').
+
+Uso:
+    python -m benchmarks.gerador_bd --linhas 1000000 --seed 42 --saida bd_1m.csv
+"""
+import argparse
+import contextlib
+import numpy as np
+import pandas as pd
+
+# Centros aproximados (lat, long) das localidades; as restantes usam a ilha mais próxima
+CENTROS_GEO = [
+    ("PRAIA", 14.93, -23.51), ("MINDELO", 16.89, -24.98), ("ESPARGOS", 16.75, -22.95),
+    ("SAL REI", 16.18, -22.92), ("ASSOMADA", 15.10, -23.68), ("SAO FILIPE", 14.90, -24.50),
+    ("TARRAFAL", 15.28, -23.75), ("PORTO NOVO", 17.02, -25.06), ("RIBEIRA GRANDE", 17.18, -25.07),
+    ("PEDRA BADEJO", 15.14, -23.53), ("CALHETA", 15.19, -23.59), ("SANTA CATARINA", 15.10, -23.67)
+]
+
+CRITERIOS = ["SUSP", "NORMAL", "FRAUDE", "CONSUMO ZERO", "LEITURA ESTIMADA", "OUTRO"]
+ANOMALIAS = ["NONE", "A01", "A02", "A05", "A10", "A13", "A22", "A31"]
+TIPOS_CLIENTE = ["DOMESTICO", "COMERCIAL", "INDUSTRIAL", "ESTADO", "SOCIAL"]
+ESTADOS_CONTRATO = ["ATIVO", "SUSPENSO", "CORTADO", "RESCINDIDO"]
+
+TAMANHO_BLOCO = 200000
+
+
+def _zipf(gerador, n, categorias, expoente=1.2):
+    """Amostra 'n' índices com distribuição enviesada (poucas categorias muito frequentes)."""
+    pesos = 1.0 / np.arange(1, categorias + 1) ** expoente
+    return gerador.choice(categorias, size=n, p=pesos / pesos.sum())
+
+
+def gerar_bloco(inicio, n, seed=42, num_pts=400, fracao_prog=0.1, fracao_sem_geo=0.3, cils_por_nib=3):
+    """Gera as linhas [inicio, inicio + n) como DataFrame de 31 colunas (determinístico por bloco)."""
+    gerador = np.random.default_rng([seed, inicio])
+    indices = np.arange(inicio, inicio + n)
+
+    # PT enviesado; cada PT pertence a uma localidade fixa
+    pt = _zipf(gerador, n, num_pts)
+    localidade_do_pt = np.random.default_rng(seed).integers(0, len(CENTROS_GEO), size=num_pts)
+    localidade = localidade_do_pt[pt]
+    nomes_localidade = np.array([c[0] for c in CENTROS_GEO], dtype=object)
+    centros_lat = np.array([c[1] for c in CENTROS_GEO])
+    centros_long = np.array([c[2] for c in CENTROS_GEO])
+
+    sem_geo = gerador.random(n) < fracao_sem_geo
+    lat = np.round(centros_lat[localidade] + gerador.normal(0, 0.03, n), 6).astype(object)
+    long = np.round(centros_long[localidade] + gerador.normal(0, 0.03, n), 6).astype(object)
+    lat[sem_geo] = ""
+    long[sem_geo] = ""
+
+    seq = gerador.integers(1, 999, n)
+    seq_txt = np.char.add("S", np.char.zfill(seq.astype(str), 3)).astype(object)
+    seq_txt[gerador.random(n) < 0.15] = ""
+
+    colunas = {
+        0: np.char.add("CIL", indices.astype(str)),
+        1: gerador.choice(["BT", "MT"], n, p=[0.95, 0.05]),
+        2: np.char.add("CT", gerador.integers(100000, 999999, n).astype(str)),
+        3: gerador.integers(0, 99999, n),
+        4: gerador.integers(1000, 9999, n),
+        5: gerador.choice(["M", "F"], n),
+        6: gerador.integers(1, 500, n),
+        7: np.round(gerador.lognormal(3.5, 1.0, n), 2),
+        8: gerador.choice(["NORMAL", "DIVIDA", "ACORDO"], n, p=[0.7, 0.2, 0.1]),
+        9: gerador.choice(["", "SIM"], n, p=[0.9, 0.1]),
+        10: np.char.add("NIB", (indices // cils_por_nib).astype(str)),
+        11: seq_txt,
+        12: nomes_localidade[localidade],
+        13: np.char.add("PT", pt.astype(str)),
+        14: gerador.integers(0, 50, n),
+        15: gerador.integers(1000, 9999, n),
+        16: gerador.choice(["UNI1", "UNI2", "UNI3"], n),
+        17: np.array(ESTADOS_CONTRATO, dtype=object)[_zipf(gerador, n, len(ESTADOS_CONTRATO))],
+        18: np.array(ANOMALIAS, dtype=object)[_zipf(gerador, n, len(ANOMALIAS), 1.5)],
+        19: indices,
+        20: gerador.choice(["ENERGIA", "AGUA"], n, p=[0.8, 0.2]),
+        21: np.char.add("CLIENTE ", indices.astype(str)),
+        22: np.array(CRITERIOS, dtype=object)[_zipf(gerador, n, len(CRITERIOS))],
+        23: np.array(TIPOS_CLIENTE, dtype=object)[_zipf(gerador, n, len(TIPOS_CLIENTE))],
+        24: gerador.choice(["T1", "T2"], n),
+        25: gerador.choice(["", "DIV"], n, p=[0.8, 0.2]),
+        26: gerador.choice(["MOD-A", "MOD-B", "MOD-C"], n),
+        27: lat,
+        28: long,
+        29: gerador.choice(["", "INSPECIONADO"], n, p=[0.9, 0.1]),
+        30: np.where(gerador.random(n) < fracao_prog, "prog", "")
+    }
+    return pd.DataFrame(colunas)
+
+
+def gerar_csv(destino, linhas, seed=42, **opcoes):
+    """Escreve 'linhas' registros em 'destino' (caminho ou ficheiro binário), em blocos."""
+    abrir = open(destino, 'wb') if isinstance(destino, str) else contextlib.nullcontext(destino)
+    with abrir as arquivo:
+        for inicio in range(0, linhas, TAMANHO_BLOCO):
+            bloco = gerar_bloco(inicio, min(TAMANHO_BLOCO, linhas - inicio), seed=seed, **opcoes)
+            bloco.to_csv(arquivo, sep=';', header=False, index=False, encoding='utf-8')
+    return destino
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera um ficheiro BD sintético para benchmarks.")
+    parser.add_argument("--linhas", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--pts", type=int, default=400, help="Número de PTs distintos")
+    parser.add_argument("--fracao-prog", type=float, default=0.1)
+    parser.add_argument("--saida", default="bd_sintetico.csv")
+    args = parser.parse_args()
+
+    gerar_csv(args.saida, args.linhas, seed=args.seed, num_pts=args.pts, fracao_prog=args.fracao_prog)
+    print(f"{args.linhas} linhas escritas em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import zlib
+import pickle
+import sqlite3
+import hashlib
+import functools
+import threading
+import contextlib
+import logging
+from collections import OrderedDict
+
+# Tentar importar o cliente Redis com fallback (camada compartilhada opcional)
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+TTL_PADRAO = 24 * 3600
+# Validade do bloqueio de cálculo: maior que o agregado mais lento, para não haver um segundo cálculo
+TTL_BLOQUEIO_PADRAO = 300
+
+# --- Serialização Compacta ---
+def serializar(valor):
+    """Serializa um valor com pickle e compressão zlib."""
+    return zlib.compress(pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL), 3)
+
+def desserializar(dados):
+    """Reverte a serialização feita por serializar().
+
+    Usa pickle: só deve ler dados escritos por esta aplicação (camadas em disco local ou
+    num Redis privado e de confiança; quem pode escrever no Redis pode executar código aqui).
+    """
+    return pickle.loads(zlib.decompress(dados))
+
+def montar_chave(prefixo, nome, args, kwargs):
+    """Monta uma chave curta e estável a partir do nome da função e dos argumentos."""
+    assinatura = repr((args, sorted(kwargs.items())))
+    resumo = hashlib.sha1(assinatura.encode('utf-8')).hexdigest()
+    return f"{prefixo}:{nome}:{resumo}"
+
+
+# --- Camada Local (em processo) ---
+class CacheLRU:
+    """Cache LRU em memória, limitado por número de itens e por tamanho em bytes."""
+
+    def __init__(self, max_itens=256, max_bytes=64 * 1024 * 1024):
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self._itens = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            dados, expira = item
+            if expira < time.time():
+                self._remover(chave)
+                return None
+            self._itens.move_to_end(chave)
+            return dados
+
+    def gravar(self, chave, dados, ttl=TTL_PADRAO):
+        with self._lock:
+            if chave in self._itens:
+                self._remover(chave)
+            self._itens[chave] = (dados, time.time() + ttl)
+            self._bytes += len(dados)
+            # Despejo dos itens menos usados recentemente
+            while self._itens and (len(self._itens) > self.max_itens or self._bytes > self.max_bytes):
+                self._remover(next(iter(self._itens)))
+
+    def _remover(self, chave):
+        dados, _ = self._itens.pop(chave)
+        self._bytes -= len(dados)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._bytes = 0
+
+
+# --- Camadas Compartilhadas (entre processos/réplicas) ---
+class CacheDisco:
+    """Armazenamento compartilhado em disco (SQLite) para processos no mesmo host."""
+
+    def __init__(self, caminho, max_bytes=512 * 1024 * 1024):
+        self.caminho = caminho
+        self.max_bytes = max_bytes
+        diretorio = os.path.dirname(os.path.abspath(caminho))
+        os.makedirs(diretorio, exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entradas (
+                    chave TEXT PRIMARY KEY,
+                    dados BLOB NOT NULL,
+                    tamanho INTEGER NOT NULL,
+                    expira REAL NOT NULL,
+                    acesso REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entradas_acesso ON entradas (acesso)")
+            conn.execute("CREATE TABLE IF NOT EXISTS bloqueios (chave TEXT PRIMARY KEY, expira REAL NOT NULL)")
+
+    @contextlib.contextmanager
+    def _conectar(self):
+        conn = sqlite3.connect(self.caminho, timeout=10, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def obter(self, chave):
+        agora = time.time()
+        with self._conectar() as conn:
+            linha = conn.execute("SELECT dados, expira FROM entradas WHERE chave = ?", (chave,)).fetchone()
+            if linha is None:
+                return None
+            if linha[1] < agora:
+                conn.execute("DELETE FROM entradas WHERE chave = ?", (chave,))
+                return None
+            conn.execute("UPDATE entradas SET acesso = ? WHERE chave = ?", (agora, chave))
+            return linha[0]
+
+    def gravar(self, chave, dados, ttl=TTL_PADRAO):
+        agora = time.time()
+        with self._conectar() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entradas (chave, dados, tamanho, expira, acesso) VALUES (?, ?, ?, ?, ?)",
+                (chave, sqlite3.Binary(dados), len(dados), agora + ttl, agora)
+            )
+            self._despejar(conn, agora)
+
+    def _despejar(self, conn, agora):
+        """Remove entradas expiradas e, se necessário, as menos acessadas até caber no limite."""
+        conn.execute("DELETE FROM entradas WHERE expira < ?", (agora,))
+        total = conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM entradas").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        alvo = int(self.max_bytes * 0.9)
+        for chave, tamanho in conn.execute("SELECT chave, tamanho FROM entradas ORDER BY acesso").fetchall():
+            if total <= alvo:
+                break
+            conn.execute("DELETE FROM entradas WHERE chave = ?", (chave,))
+            total -= tamanho
+
+    def adquirir_bloqueio(self, chave, ttl):
+        agora = time.time()
+        with self._conectar() as conn:
+            conn.execute("DELETE FROM bloqueios WHERE expira < ?", (agora,))
+            cursor = conn.execute("INSERT OR IGNORE INTO bloqueios (chave, expira) VALUES (?, ?)", (chave, agora + ttl))
+            return cursor.rowcount == 1
+
+    def liberar_bloqueio(self, chave):
+        with self._conectar() as conn:
+            conn.execute("DELETE FROM bloqueios WHERE chave = ?", (chave,))
+
+    def limpar(self, prefixo):
+        """Remove as entradas do prefixo (o ficheiro pode ser partilhado com outras aplicações)."""
+        with self._conectar() as conn:
+            conn.execute("DELETE FROM entradas WHERE substr(chave, 1, ?) = ?", (len(prefixo) + 1, f"{prefixo}:"))
+
+
+class CacheRedis:
+    """Armazenamento compartilhado em qualquer servidor que fale o protocolo Redis.
+
+    O servidor tem de ser privado e de confiança (rede interna, com autenticação): os
+    valores são desserializados com pickle (ver desserializar()).
+    """
+
+    def __init__(self, url, socket_timeout=2):
+        if not REDIS_AVAILABLE:
+            raise ImportError("Pacote 'redis' não instalado. Instale com: pip install redis")
+        # O despejo fica a cargo do servidor (TTL por chave + política maxmemory, ex.: allkeys-lru)
+        self.cliente = redis.Redis.from_url(url, socket_timeout=socket_timeout, socket_connect_timeout=socket_timeout)
+
+    def obter(self, chave):
+        return self.cliente.get(chave)
+
+    def gravar(self, chave, dados, ttl=TTL_PADRAO):
+        self.cliente.set(chave, dados, ex=int(ttl))
+
+    def adquirir_bloqueio(self, chave, ttl):
+        return bool(self.cliente.set(f"bloqueio:{chave}", b"1", nx=True, px=int(ttl * 1000)))
+
+    def liberar_bloqueio(self, chave):
+        self.cliente.delete(f"bloqueio:{chave}")
+
+    def limpar(self, prefixo):
+        """Remove as chaves do prefixo (SCAN, sem bloquear o servidor como KEYS)."""
+        for chave in self.cliente.scan_iter(match=f"{prefixo}:*", count=1000):
+            self.cliente.delete(chave)
+
+
+# --- Cache em Camadas ---
+class CacheEmCamadas:
+    """Combina o LRU local com uma camada compartilhada opcional.
+
+    Na falta de um valor, apenas o processo que obtém o bloqueio calcula o
+    resultado; os demais aguardam que ele seja publicado na camada compartilhada
+    (até espera_max). Se a camada compartilhada falhar, calcula-se de imediato.
+    """
+
+    def __init__(self, local, compartilhada=None, prefixo='vf_perda', ttl=TTL_PADRAO, espera_max=15.0,
+                 ttl_bloqueio=TTL_BLOQUEIO_PADRAO):
+        self.local = local
+        self.compartilhada = compartilhada
+        self.prefixo = prefixo
+        self.ttl = ttl
+        self.espera_max = espera_max
+        self.ttl_bloqueio = ttl_bloqueio
+
+    def obter_ou_calcular(self, chave, calcular):
+        """Retorna o valor da chave, calculando-o uma única vez quando ausente."""
+        dados = self.local.obter(chave)
+        if dados is not None:
+            return desserializar(dados)
+
+        dados = self._obter_compartilhado(chave)
+        if dados is not None:
+            self.local.gravar(chave, dados, self.ttl)
+            return desserializar(dados)
+
+        bloqueado = self._adquirir_bloqueio(chave)
+        try:
+            if bloqueado is False:
+                # Outro processo está a calcular: aguardar a publicação do resultado
+                dados = self._aguardar_compartilhado(chave)
+                if dados is not None:
+                    self.local.gravar(chave, dados, self.ttl)
+                    return desserializar(dados)
+
+            valor = calcular()
+            dados = serializar(valor)
+            self.local.gravar(chave, dados, self.ttl)
+            self._gravar_compartilhado(chave, dados)
+            return valor
+        finally:
+            if bloqueado:
+                self._liberar_bloqueio(chave)
+
+    def limpar(self):
+        """Esvazia o LRU local e as entradas deste prefixo na camada compartilhada."""
+        self.local.limpar()
+        if self.compartilhada is None:
+            return
+        try:
+            self.compartilhada.limpar(self.prefixo)
+        except Exception as e:
+            logger.warning(f"Não foi possível limpar o cache compartilhado: {e}")
+
+    def _obter_compartilhado(self, chave):
+        if self.compartilhada is None:
+            return None
+        try:
+            return self.compartilhada.obter(chave)
+        except Exception as e:
+            logger.warning(f"Cache compartilhado indisponível (leitura): {e}")
+            return None
+
+    def _gravar_compartilhado(self, chave, dados):
+        if self.compartilhada is None:
+            return
+        try:
+            self.compartilhada.gravar(chave, dados, self.ttl)
+        except Exception as e:
+            logger.warning(f"Cache compartilhado indisponível (escrita): {e}")
+
+    def _adquirir_bloqueio(self, chave):
+        """True se obtido, False se outro processo está a calcular, None sem camada compartilhada (ou em falha)."""
+        if self.compartilhada is None:
+            return None
+        try:
+            return bool(self.compartilhada.adquirir_bloqueio(chave, self.ttl_bloqueio))
+        except Exception as e:
+            logger.warning(f"Não foi possível obter bloqueio no cache compartilhado: {e}")
+            return None
+
+    def _liberar_bloqueio(self, chave):
+        try:
+            self.compartilhada.liberar_bloqueio(chave)
+        except Exception as e:
+            logger.warning(f"Não foi possível liberar bloqueio no cache compartilhado: {e}")
+
+    def _aguardar_compartilhado(self, chave):
+        if self.compartilhada is None:
+            return None
+        limite = time.time() + self.espera_max
+        intervalo = 0.05
+        while time.time() < limite:
+            time.sleep(intervalo)
+            dados = self._obter_compartilhado(chave)
+            if dados is not None:
+                return dados
+            intervalo = min(intervalo * 2, 1.0)
+        logger.warning(f"Tempo de espera esgotado pelo cálculo de {chave}; calculando localmente")
+        return None
+
+
+def criar_cache(config=None):
+    """Cria o cache em camadas a partir da configuração (secção [cache] dos secrets).
+
+    Chaves suportadas: backend ('memoria', 'disco' ou 'redis'), caminho, url,
+    prefixo, max_itens, max_mb_local, max_mb_disco, ttl, espera_max_s e ttl_bloqueio_s.
+    O backend 'redis' exige um servidor privado e de confiança (ver CacheRedis).
+    """
+    config = dict(config or {})
+    local = CacheLRU(
+        max_itens=int(config.get('max_itens', 256)),
+        max_bytes=int(config.get('max_mb_local', 64)) * 1024 * 1024
+    )
+    backend = str(config.get('backend', 'memoria')).lower()
+    compartilhada = None
+    try:
+        if backend == 'disco':
+            compartilhada = CacheDisco(
+                config.get('caminho', os.path.join('.cache', 'vf_perda_cache.sqlite3')),
+                max_bytes=int(config.get('max_mb_disco', 512)) * 1024 * 1024
+            )
+        elif backend == 'redis':
+            compartilhada = CacheRedis(config.get('url', 'redis://localhost:6379/0'))
+    except Exception as e:
+        logger.error(f"Falha ao iniciar cache compartilhado '{backend}', usando apenas memória: {e}")
+        compartilhada = None
+
+    logger.info(f"Cache de consultas iniciado (camada compartilhada: {backend if compartilhada else 'nenhuma'})")
+    return CacheEmCamadas(
+        local,
+        compartilhada,
+        prefixo=config.get('prefixo', 'vf_perda'),
+        ttl=int(config.get('ttl', TTL_PADRAO)),
+        espera_max=float(config.get('espera_max_s', 15.0)),
+        ttl_bloqueio=float(config.get('ttl_bloqueio_s', TTL_BLOQUEIO_PADRAO))
+    )
+
+_cache_global = None
+_cache_global_lock = threading.Lock()
+
+def obter_cache(config=None):
+    """Retorna o cache do processo, criando-o na primeira chamada."""
+    global _cache_global
+    with _cache_global_lock:
+        if _cache_global is None:
+            _cache_global = criar_cache(config)
+    return _cache_global
+
+# Origem do último valor devolvido por em_cache_compartilhado na thread ('compartilhado' ou 'calculado')
+_estado_thread = threading.local()
+
+def limpar_origem():
+    _estado_thread.origem = None
+
+def origem_resultado():
+    """Origem do último valor obtido nesta thread, ou None se o decorador não foi executado."""
+    return getattr(_estado_thread, 'origem', None)
+
+def em_cache_compartilhado(funcao):
+    """Decorador de métodos: consulta o cache em camadas (self.cache_consultas) antes de executar.
+
+    Os argumentos do método devem incluir a versão dos dados, de modo que
+    cada agregado seja calculado uma vez por versão em toda a frota.
+    """
+    def calcular(self, args, kwargs):
+        valor = funcao(self, *args, **kwargs)
+        # Marcado após o cálculo, para não ser sobreposto por chamadas aninhadas
+        _estado_thread.origem = 'calculado'
+        return valor
+
+    @functools.wraps(funcao)
+    def wrapper(self, *args, **kwargs):
+        camadas = getattr(self, 'cache_consultas', None)
+        if camadas is None:
+            return calcular(self, args, kwargs)
+        chave = montar_chave(camadas.prefixo, funcao.__name__, args, kwargs)
+        valor = camadas.obter_ou_calcular(chave, lambda: calcular(self, args, kwargs))
+        if origem_resultado() is None:
+            _estado_thread.origem = 'compartilhado'
+        return valor
+    return wrapper
+
+
+def em_cache_local(ttl=TTL_PADRAO):
+    """Cache por processo dos métodos de leitura: st.cache_data quando a app Streamlit está carregada.
+
+    Fora do Streamlit (CLI, API, tarefas agendadas) o método fica sem esta camada e
+    a memoização em processo é feita pela camada local de em_cache_compartilhado.
+    """
+    def decorador(funcao):
+        if 'streamlit' in sys.modules:
+            import streamlit as st
+            return st.cache_data(ttl=ttl, show_spinner=False)(funcao)
+        funcao.em_cache_local = True
+        return funcao
+    return decorador
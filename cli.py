@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Linha de comandos para tarefas em lote (sem interface Streamlit).
+
+Exemplos (cron):
+    python cli.py importar /dados/bd_diaria.csv
+    python cli.py gerar --tipo PT --valor PT12 --folhas 5 --nibs 20 --usuario cron --saida folhas.zip
+    python cli.py resetar --tipo PT --valor PT12
+    python cli.py exportar --saida relatorio.csv.gz --estado prog
+
+A ligação vem de DATABASE_URL, do ficheiro indicado em --config/VF_PERDA_CONFIG
+ou do .streamlit/secrets.toml (ver config.py).
+"""
+import io
+import os
+import sys
+import argparse
+import datetime
+
+
+def notificar_terminal(nivel, mensagem):
+    """Notificador do PostgresDatabaseManager para o terminal (stderr)."""
+    prefixo = {'erro': 'ERRO', 'aviso': 'AVISO', 'sucesso': 'OK', 'progresso': '...'}.get(nivel, 'INFO')
+    print(f"[{prefixo}] {mensagem.strip()}", file=sys.stderr)
+
+
+def _abrir_gestor():
+    from database import PostgresDatabaseManager, POSTGRES_URL
+    return PostgresDatabaseManager(POSTGRES_URL, notificador=notificar_terminal)
+
+
+# --- Comandos ---
+def comando_importar(args):
+    db_manager = _abrir_gestor()
+    with open(args.arquivo, 'rb') as arquivo:
+        buffer = io.BytesIO(arquivo.read())
+    buffer.name = os.path.basename(args.arquivo)
+    return 0 if db_manager.importar_csv(buffer, 'BD') else 1
+
+
+def comando_gerar(args):
+    import utils
+    db_manager = _abrir_gestor()
+    cils_validos = None
+    if args.cils:
+        with open(args.cils, encoding='utf-8') as arquivo:
+            cils_validos = [linha.strip() for linha in arquivo if linha.strip()]
+
+    df_folhas, cils_nao_encontrados = db_manager.gerar_folhas_trabalho(
+        args.tipo, args.valor, args.folhas, args.nibs, cils_validos,
+        args.criterio_tipo, args.criterio_valor, user_name=args.usuario
+    )
+    if df_folhas is None or df_folhas.empty:
+        print("Nenhuma folha gerada.", file=sys.stderr)
+        return 1
+
+    rotulo_tipo = args.criterio_tipo or args.tipo
+    rotulo_valor = args.criterio_valor or args.valor or "avulso"
+    saida = args.saida or (
+        f"Folhas_{rotulo_tipo}_{utils.sanitizar_nome_arquivo(rotulo_valor)}_"
+        f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    )
+    with open(saida, 'wb') as arquivo:
+        arquivo.write(utils.generate_csv_zip(df_folhas, args.nibs, rotulo_tipo, rotulo_valor))
+    print(f"{df_folhas['FOLHA'].max()} folha(s), {len(df_folhas)} registro(s) em {saida}")
+    if cils_nao_encontrados:
+        print(f"{len(cils_nao_encontrados)} CIL(s) não encontrado(s)", file=sys.stderr)
+    return 0
+
+
+def comando_resetar(args):
+    db_manager = _abrir_gestor()
+    sucesso, registros = db_manager.resetar_estado(args.tipo, args.valor)
+    if not sucesso:
+        print(f"Falha no reset: {registros}", file=sys.stderr)
+        return 1
+    print(f"{registros} registro(s) com estado 'prog' resetado(s)")
+    return 0
+
+
+def comando_exportar(args):
+    db_manager = _abrir_gestor()
+    filtros = {coluna: getattr(args, coluna) for coluna in ('pt', 'localidade', 'criterio', 'estado')}
+    linhas = db_manager.exportar_relatorio_detalhado(filtros, args.saida, comprimir=not args.sem_compressao)
+    if linhas is None:
+        return 1
+    print(f"{linhas} linha(s) exportada(s) para {args.saida}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tarefas em lote do sistema de gestão de dados.")
+    parser.add_argument("--config", help="Ficheiro TOML de configuração (mesmo formato do secrets.toml)")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    importar = subparsers.add_parser("importar", help="Importa um ficheiro BD (CSV)")
+    importar.add_argument("arquivo")
+    importar.set_defaults(funcao=comando_importar)
+
+    gerar = subparsers.add_parser("gerar", help="Gera folhas de trabalho e grava o ZIP")
+    gerar.add_argument("--tipo", choices=["PT", "LOCALIDADE", "AVULSO"], required=True)
+    gerar.add_argument("--valor", help="PT ou localidade (tipos PT e LOCALIDADE)")
+    gerar.add_argument("--folhas", type=int, required=True)
+    gerar.add_argument("--nibs", type=int, required=True, help="NIBs por folha")
+    gerar.add_argument("--criterio-tipo")
+    gerar.add_argument("--criterio-valor")
+    gerar.add_argument("--cils", help="Ficheiro de texto com um CIL por linha (tipo AVULSO)")
+    gerar.add_argument("--usuario", default="cli")
+    gerar.add_argument("--saida", help="Ficheiro ZIP (por padrão, nome com data e critério)")
+    gerar.set_defaults(funcao=comando_gerar)
+
+    resetar = subparsers.add_parser("resetar", help="Reseta o estado 'prog'")
+    resetar.add_argument("--tipo", choices=["PT", "LOCALIDADE", "AVULSO"], required=True)
+    resetar.add_argument("--valor", default="")
+    resetar.set_defaults(funcao=comando_resetar)
+
+    exportar = subparsers.add_parser("exportar", help="Exporta o relatório detalhado completo")
+    exportar.add_argument("--saida", required=True)
+    exportar.add_argument("--pt")
+    exportar.add_argument("--localidade")
+    exportar.add_argument("--criterio")
+    exportar.add_argument("--estado")
+    exportar.add_argument("--sem-compressao", action="store_true", help="CSV simples em vez de gzip")
+    exportar.set_defaults(funcao=comando_exportar)
+
+    args = parser.parse_args(argv)
+    if args.config:
+        # Lido por config.py na importação do módulo database
+        os.environ["VF_PERDA_CONFIG"] = args.config
+    return args.funcao(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
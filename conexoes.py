@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Gestão das conexões ao PostgreSQL serverless (Neon).
+
+Após um período sem uso, o compute é suspenso e a primeira conexão espera que ele
+acorde, além do handshake TLS. Este módulo:
+- tenta novamente as conexões falhadas com espera exponencial;
+- aquece um número configurável de conexões do pool no arranque;
+- mantém o compute e as conexões ativos no horário de expediente (keepalive);
+- regista a latência de cada conexão e o tempo ocioso que a precedeu.
+"""
+import time
+import random
+import datetime
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from sqlalchemy import create_engine, event, text
+
+import desempenho
+
+# zoneinfo precisa da base de fusos do sistema (ou do pacote tzdata)
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    ZoneInfo = None
+
+logger = logging.getLogger(__name__)
+
+# Padrões da secção opcional [conexao] da configuração
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+CONNECT_TIMEOUT = 15
+TENTATIVAS_CONEXAO = 4
+ESPERA_INICIAL_S = 0.5
+ESPERA_MAXIMA_S = 8.0
+CONEXOES_AQUECIDAS = 2
+# Abaixo dos 5 minutos de inatividade após os quais o Neon suspende o compute
+INTERVALO_KEEPALIVE_S = 240
+HORA_INICIO = 7
+HORA_FIM = 19
+DIAS_SEMANA = [0, 1, 2, 3, 4, 5]
+FUSO_HORARIO = "Atlantic/Cape_Verde"
+
+MAX_CONEXOES_RECENTES = 200
+
+
+class GestorConexoes:
+    """Cria o engine com tentativas de conexão e mantém o pool aquecido."""
+
+    def __init__(self, database_url, config=None):
+        config = dict(config or {})
+        self.tentativas = int(config.get('tentativas', TENTATIVAS_CONEXAO))
+        self.espera_inicial = float(config.get('espera_inicial_s', ESPERA_INICIAL_S))
+        self.espera_maxima = float(config.get('espera_maxima_s', ESPERA_MAXIMA_S))
+        self.conexoes_aquecidas = int(config.get('conexoes_aquecidas', CONEXOES_AQUECIDAS))
+        self.intervalo_keepalive = float(config.get('intervalo_keepalive_s', INTERVALO_KEEPALIVE_S))
+        self.hora_inicio = int(config.get('hora_inicio', HORA_INICIO))
+        self.hora_fim = int(config.get('hora_fim', HORA_FIM))
+        self.dias_semana = set(config.get('dias_semana', DIAS_SEMANA))
+        self.fuso = _obter_fuso(config.get('fuso_horario', FUSO_HORARIO))
+
+        self._recentes = deque(maxlen=MAX_CONEXOES_RECENTES)
+        self._ultimo_uso = time.time()
+        self._parar = threading.Event()
+        self._keepalive = None
+
+        pool_size = int(config.get('pool_size', POOL_SIZE))
+        self.conexoes_aquecidas = min(self.conexoes_aquecidas, pool_size)
+        self.engine = create_engine(
+            database_url,
+            pool_pre_ping=True,
+            pool_recycle=3600,
+            pool_size=pool_size,
+            max_overflow=int(config.get('max_overflow', MAX_OVERFLOW)),
+            connect_args={
+                'connect_timeout': int(config.get('connect_timeout', CONNECT_TIMEOUT))
+            }
+        )
+        event.listen(self.engine, "do_connect", self._conectar)
+        event.listen(self.engine, "checkout", self._marcar_uso)
+        event.listen(self.engine, "checkin", self._marcar_uso)
+
+    # --- Conexão com Tentativas ---
+    def _conectar(self, dialect, registro_conexao, cargs, cparams):
+        """Substitui a conexão DBAPI do pool: espera exponencial (com jitter) entre tentativas."""
+        ocioso = time.time() - self._ultimo_uso
+        erro_operacional = (getattr(dialect, 'loaded_dbapi', None) or dialect.dbapi).OperationalError
+        inicio = time.perf_counter()
+        for tentativa in range(1, self.tentativas + 1):
+            try:
+                conexao = dialect.connect(*cargs, **cparams)
+                break
+            except erro_operacional as e:
+                if tentativa == self.tentativas:
+                    self._registrar(inicio, tentativa, ocioso, sucesso=False)
+                    raise
+                espera = min(self.espera_maxima, self.espera_inicial * 2 ** (tentativa - 1)) * random.uniform(0.5, 1.0)
+                logger.warning(f"Conexão falhou (tentativa {tentativa}/{self.tentativas}), nova tentativa em {espera:.1f}s: {e}")
+                time.sleep(espera)
+        self._registrar(inicio, tentativa, ocioso, sucesso=True)
+        return conexao
+
+    def _registrar(self, inicio, tentativas, ocioso, sucesso):
+        duracao = time.perf_counter() - inicio
+        desempenho.registo.registrar('conexao', 'conectar' if sucesso else 'conectar (falha)', duracao)
+        self._recentes.append({
+            'quando': datetime.datetime.now(),
+            'duracao_ms': duracao * 1000,
+            'tentativas': tentativas,
+            'ocioso_antes_s': ocioso,
+            'sucesso': sucesso
+        })
+        logger.info(f"Conexão {'aberta' if sucesso else 'falhada'} em {duracao * 1000:.0f} ms "
+                    f"({tentativas} tentativa(s), {ocioso:.0f}s sem uso)")
+
+    def _marcar_uso(self, *args):
+        self._ultimo_uso = time.time()
+
+    def conexoes_recentes(self):
+        """Conexões abertas recentemente (latência, tentativas e tempo ocioso anterior)."""
+        return pd.DataFrame(list(self._recentes))
+
+    # --- Aquecimento e Keepalive ---
+    def aquecer(self, quantidade=None):
+        """Abre (ou valida) 'quantidade' conexões do pool em paralelo e devolve-as ao pool."""
+        quantidade = self.conexoes_aquecidas if quantidade is None else quantidade
+        if quantidade <= 0:
+            return 0
+
+        def _ping():
+            try:
+                with self.engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+                    # Mantida em uso até todas estarem abertas, para não reutilizar a mesma conexão
+                    barreira.wait(timeout=60)
+            except threading.BrokenBarrierError:
+                pass
+            except Exception:
+                barreira.abort()
+                raise
+
+        barreira = threading.Barrier(quantidade)
+        with ThreadPoolExecutor(max_workers=quantidade, thread_name_prefix="aquecimento") as executor:
+            futuros = [executor.submit(_ping) for _ in range(quantidade)]
+        falhas = sum(1 for f in futuros if f.exception() is not None)
+        if falhas:
+            logger.warning(f"Aquecimento: {falhas} de {quantidade} conexão(ões) falharam")
+        return quantidade - falhas
+
+    def em_expediente(self, agora=None):
+        agora = agora or datetime.datetime.now(self.fuso)
+        return agora.weekday() in self.dias_semana and self.hora_inicio <= agora.hour < self.hora_fim
+
+    def iniciar(self, aquecer=True, keepalive=True):
+        """Aquece o pool em segundo plano e inicia o keepalive (uma única vez por gestor)."""
+        if self._keepalive is not None:
+            return
+        self._keepalive = threading.Thread(
+            target=self._executar_keepalive, args=(aquecer, keepalive), daemon=True, name="keepalive_bd"
+        )
+        self._keepalive.start()
+
+    def _executar_keepalive(self, aquecer, keepalive):
+        if aquecer:
+            self._tentar_aquecer()
+        # Verificação frequente: o aquecimento ocorre logo que o pool completa 'intervalo_keepalive' sem uso
+        while keepalive and not self._parar.wait(self.intervalo_keepalive / 4):
+            # Sem atividade recente e em horário de expediente: acordar o compute e as conexões do pool
+            if self.em_expediente() and time.time() - self._ultimo_uso >= self.intervalo_keepalive:
+                self._tentar_aquecer()
+
+    def _tentar_aquecer(self):
+        try:
+            self.aquecer()
+        except Exception as e:
+            logger.warning(f"Falha no aquecimento das conexões: {e}")
+
+    def parar(self):
+        self._parar.set()
+
+
+def _obter_fuso(nome):
+    """Fuso horário do expediente; sem base de fusos, usa a hora local do servidor."""
+    if ZoneInfo is None:
+        return None
+    try:
+        return ZoneInfo(nome)
+    except Exception:
+        logger.warning(f"Fuso horário '{nome}' indisponível; usando a hora local do servidor")
+        return None
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Configuração do sistema, sem dependência do Streamlit.
+
+Ordem de precedência:
+1. DATABASE_URL no ambiente (ligação ao PostgreSQL);
+2. ficheiro TOML indicado em VF_PERDA_CONFIG;
+3. .streamlit/secrets.toml no diretório atual ou na pasta do utilizador;
+4. st.secrets, apenas se o Streamlit já estiver carregado (ex.: secrets definidos na nuvem).
+
+O formato do ficheiro é o mesmo do secrets.toml: secções [postgres], [cache],
+[analitica], [desempenho], [api], [conexao] e [autenticacao].
+"""
+import os
+import sys
+import logging
+from sqlalchemy.engine import make_url
+
+# tomllib a partir do Python 3.11; tomli como alternativa em versões anteriores
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+logger = logging.getLogger(__name__)
+
+CAMINHOS_PADRAO = [
+    os.path.join(".streamlit", "secrets.toml"),
+    os.path.join(os.path.expanduser("~"), ".streamlit", "secrets.toml")
+]
+
+
+class ConfiguracaoAusente(RuntimeError):
+    """Nenhuma configuração de ligação ao PostgreSQL foi encontrada."""
+
+
+def _ler_arquivo(caminho):
+    if tomllib is None:
+        logger.warning(f"Leitor TOML indisponível; ignorando {caminho}")
+        return {}
+    with open(caminho, 'rb') as arquivo:
+        return tomllib.load(arquivo)
+
+def carregar(caminho=None):
+    """Lê a configuração completa (dict de secções) a partir do ficheiro encontrado."""
+    caminho = caminho or os.environ.get("VF_PERDA_CONFIG")
+    if caminho:
+        logger.info(f"Configuração lida de {caminho}")
+        return _ler_arquivo(caminho)
+
+    for candidato in CAMINHOS_PADRAO:
+        if os.path.exists(candidato):
+            return _ler_arquivo(candidato)
+
+    # Secrets geridos pela plataforma (sem ficheiro local): só se a app Streamlit já estiver em execução
+    if 'streamlit' in sys.modules:
+        try:
+            import streamlit as st
+            return {nome: dict(valores) for nome, valores in st.secrets.items() if hasattr(valores, 'items')}
+        except FileNotFoundError:
+            pass
+    return {}
+
+_configuracao = carregar()
+
+def secao(nome):
+    """Secção da configuração, ou {} se não existir."""
+    return dict(_configuracao.get(nome, {}))
+
+def postgres():
+    """(POSTGRES_CONFIG, POSTGRES_URL) a partir do ambiente ou da secção [postgres].
+
+    Retorna (None, None) se não houver configuração.
+    """
+    url_ambiente = os.environ.get("DATABASE_URL")
+    if url_ambiente:
+        url = make_url(url_ambiente)
+        return {
+            'host': url.host or url.query.get('host'),
+            'port': url.port,
+            'database': url.database,
+            'user': url.username,
+            'password': url.password
+        }, url_ambiente
+
+    secao_postgres = secao("postgres")
+    if not secao_postgres:
+        return None, None
+    configuracao = {chave: secao_postgres[chave] for chave in ('host', 'port', 'database', 'user', 'password')}
+    # Neon requer SSL e usamos psycopg2 explicitamente para consistência
+    url = (
+        f"postgresql+psycopg2://{configuracao['user']}:{configuracao['password']}@"
+        f"{configuracao['host']}:{configuracao['port']}/{configuracao['database']}?sslmode=require"
+    )
+    return configuracao, url
@@ -1,32 +1,108 @@
 # -*- coding: utf-8 -*-
-import streamlit as st
 import pandas as pd
-import bcrypt
 import logging
-from sqlalchemy import create_engine, text
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import gzip
+import codecs
+import datetime
+import functools
+import contextlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 import utils
+import cache
+import config
+import analitica
+import desempenho
+import conexoes
+import senhas
+
+# PyArrow com fallback (parser CSV mais rápido na leitura em massa), importado na primeira leitura via COPY
+ARROW_AVAILABLE = utils.modulo_disponivel("pyarrow")
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# --- CONFIGURAÇÃO PARA BANCO DE DATOS (STREAMLIT SECRETS) ---
-# Usar st.secrets para configurações sensíveis
-POSTGRES_CONFIG = {
-    'host': st.secrets["postgres"]["host"],
-    'port': st.secrets["postgres"]["port"],
-    'database': st.secrets["postgres"]["database"],
-    'user': st.secrets["postgres"]["user"],
-    'password': st.secrets["postgres"]["password"]
-}
-# Neon requer SSL e usamos psycopg2 explicitamente para consistência
-POSTGRES_URL = (
-    f"postgresql+psycopg2://{POSTGRES_CONFIG['user']}:{POSTGRES_CONFIG['password']}@"
-    f"{POSTGRES_CONFIG['host']}:{POSTGRES_CONFIG['port']}/{POSTGRES_CONFIG['database']}?sslmode=require"
-)
-logger.info(f"Configuração carregada com sucesso para o banco em: {POSTGRES_CONFIG['host']}")
+# --- CONFIGURAÇÃO PARA BANCO DE DATOS (AMBIENTE OU FICHEIRO, VER config.py) ---
+POSTGRES_CONFIG, POSTGRES_URL = config.postgres()
+if POSTGRES_CONFIG:
+    logger.info(f"Configuração carregada com sucesso para o banco em: {POSTGRES_CONFIG['host']}")
+else:
+    logger.warning("Nenhuma configuração do PostgreSQL encontrada (DATABASE_URL, VF_PERDA_CONFIG ou secrets.toml)")
+
+# Os caches são invalidados pela versão dos dados (incrementada a cada escrita),
+# portanto o TTL serve apenas para libertar memória de versões antigas.
+CACHE_TTL_VERSIONADO = 24 * 3600
+
+# Tempo (segundos) durante o qual a versão lida é reutilizada pela mesma instância
+VERSAO_DADOS_TTL = 2.0
+
+# Executor partilhado para leituras concorrentes (limitado ao pool_size do engine)
+MAX_CONSULTAS_CONCORRENTES = 5
+_executor_consultas = ThreadPoolExecutor(max_workers=MAX_CONSULTAS_CONCORRENTES, thread_name_prefix="consulta")
+
+# Camada de cache compartilhada entre réplicas (secção opcional [cache] da configuração)
+CACHE_CONFIG = config.secao("cache")
+CACHE_CONFIG.setdefault('prefixo', f"vf_perda:{(POSTGRES_CONFIG or {}).get('database')}")
+CACHE_CONFIG.setdefault('ttl', CACHE_TTL_VERSIONADO)
+
+# Colunas do relatório detalhado e tamanho de cada bloco lido do servidor na exportação
+COLUNAS_RELATORIO = [
+    'cil', 'pt', 'localidade', 'criterio', 'anomalia',
+    'situacao', 'qtd', 'valor', 'estado', 'nib',
+    'desc_tp_cli', 'est_contr', 'sit_div', 'est_inspec'
+]
+TAMANHO_BLOCO_EXPORTACAO = 1024 * 1024
+
+# A partir deste número de linhas conhecido pelo chamador, as leituras usam COPY em vez de cursor
+LIMIAR_LEITURA_COPY = 20000
+
+# Tipos PostgreSQL (OID) com conversão numérica na leitura via COPY
+TIPOS_DECIMAIS = {700, 701, 1700}
+TIPOS_INTEIROS = {20, 21, 23}
+
+# Versão do esquema de índices de bd: init_db só os (re)cria quando a versão registada é inferior
+VERSAO_ESQUEMA_BD = 1
+
+# Último dia com instantâneo de métricas registado por este processo (evita verificações por execução)
+_data_ultimo_historico = None
+
+# Motor analítico colunar em memória (secção opcional [analitica], desativado por padrão)
+ANALITICA_CONFIG = config.secao("analitica")
 
+# Gravador de consultas lentas (secção opcional [desempenho]: limiar_lenta_ms, amostragem_explain,
+# max_consultas_lentas, gravar_parametros)
+DESEMPENHO_CONFIG = config.secao("desempenho")
+
+# Pool, tentativas de conexão, aquecimento e keepalive (secção opcional [conexao], ver conexoes.py)
+CONEXAO_CONFIG = config.secao("conexao")
+
+# Um gestor por URL e por processo, partilhado entre sessões e reexecuções do script
+_gestores = {}
+_lock_gestores = threading.Lock()
+
+def _funcoes_contexto_script():
+    """(add_script_run_ctx, get_script_run_ctx) do Streamlit, se a app estiver carregada.
+    
+    Propaga o contexto do script para as threads auxiliares; fora do Streamlit retorna (None, None).
+    """
+    if 'streamlit' not in sys.modules:
+        return None, None
+    try:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+    except ImportError:
+        return None, None
+    return add_script_run_ctx, get_script_run_ctx
+
+@desempenho.instrumentar
 class PostgresDatabaseManager:
     """Gerencia a conexão e operações com o banco de dados PostgreSQL, 
     incluindo autenticação segura (bcrypt) e operações de dados otimizadas.
@@ -47,22 +123,50 @@ class PostgresDatabaseManager:
         "EST_CTR": "est_contr"
     }
     
-    def __init__(self, database_url):
+    # Colunas filtráveis cobertas pelo catálogo de valores (uma única leitura da BD)
+    COLUNAS_CATALOGO = ['pt', 'localidade', 'criterio', 'anomalia', 'desc_tp_cli', 'est_contr']
+    
+    # Dimensões com tabela de resumo materializada (resumo_<dimensao>)
+    DIMENSOES_RESUMO = ['pt', 'localidade', 'criterio']
+    
+    # Dimensões do cubo pré-agregado (cubo_bd); 'estado' distingue apenas 'prog' de ''
+    DIMENSOES_CUBO = ['pt', 'localidade', 'criterio', 'anomalia', 'desc_tp_cli', 'est_contr', 'estado']
+    
+    # Ordenações do relatório paginado: (colunas, direção); cada uma tem índice (sem nulos) com num_linha no fim
+    ORDENACOES_RELATORIO = {
+        'pt': (['pt', 'localidade', 'criterio'], 'ASC'),
+        'valor_desc': (['valor'], 'DESC'),
+        'valor_asc': (['valor'], 'ASC'),
+        'cil': (['cil'], 'ASC')
+    }
+    
+    # Tamanhos de página permitidos no relatório paginado
+    TAMANHOS_PAGINA_RELATORIO = (50, 100, 250, 500)
+    
+    # Limite de células devolvidas ao mapa de densidade (as mais densas)
+    LIMITE_PONTOS_MAPA = 5000
+    
+    def __init__(self, database_url, notificador=None):
+        """notificador: função (nivel, mensagem) que recebe avisos para o utilizador
+        ('info', 'sucesso', 'aviso', 'erro' ou 'progresso'); sem ele, ficam só no log.
+        """
+        if not database_url:
+            raise config.ConfiguracaoAusente("Defina DATABASE_URL ou a secção [postgres] da configuração")
         self.database_url = database_url
+        self.notificador = notificador
         self.engine = None
+        self.gravador_lentas = None
+        self._versao_dados = None
+        self._versao_lida_em = 0.0
+        self.cache_consultas = cache.obter_cache(CACHE_CONFIG)
+        self.motor_analitico = analitica.obter_motor(ANALITICA_CONFIG)
         
         try:
-            # Configurações de conexão otimizadas para o ambiente de produção
-            self.engine = create_engine(
-                database_url,
-                pool_pre_ping=True,
-                pool_recycle=3600,
-                pool_size=5,
-                max_overflow=10,
-                connect_args={
-                    'connect_timeout': 15
-                }
-            )
+            # Engine com tentativas de conexão (espera exponencial) e registo da latência
+            self.conexoes = conexoes.GestorConexoes(database_url, CONEXAO_CONFIG)
+            self.engine = self.conexoes.engine
+            self.gravador_lentas = desempenho.criar_gravador(self.engine, DESEMPENHO_CONFIG)
+            desempenho.instrumentar_engine(self.engine, self.gravador_lentas)
             
             # Testar conexão
             with self.engine.connect() as conn:
@@ -73,11 +177,11 @@ class PostgresDatabaseManager:
             
         except Exception as e:
             error_msg = f"❌ Erro ao conectar com o Banco de Dados: {str(e)}"
-            st.error(error_msg)
+            self._notificar('erro', error_msg)
             logger.error(error_msg)
             
             # Mensagem geral para o usuário final
-            st.error("""
+            self._notificar('erro', """
             🔌 **Erro de Conexão com o Servidor**
             
             Não foi possível estabelecer uma conexão estável com o banco de dados. 
@@ -86,6 +190,16 @@ class PostgresDatabaseManager:
                 
             raise
 
+    def fechar(self):
+        """Para o keepalive e fecha as conexões do pool."""
+        self.conexoes.parar()
+        self.engine.dispose()
+
+    def _notificar(self, nivel, mensagem):
+        """Encaminha uma mensagem ao notificador da interface (se houver)."""
+        if self.notificador is not None:
+            self.notificador(nivel, mensagem)
+
     def _get_conn(self):
         """Retorna uma conexão ativa com o banco."""
         return self.engine.connect()
@@ -103,9 +217,17 @@ class PostgresDatabaseManager:
                     mat_leitura TEXT, desc_uni TEXT, est_contr TEXT, anomalia TEXT, id TEXT,
                     produto TEXT, nome TEXT, criterio TEXT, desc_tp_cli TEXT, tip TEXT,
                     sit_div TEXT, modelo TEXT, lat DOUBLE PRECISION, long DOUBLE PRECISION, est_inspec TEXT,
-                    estado TEXT
+                    estado TEXT, num_linha BIGINT GENERATED BY DEFAULT AS IDENTITY
                 )
             '''))
+            # BD anterior à paginação do relatório: acrescentar a chave sequencial de desempate
+            if not conn.execute(text("""
+                SELECT EXISTS (
+                    SELECT 1 FROM information_schema.columns 
+                    WHERE table_schema = current_schema() AND table_name = 'bd' AND column_name = 'num_linha'
+                )
+            """)).scalar():
+                conn.execute(text("ALTER TABLE bd ADD COLUMN num_linha BIGINT GENERATED BY DEFAULT AS IDENTITY"))
             
             # Tabela de usuários
             conn.execute(text('''
@@ -133,6 +255,154 @@ class PostgresDatabaseManager:
                 )
             '''))
             
+            # Tabela de controle da versão dos dados (chave dos caches)
+            conn.execute(text('''
+                CREATE TABLE IF NOT EXISTS controle_versao (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    versao BIGINT NOT NULL DEFAULT 0,
+                    atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            '''))
+            conn.execute(text("INSERT INTO controle_versao (id, versao) VALUES (1, 0) ON CONFLICT (id) DO NOTHING"))
+            # Versão da última importação: distingue as substituições de bd das mudanças de estado
+            conn.execute(text("ALTER TABLE controle_versao ADD COLUMN IF NOT EXISTS versao_importacao BIGINT NOT NULL DEFAULT 0"))
+            # Poda de alteracoes_estado: versão até à qual o registo está incompleto e linhas registadas desde então
+            conn.execute(text("ALTER TABLE controle_versao ADD COLUMN IF NOT EXISTS versao_poda BIGINT NOT NULL DEFAULT 0"))
+            conn.execute(text("ALTER TABLE controle_versao ADD COLUMN IF NOT EXISTS linhas_alteracoes BIGINT NOT NULL DEFAULT 0"))
+            # Migração única dos índices de bd (CREATE INDEX bloqueia as escritas: não repetir a cada arranque)
+            conn.execute(text("ALTER TABLE controle_versao ADD COLUMN IF NOT EXISTS versao_esquema INTEGER NOT NULL DEFAULT 0"))
+            versao_esquema = conn.execute(text("SELECT versao_esquema FROM controle_versao WHERE id = 1 FOR UPDATE")).scalar()
+            if versao_esquema < VERSAO_ESQUEMA_BD:
+                self._criar_indices_bd(conn)
+                conn.execute(text("UPDATE controle_versao SET versao_esquema = :versao WHERE id = 1"), {'versao': VERSAO_ESQUEMA_BD})
+            
+            # Linhas de bd com estado alterado, por versão (atualização incremental do motor analítico, se ativo)
+            conn.execute(text('''
+                CREATE TABLE IF NOT EXISTS alteracoes_estado (
+                    versao BIGINT,
+                    num_linha BIGINT NOT NULL
+                )
+            '''))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_alteracoes_estado_versao ON alteracoes_estado (versao)"))
+            
+            # Tabelas de resumo materializadas (dashboard e análise de eficiência)
+            conn.execute(text('''
+                CREATE TABLE IF NOT EXISTS resumo_global (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    total_registros BIGINT NOT NULL DEFAULT 0,
+                    cils_unicos BIGINT NOT NULL DEFAULT 0,
+                    pts_unicos BIGINT NOT NULL DEFAULT 0,
+                    localidades_unicas BIGINT NOT NULL DEFAULT 0,
+                    nibs_unicos BIGINT NOT NULL DEFAULT 0,
+                    registros_em_progresso BIGINT NOT NULL DEFAULT 0,
+                    total_qtd DOUBLE PRECISION,
+                    total_valor DOUBLE PRECISION,
+                    media_qtd DOUBLE PRECISION,
+                    media_valor DOUBLE PRECISION,
+                    atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            '''))
+            for dimensao in self.DIMENSOES_RESUMO:
+                conn.execute(text(f'''
+                    CREATE TABLE IF NOT EXISTS resumo_{dimensao} (
+                        {dimensao} TEXT PRIMARY KEY,
+                        total_registros BIGINT NOT NULL DEFAULT 0,
+                        em_progresso BIGINT NOT NULL DEFAULT 0,
+                        valor_total DOUBLE PRECISION NOT NULL DEFAULT 0,
+                        registros_com_valor BIGINT NOT NULL DEFAULT 0
+                    )
+                '''))
+            
+            # Contadores de disponibilidade por (coluna, valor) para os filtros de geração
+            conn.execute(text('''
+                CREATE TABLE IF NOT EXISTS contadores_disponibilidade (
+                    coluna TEXT NOT NULL,
+                    valor TEXT NOT NULL,
+                    total BIGINT NOT NULL DEFAULT 0,
+                    disponiveis BIGINT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (coluna, valor)
+                )
+            '''))
+            if conn.execute(text("SELECT NOT EXISTS (SELECT 1 FROM contadores_disponibilidade)")).scalar():
+                self._atualizar_contadores(conn)
+            
+            # Cubo pré-agregado para fatiamento livre (medidas: registros, soma de valor e de qtd)
+            dimensoes_cubo = ", ".join(f"{d} TEXT NOT NULL" for d in self.DIMENSOES_CUBO)
+            conn.execute(text(f'''
+                CREATE TABLE IF NOT EXISTS cubo_bd (
+                    {dimensoes_cubo},
+                    registros BIGINT NOT NULL DEFAULT 0,
+                    soma_valor DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    soma_qtd DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    PRIMARY KEY ({", ".join(self.DIMENSOES_CUBO)})
+                )
+            '''))
+            if conn.execute(text("SELECT NOT EXISTS (SELECT 1 FROM cubo_bd)")).scalar():
+                self._atualizar_cubo(conn)
+            
+            # Primeira execução sobre uma BD já existente: materializar os resumos
+            if conn.execute(text("SELECT COUNT(*) FROM resumo_global")).scalar() == 0:
+                self._atualizar_resumos(conn)
+                logger.info("Tabelas de resumo materializadas na inicialização")
+            
+            # Consultas lentas gravadas pelo módulo de desempenho (limitadas às mais recentes)
+            conn.execute(text('''
+                CREATE TABLE IF NOT EXISTS slow_queries (
+                    id BIGSERIAL PRIMARY KEY,
+                    registado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    sql TEXT NOT NULL,
+                    parametros TEXT,
+                    duracao_ms DOUBLE PRECISION NOT NULL,
+                    linhas BIGINT,
+                    plano TEXT
+                )
+            '''))
+            
+            # Perfil por fases de cada importação (tempo, CPU, linhas e pico de memória)
+            conn.execute(text('''
+                CREATE TABLE IF NOT EXISTS import_runs (
+                    id BIGSERIAL PRIMARY KEY,
+                    iniciado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    arquivo TEXT,
+                    tamanho_bytes BIGINT,
+                    linhas BIGINT,
+                    sucesso BOOLEAN NOT NULL,
+                    erro TEXT,
+                    duracao_s DOUBLE PRECISION NOT NULL,
+                    fases JSONB NOT NULL
+                )
+            '''))
+            
+            # Séries temporais de métricas (um instantâneo por dia e após cada importação)
+            conn.execute(text('''
+                CREATE TABLE IF NOT EXISTS historico_metricas (
+                    data DATE PRIMARY KEY,
+                    total_registros BIGINT NOT NULL DEFAULT 0,
+                    registros_em_progresso BIGINT NOT NULL DEFAULT 0,
+                    percentual_progresso DOUBLE PRECISION,
+                    cils_unicos BIGINT NOT NULL DEFAULT 0,
+                    pts_unicos BIGINT NOT NULL DEFAULT 0,
+                    localidades_unicas BIGINT NOT NULL DEFAULT 0,
+                    nibs_unicos BIGINT NOT NULL DEFAULT 0,
+                    total_qtd DOUBLE PRECISION,
+                    total_valor DOUBLE PRECISION,
+                    media_valor DOUBLE PRECISION,
+                    registado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            '''))
+            conn.execute(text('''
+                CREATE TABLE IF NOT EXISTS historico_pt (
+                    data DATE NOT NULL,
+                    pt TEXT NOT NULL,
+                    total_registros BIGINT NOT NULL DEFAULT 0,
+                    em_progresso BIGINT NOT NULL DEFAULT 0,
+                    percentual_progresso DOUBLE PRECISION,
+                    valor_total DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    PRIMARY KEY (data, pt)
+                )
+            '''))
+            self._registrar_historico_diario(conn)
+            
             # Inserir usuários padrão se a tabela estiver vazia
             result = conn.execute(text("SELECT COUNT(*) FROM usuarios"))
             count = result.scalar()
@@ -149,39 +419,532 @@ class PostgresDatabaseManager:
                 logger.info("Usuários padrão inseridos na inicialização")
             conn.commit()
 
+    def _criar_indices_bd(self, conn):
+        """Cria os índices das ordenações do relatório e de num_linha (apenas os que faltam).
+        
+        Um índice ascendente serve as duas direções (varrimento para trás em DESC).
+        Chamado pela importação (bd recriada) e, uma única vez por VERSAO_ESQUEMA_BD, por init_db.
+        """
+        for colunas, _ in self.ORDENACOES_RELATORIO.values():
+            # Índices anteriores sobre as colunas simples (não servem a chave sem nulos)
+            conn.execute(text(f"DROP INDEX IF EXISTS idx_bd_relatorio_{'_'.join(colunas)}"))
+            indice = f"idx_bd_pagina_{'_'.join(colunas)}"
+            if conn.execute(text("SELECT to_regclass(:indice) IS NULL"), {'indice': indice}).scalar():
+                expressoes = [self._expressao_ordem(c) for c in colunas] + ['num_linha']
+                conn.execute(text(f"CREATE INDEX {indice} ON bd ({', '.join(expressoes)})"))
+        # Leitura das linhas alteradas pelo motor analítico
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_bd_num_linha ON bd (num_linha)"))
+
+    @staticmethod
+    def _expressao_ordem(coluna):
+        """Expressão sem nulos da coluna de ordenação do relatório (comparação de tuplos segura).
+        
+        NaN ordena depois de qualquer número, como NULL na ordem padrão.
+        """
+        return "COALESCE(valor, 'NaN'::float8)" if coluna == 'valor' else f"COALESCE({coluna}, '')"
+
+    # --- Versão dos Dados (Invalidação de Cache) ---
+    def obter_versao_dados(self):
+        """Retorna a versão atual dos dados, incluída na chave de todos os caches."""
+        agora = time.monotonic()
+        if self._versao_dados is None or agora - self._versao_lida_em > VERSAO_DADOS_TTL:
+            # Memorizada por poucos segundos: uma leitura por execução do script ou fragmento
+            with self.engine.connect() as conn:
+                versao = conn.execute(text("SELECT versao FROM controle_versao WHERE id = 1")).scalar()
+            self._versao_dados = versao or 0
+            self._versao_lida_em = agora
+            # O gestor é partilhado pelo processo: a mudança de dia é detetada aqui e não só no init_db
+            if _data_ultimo_historico != datetime.date.today():
+                self._verificar_historico_diario()
+        return self._versao_dados
+
+    def _verificar_historico_diario(self):
+        """Regista o instantâneo diário de métricas numa transação própria (falhas só no log)."""
+        try:
+            with self.engine.begin() as conn:
+                self._registrar_historico_diario(conn)
+        except Exception as e:
+            logger.warning(f"Falha ao registar o instantâneo diário de métricas: {e}")
+
+    def _incrementar_versao_dados(self, conn, importacao=False):
+        """Incrementa a versão dos dados dentro da transação de escrita em curso.
+        
+        O bloqueio da linha de controle_versao até ao commit garante que as versões seguem a
+        ordem dos commits; as linhas alteradas nesta transação ficam associadas à nova versão.
+        Sem motor analítico neste processo nada é registado e versao_poda obriga os snapshots
+        de outros processos a recarregar.
+        """
+        registar = self.motor_analitico is not None
+        nova = conn.execute(text("""
+            UPDATE controle_versao 
+            SET versao = versao + 1, 
+                versao_importacao = CASE WHEN :importacao THEN versao + 1 ELSE versao_importacao END,
+                versao_poda = CASE WHEN :registar THEN versao_poda ELSE versao + 1 END,
+                atualizado_em = CURRENT_TIMESTAMP 
+            WHERE id = 1
+            RETURNING versao
+        """), {'importacao': importacao, 'registar': registar and not importacao}).scalar()
+        if importacao:
+            # bd foi substituída: o motor analítico recarrega por completo
+            conn.execute(text("DELETE FROM alteracoes_estado"))
+            conn.execute(text("UPDATE controle_versao SET linhas_alteracoes = 0 WHERE id = 1"))
+        elif registar:
+            # Só as linhas sem versão desta transação são visíveis (as de outras ainda não confirmadas não)
+            linhas = conn.execute(
+                text("UPDATE alteracoes_estado SET versao = :nova WHERE versao IS NULL"), {'nova': nova}
+            ).rowcount
+            total = conn.execute(text("""
+                UPDATE controle_versao SET linhas_alteracoes = linhas_alteracoes + :linhas WHERE id = 1
+                RETURNING linhas_alteracoes
+            """), {'linhas': linhas}).scalar()
+            if total > analitica.MAX_LINHAS_ALTERACOES:
+                # Poda pelo volume: esvazia o registo (as linhas não confirmadas de outras transações ficam)
+                conn.execute(text("DELETE FROM alteracoes_estado WHERE versao IS NOT NULL"))
+                conn.execute(text("UPDATE controle_versao SET versao_poda = :nova, linhas_alteracoes = 0 WHERE id = 1"),
+                             {'nova': nova})
+        # Força nova leitura na próxima consulta (após o commit)
+        self._versao_dados = None
+
+    # --- Resumos Materializados ---
+    def _atualizar_resumos(self, conn):
+        """Recalcula por completo as tabelas de resumo a partir da tabela bd."""
+        tabelas = ", ".join(["resumo_global"] + [f"resumo_{d}" for d in self.DIMENSOES_RESUMO])
+        conn.execute(text(f"TRUNCATE {tabelas}"))
+        
+        conn.execute(text("""
+            INSERT INTO resumo_global (
+                id, total_registros, cils_unicos, pts_unicos, localidades_unicas, nibs_unicos,
+                registros_em_progresso, total_qtd, total_valor, media_qtd, media_valor
+            )
+            SELECT 
+                1,
+                COUNT(*),
+                COUNT(DISTINCT cil),
+                COUNT(DISTINCT pt),
+                COUNT(DISTINCT localidade),
+                COUNT(DISTINCT nib),
+                COALESCE(SUM(CASE WHEN LOWER(TRIM(estado)) = 'prog' THEN 1 ELSE 0 END), 0),
+                SUM(qtd),
+                SUM(valor),
+                AVG(qtd),
+                AVG(valor)
+            FROM bd
+        """))
+        
+        for dimensao in self.DIMENSOES_RESUMO:
+            conn.execute(text(f"""
+                INSERT INTO resumo_{dimensao} ({dimensao}, total_registros, em_progresso, valor_total, registros_com_valor)
+                SELECT 
+                    UPPER(TRIM({dimensao})),
+                    COUNT(*),
+                    SUM(CASE WHEN LOWER(TRIM(estado)) = 'prog' THEN 1 ELSE 0 END),
+                    COALESCE(SUM(valor), 0),
+                    COUNT(valor)
+                FROM bd
+                WHERE {dimensao} IS NOT NULL AND TRIM({dimensao}) != ''
+                GROUP BY UPPER(TRIM({dimensao}))
+            """))
+
+    # --- Histórico de Métricas (Séries Temporais) ---
+    def _registrar_historico(self, conn, substituir=True):
+        """Grava o instantâneo do dia a partir dos resumos materializados.
+        
+        Com substituir=False mantém um instantâneo já existente para o dia.
+        """
+        conflito_global = """DO UPDATE SET 
+                    total_registros = EXCLUDED.total_registros,
+                    registros_em_progresso = EXCLUDED.registros_em_progresso,
+                    percentual_progresso = EXCLUDED.percentual_progresso,
+                    cils_unicos = EXCLUDED.cils_unicos,
+                    pts_unicos = EXCLUDED.pts_unicos,
+                    localidades_unicas = EXCLUDED.localidades_unicas,
+                    nibs_unicos = EXCLUDED.nibs_unicos,
+                    total_qtd = EXCLUDED.total_qtd,
+                    total_valor = EXCLUDED.total_valor,
+                    media_valor = EXCLUDED.media_valor,
+                    registado_em = CURRENT_TIMESTAMP""" if substituir else "DO NOTHING"
+        conflito_pt = """DO UPDATE SET 
+                    total_registros = EXCLUDED.total_registros,
+                    em_progresso = EXCLUDED.em_progresso,
+                    percentual_progresso = EXCLUDED.percentual_progresso,
+                    valor_total = EXCLUDED.valor_total""" if substituir else "DO NOTHING"
+        
+        inseridos = conn.execute(text(f"""
+            INSERT INTO historico_metricas (
+                data, total_registros, registros_em_progresso, percentual_progresso, cils_unicos,
+                pts_unicos, localidades_unicas, nibs_unicos, total_qtd, total_valor, media_valor
+            )
+            SELECT 
+                CURRENT_DATE, total_registros, registros_em_progresso,
+                ROUND(registros_em_progresso * 100.0 / NULLIF(total_registros, 0), 2),
+                cils_unicos, pts_unicos, localidades_unicas, nibs_unicos, total_qtd, total_valor, media_valor
+            FROM resumo_global
+            WHERE id = 1
+            ON CONFLICT (data) {conflito_global}
+        """)).rowcount
+        
+        # Sem substituição, os PTs só são gravados se o instantâneo global do dia era novo
+        if substituir or inseridos:
+            conn.execute(text(f"""
+                INSERT INTO historico_pt (data, pt, total_registros, em_progresso, percentual_progresso, valor_total)
+                SELECT 
+                    CURRENT_DATE, pt, total_registros, em_progresso,
+                    ROUND(em_progresso * 100.0 / NULLIF(total_registros, 0), 2),
+                    valor_total
+                FROM resumo_pt
+                ON CONFLICT (data, pt) {conflito_pt}
+            """))
+
+    def _registrar_historico_diario(self, conn):
+        """Garante um instantâneo por dia; verificado na BD apenas uma vez por dia e processo."""
+        global _data_ultimo_historico
+        hoje = datetime.date.today()
+        if _data_ultimo_historico == hoje:
+            return
+        self._registrar_historico(conn, substituir=False)
+        _data_ultimo_historico = hoje
+
+    def _atualizar_contadores(self, conn):
+        """Recalcula os contadores de disponibilidade com uma única leitura (GROUPING SETS)."""
+        colunas = self.COLUNAS_CATALOGO
+        normalizadas = ",\n".join(f"NULLIF(UPPER(TRIM({c})), '') AS {c}" for c in colunas)
+        casos = "\n".join(f"WHEN GROUPING({c}) = 0 THEN '{c}'" for c in colunas)
+        
+        conn.execute(text("TRUNCATE contadores_disponibilidade"))
+        conn.execute(text(f"""
+            WITH base AS (
+                SELECT 
+                    {normalizadas},
+                    LOWER(TRIM(estado)) != 'prog' AS disponivel
+                FROM bd
+            ),
+            agrupado AS (
+                SELECT 
+                    CASE {casos} END AS coluna,
+                    COALESCE({', '.join(colunas)}) AS valor,
+                    COUNT(*) AS total,
+                    COUNT(*) FILTER (WHERE disponivel) AS disponiveis
+                FROM base
+                GROUP BY GROUPING SETS ({', '.join(f'({c})' for c in colunas)})
+            )
+            INSERT INTO contadores_disponibilidade (coluna, valor, total, disponiveis)
+            SELECT coluna, valor, total, disponiveis
+            FROM agrupado
+            WHERE valor IS NOT NULL
+        """))
+
+    def _expressoes_cubo(self):
+        """Expressões SQL que normalizam cada dimensão do cubo a partir de uma linha de bd."""
+        expressoes = {d: f"COALESCE(UPPER(TRIM({d})), '')" for d in self.DIMENSOES_CUBO}
+        expressoes['estado'] = "CASE WHEN LOWER(TRIM(estado)) = 'prog' THEN 'prog' ELSE '' END"
+        return expressoes
+
+    def _atualizar_cubo(self, conn):
+        """Recalcula o cubo pré-agregado a partir da tabela bd."""
+        expressoes = self._expressoes_cubo()
+        conn.execute(text("TRUNCATE cubo_bd"))
+        conn.execute(text(f"""
+            INSERT INTO cubo_bd ({", ".join(self.DIMENSOES_CUBO)}, registros, soma_valor, soma_qtd)
+            SELECT 
+                {", ".join(f"{e} AS {d}" for d, e in expressoes.items())},
+                COUNT(*),
+                COALESCE(SUM(valor), 0),
+                COALESCE(SUM(qtd), 0)
+            FROM bd
+            GROUP BY {", ".join(expressoes.values())}
+        """))
+
+    def _ctes_propagacao_estado(self):
+        """CTEs que aplicam aos resumos por dimensão, contadores, cubo e registo de alterações o efeito das linhas em 'alterados' (delta de :delta em 'prog')."""
+        ctes = []
+        if self.motor_analitico is not None:
+            # Só há quem leia o registo com o motor analítico ativo
+            ctes.append("""
+                registo_alteracoes AS (
+                    INSERT INTO alteracoes_estado (num_linha) SELECT num_linha FROM alterados
+                )
+            """)
+        for dimensao in self.DIMENSOES_RESUMO:
+            ctes.append(f"""
+                delta_{dimensao} AS (
+                    UPDATE resumo_{dimensao} r
+                    SET em_progresso = r.em_progresso + :delta * d.n
+                    FROM (
+                        SELECT UPPER(TRIM({dimensao})) AS chave, COUNT(*) AS n 
+                        FROM alterados 
+                        WHERE {dimensao} IS NOT NULL AND TRIM({dimensao}) != ''
+                        GROUP BY UPPER(TRIM({dimensao}))
+                    ) d
+                    WHERE r.{dimensao} = d.chave
+                )
+            """)
+        
+        # Contadores de disponibilidade: entrar em 'prog' consome, sair devolve
+        deltas_contadores = " UNION ALL ".join(
+            f"""SELECT '{c}' AS coluna, UPPER(TRIM({c})) AS chave, COUNT(*) AS n 
+                FROM alterados WHERE {c} IS NOT NULL AND TRIM({c}) != '' 
+                GROUP BY UPPER(TRIM({c}))"""
+            for c in self.COLUNAS_CATALOGO
+        )
+        ctes.append(f"""
+            delta_contadores AS (
+                UPDATE contadores_disponibilidade r
+                SET disponiveis = r.disponiveis - :delta * d.n
+                FROM ({deltas_contadores}) d
+                WHERE r.coluna = d.coluna AND r.valor = d.chave
+            )
+        """)
+        
+        # Cubo: as linhas alteradas saem da célula de origem e entram na de destino
+        expressoes = self._expressoes_cubo()
+        dimensoes_sem_estado = [d for d in self.DIMENSOES_CUBO if d != 'estado']
+        colunas = ", ".join(dimensoes_sem_estado)
+        ctes.append(f"""
+            agregado_cubo AS (
+                SELECT 
+                    {", ".join(f"{expressoes[d]} AS {d}" for d in dimensoes_sem_estado)},
+                    COUNT(*) AS n,
+                    COALESCE(SUM(valor), 0) AS v,
+                    COALESCE(SUM(qtd), 0) AS q
+                FROM alterados
+                GROUP BY {", ".join(expressoes[d] for d in dimensoes_sem_estado)}
+            ),
+            delta_cubo_origem AS (
+                UPDATE cubo_bd c
+                SET registros = c.registros - a.n, soma_valor = c.soma_valor - a.v, soma_qtd = c.soma_qtd - a.q
+                FROM agregado_cubo a
+                WHERE {" AND ".join(f"c.{d} = a.{d}" for d in dimensoes_sem_estado)}
+                AND c.estado = CASE WHEN :delta > 0 THEN '' ELSE 'prog' END
+            ),
+            delta_cubo_destino AS (
+                INSERT INTO cubo_bd ({colunas}, estado, registros, soma_valor, soma_qtd)
+                SELECT {colunas}, CASE WHEN :delta > 0 THEN 'prog' ELSE '' END, n, v, q
+                FROM agregado_cubo
+                ON CONFLICT ({colunas}, estado) DO UPDATE 
+                SET registros = cubo_bd.registros + EXCLUDED.registros,
+                    soma_valor = cubo_bd.soma_valor + EXCLUDED.soma_valor,
+                    soma_qtd = cubo_bd.soma_qtd + EXCLUDED.soma_qtd
+            )
+        """)
+        return ctes
+
+    def _concluir_mudanca_estado(self, conn, delta_prog):
+        """Aplica a resumo_global o saldo de 'prog' da transação e incrementa a versão dos dados.
+        
+        São as últimas instruções antes do commit: as linhas únicas de resumo_global e
+        controle_versao, comuns a todas as gerações, ficam bloqueadas o menor tempo possível.
+        """
+        conn.execute(text("""
+            UPDATE resumo_global 
+            SET registros_em_progresso = registros_em_progresso + :delta, atualizado_em = CURRENT_TIMESTAMP
+            WHERE id = 1
+        """), {'delta': delta_prog})
+        self._incrementar_versao_dados(conn)
+
+    def _executar_mudanca_estado(self, conn, update_sql, params, para_prog):
+        """Executa um UPDATE de estado em bd e propaga o efeito às estruturas derivadas na mesma instrução.
+        
+        Retorna o número de registros alterados.
+        """
+        colunas_retorno = ", ".join(dict.fromkeys(
+            self.DIMENSOES_RESUMO + self.COLUNAS_CATALOGO + self.DIMENSOES_CUBO[:-1] + ['valor', 'qtd', 'num_linha']
+        ))
+        ctes = ",".join(self._ctes_propagacao_estado())
+        query = text(f"""
+            WITH alterados AS (
+                {update_sql}
+                RETURNING {colunas_retorno}
+            ),
+            {ctes}
+            SELECT COUNT(*) FROM alterados
+        """)
+        return conn.execute(query, {**params, 'delta': 1 if para_prog else -1}).scalar()
+
+    # --- Motor Analítico (snapshot colunar opcional) ---
+    def _snapshot_analitico(self):
+        """Retorna o snapshot colunar da versão atual, ou None se o motor estiver inativo ou falhar."""
+        if self.motor_analitico is None:
+            return None
+        try:
+            return self.motor_analitico.snapshot(self.engine, self.obter_versao_dados())
+        except Exception as e:
+            logger.error(f"Motor analítico indisponível, usando PostgreSQL: {e}")
+            return None
+
+    # --- Execução Concorrente de Consultas ---
+    def executar_em_paralelo(self, tarefas):
+        """Executa funções independentes em paralelo e retorna {nome: resultado} quando todas terminam.
+        
+        Chamadas feitas a partir de uma thread do executor são executadas em série,
+        evitando que tarefas aninhadas esperem por vagas ocupadas pelas suas próprias tarefas-mãe.
+        """
+        if threading.current_thread().name.startswith("consulta"):
+            return {nome: funcao() for nome, funcao in tarefas.items()}
+        
+        add_script_run_ctx, get_script_run_ctx = _funcoes_contexto_script()
+        ctx = get_script_run_ctx() if get_script_run_ctx else None
+        
+        def _executar(funcao):
+            if ctx is not None:
+                add_script_run_ctx(threading.current_thread(), ctx)
+            return funcao()
+        
+        futuros = {nome: _executor_consultas.submit(_executar, funcao) for nome, funcao in tarefas.items()}
+        return {nome: futuro.result() for nome, futuro in futuros.items()}
+
+    def executar_consultas_concorrentes(self, consultas):
+        """Executa consultas de leitura {nome: (sql, params)}, cada uma na sua conexão do pool."""
+        def _ler(sql, params):
+            with self.engine.connect() as conn:
+                return pd.read_sql_query(text(sql), conn, params=params)
+        
+        return self.executar_em_paralelo({
+            nome: functools.partial(_ler, sql, params) for nome, (sql, params) in consultas.items()
+        })
+
+    # --- Leitura em Massa (COPY) ---
+    def ler_dataframe(self, conn, sql, params=None, via_copy=False):
+        """Executa um SELECT e devolve um DataFrame.
+        
+        Por padrão usa pd.read_sql_query (instrumentado pelo engine). Com via_copy=True, indicado
+        pelos chamadores que sabem que o resultado é grande, o resultado é transferido em CSV com
+        COPY ... TO STDOUT e convertido por um parser tipado, sem criar um tuplo Python por linha.
+        """
+        params = params or {}
+        if not via_copy:
+            return pd.read_sql_query(text(sql), conn, params=params)
+        compilado = text(sql).bindparams(**params).compile(dialect=conn.dialect)
+        cursor = conn.connection.cursor()
+        try:
+            consulta = cursor.mogrify(compilado.string, compilado.params).decode('utf-8')
+            return self._ler_via_copy(cursor, consulta, (compilado.string, compilado.params))
+        finally:
+            cursor.close()
+
+    def _ler_via_copy(self, cursor, consulta, parametrizada=None):
+        """Lê o resultado de 'consulta' (SQL já com parâmetros) via COPY em CSV.
+        
+        'parametrizada' (sql, parâmetros) é a forma passada ao gravador de consultas lentas,
+        que não vê o COPY por ser executado fora dos eventos do engine.
+        """
+        # Tipos das colunas a partir da descrição do resultado (sem ler linhas)
+        cursor.execute(f"SELECT * FROM ({consulta}) AS consulta LIMIT 0")
+        tipos = {}
+        for coluna in cursor.description:
+            if coluna.type_code in TIPOS_DECIMAIS:
+                tipos[coluna.name] = 'decimal'
+            elif coluna.type_code in TIPOS_INTEIROS:
+                tipos[coluna.name] = 'inteiro'
+            else:
+                tipos[coluna.name] = 'texto'
+        
+        buffer = io.BytesIO()
+        # NULL explícito distingue valores nulos de textos vazios. O pyarrow distingue o marcador
+        # das aspas com que o COPY escreve um texto igual a ele; o pandas não, daí um marcador único
+        nulo = '\\N' if ARROW_AVAILABLE else f"\\N{uuid.uuid4().hex}"
+        copia = f"COPY ({consulta}) TO STDOUT WITH (FORMAT csv, HEADER true, NULL '{nulo}', ENCODING 'UTF8')"
+        inicio = time.perf_counter()
+        cursor.copy_expert(copia, buffer, size=TAMANHO_BLOCO_EXPORTACAO)
+        duracao = time.perf_counter() - inicio
+        desempenho.registrar_instrucao(copia, duracao, cursor.rowcount, buffer.tell())
+        if self.gravador_lentas is not None and parametrizada is not None:
+            self.gravador_lentas.avaliar(*parametrizada, duracao, cursor.rowcount)
+        buffer.seek(0)
+        
+        if ARROW_AVAILABLE:
+            import pyarrow.csv
+            tipos_arrow = {'decimal': pyarrow.float64(), 'inteiro': pyarrow.int64(), 'texto': pyarrow.string()}
+            tabela = pyarrow.csv.read_csv(
+                buffer,
+                convert_options=pyarrow.csv.ConvertOptions(
+                    column_types={c: tipos_arrow[t] for c, t in tipos.items()},
+                    null_values=[nulo],
+                    strings_can_be_null=True,
+                    quoted_strings_can_be_null=False
+                )
+            )
+            return tabela.to_pandas()
+        
+        tipos_pandas = {'decimal': 'float64', 'inteiro': 'Int64', 'texto': str}
+        df = pd.read_csv(
+            buffer,
+            dtype={c: tipos_pandas[t] for c, t in tipos.items()},
+            keep_default_na=False,
+            na_values=[nulo]
+        )
+        # Inteiros sem nulos com o mesmo dtype que o cursor produziria
+        for coluna, tipo in tipos.items():
+            if tipo == 'inteiro' and not df[coluna].isna().any():
+                df[coluna] = df[coluna].astype('int64')
+        return df
+
     # --- Funções de Hashing e Autenticação (bcrypt) ---
     @staticmethod
     def hash_password(password):
-        """Gera um hash seguro da senha usando bcrypt."""
+        """Gera um hash seguro da senha usando bcrypt (custo alvo da secção [autenticacao])."""
         if not password or len(password.strip()) == 0:
             raise ValueError("Senha não pode ser vazia")
         # O salt é gerado automaticamente pelo bcrypt.gensalt()
-        hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        return hashed.decode('utf-8')
+        return senhas.gerar_hash(password)
 
-    def autenticar_usuario(self, username, password):
-        """Verifica as credenciais do usuário usando bcrypt."""
+    def autenticar_usuario(self, username, password, verificacoes_recentes=None):
+        """Verifica as credenciais do usuário usando bcrypt (no pool de verificação).
+        
+        Utilizadores com falhas recentes em excesso são recusados antes de qualquer bcrypt;
+        hashes com custo diferente do alvo são refeitos em segundo plano após o login.
+        verificacoes_recentes (ex.: api.CacheCredenciais) dispensa o bcrypt de uma senha já
+        verificada contra o mesmo hash; a linha do utilizador é sempre relida.
+        """
         if not username or not password:
             return None
+        username = username.strip()
+        
+        bloqueio = senhas.registo_falhas.bloqueado_por(username)
+        if bloqueio:
+            logger.warning(f"Autenticação recusada para {username}: bloqueado por mais {bloqueio:.0f}s")
+            self._notificar('aviso', f"🔒 Demasiadas tentativas falhadas. Tente novamente dentro de {max(1, round(bloqueio / 60))} minuto(s).")
+            return None
             
         with self.engine.connect() as conn:
             result = conn.execute(
                 text("SELECT id, username, password_hash, nome, role FROM usuarios WHERE username = :username"),
-                {"username": username.strip()}
+                {"username": username}
             )
             usuario = result.fetchone()
         
         if usuario:
             try:
-                if bcrypt.checkpw(password.encode('utf-8'), usuario[2].encode('utf-8')):
+                if verificacoes_recentes is not None and verificacoes_recentes.contem(username, password, usuario[2]):
+                    return {'id': usuario[0], 'username': usuario[1], 'nome': usuario[3], 'role': usuario[4]}
+                if senhas.verificar(password, usuario[2]):
                     logger.info(f"Autenticação bem-sucedida para: {username}")
+                    senhas.registo_falhas.limpar(username)
+                    if senhas.precisa_rehash(usuario[2]):
+                        senhas.em_segundo_plano(self._atualizar_hash_senha, usuario[0], usuario[2], password)
+                    if verificacoes_recentes is not None:
+                        verificacoes_recentes.gravar(username, password, usuario[2])
                     return {'id': usuario[0], 'username': usuario[1], 'nome': usuario[3], 'role': usuario[4]}
-            except (ValueError, Exception) as e:
+            except ValueError as e:
+                # Hash inválido conta como tentativa falhada
                 logger.warning(f"Hash inválido ou erro na autenticação para {username}: {e}")
-                return None 
+            # Só utilizadores existentes: nomes inventados não ocupam (nem esvaziam) o registo de falhas
+            senhas.registo_falhas.registrar_falha(username)
         logger.warning(f"Tentativa de autenticação falhou para: {username}")
         return None
 
+    def _atualizar_hash_senha(self, user_id, hash_antigo, password):
+        """Refaz o hash com o custo alvo, se a senha não tiver sido alterada entretanto."""
+        try:
+            with self.engine.begin() as conn:
+                result = conn.execute(
+                    text("UPDATE usuarios SET password_hash = :hash_novo WHERE id = :id AND password_hash = :hash_antigo"),
+                    {"hash_novo": senhas.gerar_hash(password), "id": user_id, "hash_antigo": hash_antigo}
+                )
+            if result.rowcount:
+                logger.info(f"Hash da senha do usuário ID {user_id} atualizado para o custo {senhas.CUSTO_BCRYPT}")
+        except Exception as e:
+            logger.warning(f"Falha ao atualizar o hash do usuário ID {user_id}: {e}")
+
     # --- Funções de Gerenciamento de Usuários ---
     def obter_usuarios(self):
         """Retorna a lista de todos os usuários."""
@@ -300,107 +1063,239 @@ class PostgresDatabaseManager:
 
     # --- Funções de Importação e Dados (Otimizadas) ---
     def importar_csv(self, arquivo_csv, tabela='BD', colunas_esperadas=31):
-        """Importa dados do CSV para a tabela BD do PostgreSQL, otimizado para grandes volumes."""
+        """Importa dados do CSV para a tabela BD do PostgreSQL, otimizado para grandes volumes.
+        
+        Cada fase é medida (tempo, CPU, linhas, pico de memória) e a execução fica gravada em import_runs.
+        """
+        if tabela != 'BD':
+            return False
+        
+        perfil = desempenho.PerfilFases(
+            DESEMPENHO_CONFIG.get('memoria_importacao', desempenho.MEMORIA_IMPORTACAO),
+            ao_iniciar_fase=lambda fase: self._notificar('progresso', f"Importação: {fase}")
+        )
+        linhas = None
         try:
-            # 1. Detecção e Leitura
-            encoding = utils.detectar_encoding(arquivo_csv)
-            separador = utils.detectar_separador(arquivo_csv, encoding)
+            with perfil:
+                # 1. Detecção
+                with perfil.fase('deteccao'):
+                    encoding = utils.detectar_encoding(arquivo_csv)
+                    separador = utils.detectar_separador(arquivo_csv, encoding)
 
-            if tabela == 'BD':
-                df_novo = pd.read_csv(arquivo_csv, sep=separador, encoding=encoding, 
-                                      on_bad_lines='skip', header=None, low_memory=False) 
+                # 2. Leitura
+                with perfil.fase('leitura') as fase:
+                    df_novo = pd.read_csv(arquivo_csv, sep=separador, encoding=encoding, 
+                                          on_bad_lines='skip', header=None, low_memory=False) 
+                    linhas = fase['linhas'] = len(df_novo)
                 
                 if len(df_novo.columns) < colunas_esperadas:
-                    st.error(f"❌ O arquivo BD deve ter pelo menos {colunas_esperadas} colunas. Encontradas: {len(df_novo.columns)}")
+                    self._notificar('erro', f"❌ O arquivo BD deve ter pelo menos {colunas_esperadas} colunas. Encontradas: {len(df_novo.columns)}")
+                    self._registrar_execucao_importacao(perfil, arquivo_csv, linhas, False, "Colunas insuficientes")
                     return False
                 
-                # Mapeamento de colunas
-                column_mapping = {
-                    0: 'cil', 1: 'prod', 2: 'contador', 3: 'leitura', 4: 'mat_contador',
-                    5: 'med_fat', 6: 'qtd', 7: 'valor', 8: 'situacao', 9: 'acordo',
-                    10: 'nib', 11: 'seq', 12: 'localidade', 13: 'pt', 14: 'desv',
-                    15: 'mat_leitura', 16: 'desc_uni', 17: 'est_contr', 18: 'anomalia', 19: 'id',
-                    20: 'produto', 21: 'nome', 22: 'criterio', 23: 'desc_tp_cli', 24: 'tip',
-                    25: 'sit_div', 26: 'modelo', 27: 'lat', 28: 'long', 29: 'est_inspec',
-                    30: 'estado'
-                }
-                
-                df_novo.rename(columns=column_mapping, inplace=True)
-                
-                # 2. Tratamento e Limpeza
-                for col in ['criterio', 'pt', 'localidade', 'nib', 'cil', 'estado']:
-                    if col in df_novo.columns:
-                        df_novo[col] = df_novo[col].fillna('').astype(str).str.strip()
-
-                df_novo['criterio'] = df_novo['criterio'].str.upper()
-                df_novo['pt'] = df_novo['pt'].str.upper()
-                df_novo['localidade'] = df_novo['localidade'].str.upper()
-                df_novo['estado'] = df_novo['estado'].str.lower()
-                
-                # Tratamento de Numéricos
-                df_novo['qtd'] = pd.to_numeric(df_novo['qtd'], errors='coerce').fillna(0)
-                df_novo['valor'] = pd.to_numeric(df_novo['valor'], errors='coerce').fillna(0)
-                df_novo['lat'] = pd.to_numeric(df_novo['lat'], errors='coerce')
-                df_novo['long'] = pd.to_numeric(df_novo['long'], errors='coerce')
+                # 3. Tratamento e Limpeza
+                with perfil.fase('limpeza', linhas):
+                    df_novo = self._limpar_dataframe_bd(df_novo)
                 
-                # 3. Operações no BD
+                # 4. Operações no BD
                 with self.engine.connect() as conn:
-                    # Criar tabela temporária
-                    df_novo.to_sql('bd_temp_import', conn, if_exists='replace', index=False)
+                    with perfil.fase('carga_temporaria', linhas):
+                        df_novo.to_sql('bd_temp_import', conn, if_exists='replace', index=False)
+                    df_novo = None
                     
                     # Preservar estado 'prog' existente
-                    update_query = text("""
-                        UPDATE bd_temp_import as new 
-                        SET estado = 'prog' 
-                        FROM bd as old
-                        WHERE new.cil = old.cil AND old.estado = 'prog'
-                    """)
-                    result = conn.execute(update_query)
-                    st.info(f"O estado 'prog' foi preservado para {result.rowcount} registro(s) durante a importação.")
+                    with perfil.fase('preservacao_prog') as fase:
+                        result = conn.execute(text("""
+                            UPDATE bd_temp_import as new 
+                            SET estado = 'prog' 
+                            FROM bd as old
+                            WHERE new.cil = old.cil AND old.estado = 'prog'
+                        """))
+                        fase['linhas'] = result.rowcount
+                    self._notificar('info', f"O estado 'prog' foi preservado para {result.rowcount} registro(s) durante a importação.")
                     
                     # Substituir a tabela BD
-                    conn.execute(text("DROP TABLE IF EXISTS bd CASCADE"))
-                    conn.execute(text("ALTER TABLE bd_temp_import RENAME TO bd"))
-                    conn.commit()
+                    with perfil.fase('substituicao', linhas):
+                        conn.execute(text("DROP TABLE IF EXISTS bd CASCADE"))
+                        conn.execute(text("ALTER TABLE bd_temp_import RENAME TO bd"))
+                        self._criar_indices_bd(conn)
+                    with perfil.fase('resumos', linhas):
+                        self._atualizar_resumos(conn)
+                        self._atualizar_contadores(conn)
+                        self._atualizar_cubo(conn)
+                        self._registrar_historico(conn)
+                        self._incrementar_versao_dados(conn, importacao=True)
+                    with perfil.fase('commit'):
+                        conn.commit()
 
-                self.ordenar_tabela_bd()
-                logger.info(f"CSV importado com sucesso: {len(df_novo)} registros")
-                return True
+            self._registrar_execucao_importacao(perfil, arquivo_csv, linhas, True)
+            self.ordenar_tabela_bd()
+            logger.info(f"CSV importado com sucesso: {linhas} registros em {perfil.duracao_total:.1f}s")
+            return True
             
         except Exception as e:
             error_msg = f"❌ Erro ao importar arquivo para PostgreSQL: {str(e)}"
-            st.error(error_msg)
+            self._notificar('erro', error_msg)
             logger.error(error_msg)
+            self._registrar_execucao_importacao(perfil, arquivo_csv, linhas, False, str(e))
             return False
 
+    def _limpar_dataframe_bd(self, df_novo):
+        """Nomeia as 31 colunas do ficheiro BD e normaliza texto e numéricos."""
+        # Mapeamento de colunas
+        column_mapping = {
+            0: 'cil', 1: 'prod', 2: 'contador', 3: 'leitura', 4: 'mat_contador',
+            5: 'med_fat', 6: 'qtd', 7: 'valor', 8: 'situacao', 9: 'acordo',
+            10: 'nib', 11: 'seq', 12: 'localidade', 13: 'pt', 14: 'desv',
+            15: 'mat_leitura', 16: 'desc_uni', 17: 'est_contr', 18: 'anomalia', 19: 'id',
+            20: 'produto', 21: 'nome', 22: 'criterio', 23: 'desc_tp_cli', 24: 'tip',
+            25: 'sit_div', 26: 'modelo', 27: 'lat', 28: 'long', 29: 'est_inspec',
+            30: 'estado'
+        }
+        
+        df_novo.rename(columns=column_mapping, inplace=True)
+        
+        for col in ['criterio', 'pt', 'localidade', 'nib', 'cil', 'estado']:
+            if col in df_novo.columns:
+                df_novo[col] = df_novo[col].fillna('').astype(str).str.strip()
+
+        df_novo['criterio'] = df_novo['criterio'].str.upper()
+        df_novo['pt'] = df_novo['pt'].str.upper()
+        df_novo['localidade'] = df_novo['localidade'].str.upper()
+        df_novo['estado'] = df_novo['estado'].str.lower()
+        
+        # Tratamento de Numéricos
+        df_novo['qtd'] = pd.to_numeric(df_novo['qtd'], errors='coerce').fillna(0)
+        df_novo['valor'] = pd.to_numeric(df_novo['valor'], errors='coerce').fillna(0)
+        df_novo['lat'] = pd.to_numeric(df_novo['lat'], errors='coerce')
+        df_novo['long'] = pd.to_numeric(df_novo['long'], errors='coerce')
+        
+        # Chave sequencial de desempate da paginação do relatório
+        df_novo['num_linha'] = range(1, len(df_novo) + 1)
+        return df_novo
+
+    def _registrar_execucao_importacao(self, perfil, arquivo_csv, linhas, sucesso, erro=None):
+        """Grava o perfil da importação em import_runs (falhas aqui não afetam a importação)."""
+        try:
+            tamanho = arquivo_csv.getbuffer().nbytes if hasattr(arquivo_csv, 'getbuffer') else None
+            with self.engine.connect() as conn:
+                conn.execute(text("""
+                    INSERT INTO import_runs (arquivo, tamanho_bytes, linhas, sucesso, erro, duracao_s, fases)
+                    VALUES (:arquivo, :tamanho, :linhas, :sucesso, :erro, :duracao, CAST(:fases AS JSONB))
+                """), {
+                    'arquivo': getattr(arquivo_csv, 'name', None),
+                    'tamanho': tamanho,
+                    'linhas': linhas,
+                    'sucesso': sucesso,
+                    'erro': erro,
+                    'duracao': perfil.duracao_total,
+                    'fases': json.dumps(perfil.fases)
+                })
+                conn.commit()
+        except Exception as e:
+            logger.warning(f"Não foi possível gravar o perfil da importação: {e}")
+
+    def obter_execucoes_importacao(self, limite=20):
+        """Importações mais recentes, com a lista de fases medidas em cada uma."""
+        try:
+            with self.engine.connect() as conn:
+                return pd.read_sql_query(text("""
+                    SELECT id, iniciado_em, arquivo, tamanho_bytes, linhas, sucesso, erro, duracao_s, fases
+                    FROM import_runs
+                    ORDER BY id DESC
+                    LIMIT :limite
+                """), conn, params={'limite': int(limite)})
+        except Exception as e:
+            logger.error(f"Erro ao obter execuções de importação: {e}")
+            return pd.DataFrame()
+
     def ordenar_tabela_bd(self):
         """Placeholder: A ordenação física é desabilitada. A ordenação será feita nas QUERIES."""
-        st.info("ℹ️ Ordenação da tabela BD física desabilitada para otimização de performance.")
+        self._notificar('info', "ℹ️ Ordenação da tabela BD física desabilitada para otimização de performance.")
         return True
 
-    @st.cache_data(ttl=60, show_spinner=False)
-    def obter_valores_unicos_com_contagem(_self, coluna, tabela='bd'):
+    def obter_catalogo_filtros(self):
+        """Obtém, para cada coluna filtrável, a lista de (valor, total, disponíveis)."""
+        return self._obter_catalogo_filtros(self.obter_versao_dados())
+
+    @cache.em_cache_local(ttl=CACHE_TTL_VERSIONADO)
+    @cache.em_cache_compartilhado
+    def _obter_catalogo_filtros(_self, versao_dados):
+        """Lê o catálogo a partir da tabela de contadores; o cache é invalidado pela versão dos dados."""
+        with _self.engine.connect() as conn:
+            df = pd.read_sql_query(text("""
+                SELECT coluna, valor, total, disponiveis
+                FROM contadores_disponibilidade
+                ORDER BY coluna, valor
+            """), conn)
+        
+        catalogo = {c: [] for c in _self.COLUNAS_CATALOGO}
+        for coluna, valor, total, disponiveis in df.itertuples(index=False):
+            if coluna in catalogo:
+                catalogo[coluna].append((valor, int(total), int(disponiveis)))
+        logger.debug(f"Catálogo de filtros lido: {len(df)} valores em {len(catalogo)} colunas")
+        return catalogo
+
+    def _valores_do_catalogo(self, coluna, tabela):
+        """Retorna as entradas do catálogo para a coluna, ou None se ela não for coberta."""
+        coluna_sql = self.MAPEAMENTO_COLUNAS.get(coluna.lower(), coluna.lower())
+        if tabela != 'bd' or coluna_sql not in self.COLUNAS_CATALOGO:
+            return None
+        return self.obter_catalogo_filtros()[coluna_sql]
+
+    def obter_valores_unicos_com_contagem(self, coluna, tabela='bd'):
         """Obtém dicionário {valor: count} de registros disponíveis."""
         try:
-            with _self.engine.connect() as conn:
-                coluna_sql = _self.MAPEAMENTO_COLUNAS.get(coluna.lower(), coluna.lower())
-                
-                query = text(f"""
-                    SELECT UPPER(TRIM({coluna_sql})) as valor, COUNT(*) as qtd
-                    FROM {tabela}
-                    WHERE {coluna_sql} IS NOT NULL 
-                    AND TRIM({coluna_sql}) != '' 
-                    AND LOWER(TRIM(estado)) != 'prog'
-                    GROUP BY UPPER(TRIM({coluna_sql}))
-                    ORDER BY valor
-                """)
-                
-                df = pd.read_sql_query(query, conn)
-                return dict(zip(df['valor'], df['qtd']))
+            coluna_sql = self.MAPEAMENTO_COLUNAS.get(coluna.lower(), coluna.lower())
+            if tabela == 'bd' and coluna_sql in self.COLUNAS_CATALOGO:
+                # Leitura indexada dos contadores mantidos na mesma transação das escritas
+                with self.engine.connect() as conn:
+                    df = pd.read_sql_query(text("""
+                        SELECT valor, disponiveis
+                        FROM contadores_disponibilidade
+                        WHERE coluna = :coluna AND disponiveis > 0
+                        ORDER BY valor
+                    """), conn, params={'coluna': coluna_sql})
+                return dict(zip(df['valor'], df['disponiveis']))
+            return self._obter_valores_unicos_com_contagem(coluna, tabela, self.obter_versao_dados())
         except Exception as e:
-            st.error(f"Erro ao obter contagens: {e}")
+            self._notificar('erro', f"Erro ao obter contagens: {e}")
             return {}
 
+    @cache.em_cache_local(ttl=CACHE_TTL_VERSIONADO)
+    @cache.em_cache_compartilhado
+    def _obter_valores_unicos_com_contagem(_self, coluna, tabela, versao_dados):
+        """Consulta as contagens por valor; o cache é invalidado pela versão dos dados."""
+        with _self.engine.connect() as conn:
+            coluna_sql = _self.MAPEAMENTO_COLUNAS.get(coluna.lower(), coluna.lower())
+            
+            query = text(f"""
+                SELECT UPPER(TRIM({coluna_sql})) as valor, COUNT(*) as qtd
+                FROM {tabela}
+                WHERE {coluna_sql} IS NOT NULL 
+                AND TRIM({coluna_sql}) != '' 
+                AND LOWER(TRIM(estado)) != 'prog'
+                GROUP BY UPPER(TRIM({coluna_sql}))
+                ORDER BY valor
+            """)
+            
+            df = pd.read_sql_query(query, conn)
+            return dict(zip(df['valor'], df['qtd']))
+
+    def obter_consultas_lentas(self, limite=100):
+        """Consultas lentas mais recentes gravadas pelo módulo de desempenho."""
+        try:
+            with self.engine.connect() as conn:
+                return pd.read_sql_query(text("""
+                    SELECT id, registado_em, duracao_ms, linhas, sql, parametros, plano
+                    FROM slow_queries
+                    ORDER BY id DESC
+                    LIMIT :limite
+                """), conn, params={'limite': int(limite)})
+        except Exception as e:
+            logger.error(f"Erro ao obter consultas lentas: {e}")
+            return pd.DataFrame()
+
     def obter_historico_geracao(self):
         """Retorna os últimos 20 registros de geração."""
         try:
@@ -424,33 +1319,56 @@ class PostgresDatabaseManager:
             logger.error(f"Erro ao obter histórico: {e}")
             return pd.DataFrame()
 
-    @st.cache_data(ttl=3600, show_spinner=False)
-    def obter_valores_unicos(_self, coluna, tabela='bd'):
+    def obter_valores_unicos(self, coluna, tabela='bd'):
         """Obtém valores únicos de uma coluna, com cache para melhor performance."""
         try:
-            with _self.engine.connect() as conn:
-                # Usa o nome mapeado ou o original se não estiver no mapeamento
-                coluna_sql = _self.MAPEAMENTO_COLUNAS.get(coluna.lower(), coluna.lower())
-                    
-                query = text(f"""
-                    SELECT DISTINCT UPPER(TRIM({coluna_sql})) as valor_unico
-                    FROM {tabela} 
-                    WHERE {coluna_sql} IS NOT NULL 
-                    AND TRIM({coluna_sql}) != '' 
-                    AND TRIM(UPPER({coluna_sql})) NOT IN ('NONE', 'NULL')
-                    ORDER BY valor_unico
-                """)
-                
-                df = pd.read_sql_query(query, conn)
-                valores = df['valor_unico'].tolist()
-                logger.debug(f"Valores únicos obtidos para {coluna}: {len(valores)} valores")
-                return valores
+            entradas = self._valores_do_catalogo(coluna, tabela)
+            if entradas is not None:
+                return [valor for valor, _, _ in entradas if valor not in ('NONE', 'NULL')]
+            return self._obter_valores_unicos(coluna, tabela, self.obter_versao_dados())
         except Exception as e:
-            st.error(f"❌ Erro ao obter valores únicos para {coluna}: {e}")
+            self._notificar('erro', f"❌ Erro ao obter valores únicos para {coluna}: {e}")
             return []
 
-    def gerar_folhas_trabalho(self, tipo_folha, valor_selecionado, quantidade_folhas, quantidade_nibs, cils_validos=None, criterio_tipo=None, criterio_valor=None, user_name=None):
-        """Gera folhas de trabalho com filtragem e ordenação no SQL."""
+    @cache.em_cache_local(ttl=CACHE_TTL_VERSIONADO)
+    @cache.em_cache_compartilhado
+    def _obter_valores_unicos(_self, coluna, tabela, versao_dados):
+        """Consulta os valores únicos; o cache é invalidado pela versão dos dados."""
+        with _self.engine.connect() as conn:
+            # Usa o nome mapeado ou o original se não estiver no mapeamento
+            coluna_sql = _self.MAPEAMENTO_COLUNAS.get(coluna.lower(), coluna.lower())
+                
+            query = text(f"""
+                SELECT DISTINCT UPPER(TRIM({coluna_sql})) as valor_unico
+                FROM {tabela} 
+                WHERE {coluna_sql} IS NOT NULL 
+                AND TRIM({coluna_sql}) != '' 
+                AND TRIM(UPPER({coluna_sql})) NOT IN ('NONE', 'NULL')
+                ORDER BY valor_unico
+            """)
+            
+            df = pd.read_sql_query(query, conn)
+            valores = df['valor_unico'].tolist()
+            logger.debug(f"Valores únicos obtidos para {coluna}: {len(valores)} valores")
+            return valores
+
+    def _candidatos_estimados(self, conn, tipo_folha, valor_selecionado, cils_validos):
+        """Limite superior dos registros lidos pela geração (CILs pedidos ou contador de disponíveis)."""
+        if tipo_folha == "AVULSO":
+            return len(cils_validos or [])
+        if not valor_selecionado:
+            return self.contar_registros_bd() or 0
+        # Leitura pela chave primária do contador mantido pelas escritas
+        return conn.execute(text("""
+            SELECT disponiveis FROM contadores_disponibilidade WHERE coluna = :coluna AND valor = :valor
+        """), {'coluna': tipo_folha.lower(), 'valor': valor_selecionado.strip().upper()}).scalar() or 0
+
+    def gerar_folhas_trabalho(self, tipo_folha, valor_selecionado, quantidade_folhas, quantidade_nibs, cils_validos=None, criterio_tipo=None, criterio_valor=None, user_name=None, propagar_erros=False):
+        """Gera folhas de trabalho com filtragem e ordenação no SQL.
+        
+        Em erro devolve (None, []), como sem registros; com propagar_erros=True a exceção
+        é relançada depois de registada (a API distingue assim falhas de resultados vazios).
+        """
         try:
             with self.engine.connect() as conn:
                 
@@ -502,7 +1420,10 @@ class PostgresDatabaseManager:
                 where_clause = f"WHERE {' AND '.join(where_conditions)}" if where_conditions else ""
                 full_query = f"{select_clause} {where_clause} {order_by_clause}"
                 
-                df = pd.read_sql_query(text(full_query), conn, params=query_params)
+                df = self.ler_dataframe(
+                    conn, full_query, query_params,
+                    via_copy=self._candidatos_estimados(conn, tipo_folha, valor_selecionado, cils_validos) >= LIMIAR_LEITURA_COPY
+                )
 
                 if tipo_folha == "AVULSO" and cils_validos:
                     cils_encontrados = set(df['cil'].unique()) if not df.empty else set()
@@ -523,43 +1444,42 @@ class PostgresDatabaseManager:
                 quantidade_folhas = min(quantidade_folhas, folhas_possiveis)
                 
                 folhas = []
-                total_registros_atualizados = 0
-                
                 for i in range(quantidade_folhas):
                     nibs_na_folha = nibs_unicos[i * quantidade_nibs: (i + 1) * quantidade_nibs].tolist()
                     folha_df = df[df['nib'].isin(nibs_na_folha)].copy()
                     folha_df['FOLHA'] = i + 1
                     folhas.append(folha_df)
+                
+                # 4. Atualização de Estado (APENAS SE NÃO FOR AVULSO)
+                if tipo_folha != "AVULSO":
+                    # Um só UPDATE para todas as folhas: os resumos e contadores ficam bloqueados só no fim da transação
+                    update_where_conditions = ["LOWER(TRIM(estado)) != 'prog'"]
+                    update_params = {'nibs': nibs_unicos[:quantidade_folhas * quantidade_nibs].tolist()}
                     
-                    # 4. Atualização de Estado (APENAS SE NÃO FOR AVULSO)
-                    if tipo_folha != "AVULSO":
-                        update_where_conditions = ["LOWER(TRIM(estado)) != 'prog'"]
-                        update_params = {'nibs': nibs_na_folha}
-                        
-                        if criterio_tipo and criterio_valor:
-                            coluna_criterio = self.MAPEAMENTO_CRITERIOS.get(criterio_tipo)
-                            if coluna_criterio:
-                                update_where_conditions.append(f"UPPER(TRIM({coluna_criterio})) = :criterio_valor")
-                                update_params['criterio_valor'] = criterio_valor.strip().upper()
-
-                        if tipo_folha == "PT" or tipo_folha == "LOCALIDADE":
-                            coluna_filtro = 'pt' if tipo_folha == "PT" else 'localidade'
-                            update_where_conditions.append(f"UPPER(TRIM({coluna_filtro})) = :valor_update")
-                            update_params['valor_update'] = valor_selecionado.strip().upper()
-                        
-                        update_query = text(f"""
-                            UPDATE bd SET estado = 'prog' 
-                            WHERE nib = ANY(:nibs) AND {' AND '.join(update_where_conditions)}
-                        """)
-                        
-                        result = conn.execute(update_query, update_params)
-                        total_registros_atualizados += result.rowcount
-                    else:
-                        # Se for Avulso, conta os registros mas não atualiza
-                        total_registros_atualizados += len(folha_df)
-            
+                    if criterio_tipo and criterio_valor:
+                        coluna_criterio = self.MAPEAMENTO_CRITERIOS.get(criterio_tipo)
+                        if coluna_criterio:
+                            update_where_conditions.append(f"UPPER(TRIM({coluna_criterio})) = :criterio_valor")
+                            update_params['criterio_valor'] = criterio_valor.strip().upper()
+
+                    if tipo_folha == "PT" or tipo_folha == "LOCALIDADE":
+                        coluna_filtro = 'pt' if tipo_folha == "PT" else 'localidade'
+                        update_where_conditions.append(f"UPPER(TRIM({coluna_filtro})) = :valor_update")
+                        update_params['valor_update'] = valor_selecionado.strip().upper()
+                    
+                    update_sql = f"""
+                        UPDATE bd SET estado = 'prog' 
+                        WHERE nib = ANY(:nibs) AND {' AND '.join(update_where_conditions)}
+                    """
+                    
+                    total_registros_atualizados = self._executar_mudanca_estado(conn, update_sql, update_params, para_prog=True)
+                    if total_registros_atualizados > 0:
+                        self._concluir_mudanca_estado(conn, total_registros_atualizados)
+                else:
+                    # Se for Avulso, conta os registros mas não atualiza
+                    total_registros_atualizados = sum(len(folha_df) for folha_df in folhas)
                 conn.commit()
-                st.success(f"✅ Estado atualizado para 'prog' em {total_registros_atualizados} registros.")
+                self._notificar('sucesso', f"✅ Estado atualizado para 'prog' em {total_registros_atualizados} registros.")
                 logger.info(f"Folhas geradas: {quantidade_folhas}, registros atualizados: {total_registros_atualizados}")
                 
                 # 5. Registrar no log de geração
@@ -592,8 +1512,10 @@ class PostgresDatabaseManager:
             
         except Exception as e:
             error_msg = f"❌ Erro ao gerar folhas no Postgres: {str(e)}"
-            st.error(error_msg)
+            self._notificar('erro', error_msg)
             logger.error(error_msg)
+            if propagar_erros:
+                raise
             return None, []
 
     def simular_folhas_trabalho(self, tipo_folha, valor_selecionado, quantidade_folhas, quantidade_nibs, cils_validos=None, criterio_tipo=None, criterio_valor=None):
@@ -688,142 +1610,311 @@ class PostgresDatabaseManager:
                 valor_sql = valor.strip().upper() if valor else ""
                 
                 if tipo == 'PT':
-                    query = text("UPDATE bd SET estado = '' WHERE LOWER(TRIM(estado)) = 'prog' AND UPPER(TRIM(pt)) = :valor")
+                    query = "UPDATE bd SET estado = '' WHERE LOWER(TRIM(estado)) = 'prog' AND UPPER(TRIM(pt)) = :valor"
                     params = {"valor": valor_sql}
                 elif tipo == 'LOCALIDADE':
-                    query = text("UPDATE bd SET estado = '' WHERE LOWER(TRIM(estado)) = 'prog' AND UPPER(TRIM(localidade)) = :valor")
+                    query = "UPDATE bd SET estado = '' WHERE LOWER(TRIM(estado)) = 'prog' AND UPPER(TRIM(localidade)) = :valor"
                     params = {"valor": valor_sql}
                 elif tipo == 'AVULSO':
-                    query = text("UPDATE bd SET estado = '' WHERE LOWER(TRIM(estado)) = 'prog'")
+                    query = "UPDATE bd SET estado = '' WHERE LOWER(TRIM(estado)) = 'prog'"
                     params = {}
                 else:
                     return False, "Tipo de reset inválido."
                     
-                result = conn.execute(query, params)
+                registros_afetados = self._executar_mudanca_estado(conn, query, params, para_prog=False)
+                if registros_afetados > 0:
+                    self._concluir_mudanca_estado(conn, -registros_afetados)
                 conn.commit()
-                registros_afetados = result.rowcount
                 logger.info(f"Reset de estado: {tipo} - {valor}, {registros_afetados} registros afetados")
                 return True, registros_afetados
                 
         except Exception as e:
             error_msg = f"❌ Erro ao resetar o estado no Postgres: {str(e)}"
-            st.error(error_msg)
+            self._notificar('erro', error_msg)
             logger.error(error_msg)
             return False, 0
 
     # --- NOVOS MÉTODOS PARA RELATÓRIOS E DASHBOARDS ---
     
-    @st.cache_data(ttl=1800, show_spinner=False)
-    def obter_estatisticas_gerais(_self):
+    def contar_registros_bd(self):
+        """Número de registros da tabela bd (barra lateral), sem varrer a tabela.
+        
+        Retorna None em caso de erro.
+        """
+        try:
+            return self._contar_registros_bd(self.obter_versao_dados())
+        except Exception as e:
+            logger.error(f"Erro ao contar registros: {e}")
+            return None
+
+    @cache.em_cache_local(ttl=CACHE_TTL_VERSIONADO)
+    @cache.em_cache_compartilhado
+    def _contar_registros_bd(_self, versao_dados):
+        """Contador mantido em resumo_global (recalculado em cada importação);
+        sem ele, a estimativa do catálogo (pg_class.reltuples).
+        """
+        with _self.engine.connect() as conn:
+            total = conn.execute(text("SELECT total_registros FROM resumo_global WHERE id = 1")).scalar()
+            if total is None:
+                # reltuples é -1 numa tabela ainda não analisada
+                total = conn.execute(text(
+                    "SELECT GREATEST(reltuples, 0)::BIGINT FROM pg_class WHERE oid = 'bd'::regclass"
+                )).scalar()
+        return int(total or 0)
+
+    def obter_estatisticas_gerais(self):
         """Obtém estatísticas gerais do sistema para dashboard."""
         try:
-            with _self.engine.connect() as conn:
-                # Estatísticas principais
-                stats_query = text("""
-                    SELECT 
-                        COUNT(*) as total_registros,
-                        COUNT(DISTINCT cil) as cils_unicos,
-                        COUNT(DISTINCT pt) as pts_unicos,
-                        COUNT(DISTINCT localidade) as localidades_unicas,
-                        COUNT(DISTINCT nib) as nibs_unicos,
-                        SUM(CASE WHEN LOWER(TRIM(estado)) = 'prog' THEN 1 ELSE 0 END) as registros_em_progresso,
-                        SUM(qtd) as total_qtd,
-                        SUM(valor) as total_valor,
-                        AVG(qtd) as media_qtd,
-                        AVG(valor) as media_valor
-                    FROM bd
-                """)
-                
-                stats_df = pd.read_sql_query(stats_query, conn)
-                
-                return {
-                    'estatisticas_gerais': stats_df.iloc[0].to_dict() if not stats_df.empty else {}
-                }
-                
+            return self._obter_estatisticas_gerais(self.obter_versao_dados())
         except Exception as e:
             logger.error(f"Erro ao obter estatísticas: {e}")
             return {}
+
+    @cache.em_cache_local(ttl=CACHE_TTL_VERSIONADO)
+    @cache.em_cache_compartilhado
+    def _obter_estatisticas_gerais(_self, versao_dados):
+        """Calcula as estatísticas gerais; o cache é invalidado pela versão dos dados."""
+        with _self.engine.connect() as conn:
+            # Estatísticas principais (lidas do resumo materializado)
+            stats_query = text("""
+                SELECT 
+                    total_registros,
+                    cils_unicos,
+                    pts_unicos,
+                    localidades_unicas,
+                    nibs_unicos,
+                    registros_em_progresso,
+                    total_qtd,
+                    total_valor,
+                    media_qtd,
+                    media_valor
+                FROM resumo_global
+                WHERE id = 1
+            """)
+
+            stats_df = pd.read_sql_query(stats_query, conn)
+
+            return {
+                'estatisticas_gerais': stats_df.iloc[0].to_dict() if not stats_df.empty else {}
+            }
     
-    @st.cache_data(ttl=1800, show_spinner=False)
-    def obter_metricas_operacionais(_self):
+    def obter_metricas_operacionais(self):
         """Obtém métricas operacionais para relatórios."""
         try:
-            with _self.engine.connect() as conn:
-                # Eficiência por PT
-                eficiencia_pt_query = text("""
-                    SELECT 
-                        UPPER(TRIM(pt)) as pt,
-                        COUNT(*) as total_registros,
-                        SUM(CASE WHEN LOWER(TRIM(estado)) = 'prog' THEN 1 ELSE 0 END) as em_progresso,
-                        ROUND(SUM(CASE WHEN LOWER(TRIM(estado)) = 'prog' THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) as percentual_progresso,
-                        SUM(valor) as valor_total,
-                        AVG(valor) as valor_medio
-                    FROM bd
-                    WHERE pt IS NOT NULL AND TRIM(pt) != ''
-                    GROUP BY UPPER(TRIM(pt))
-                    HAVING COUNT(*) > 10
-                    ORDER BY total_registros DESC
-                    LIMIT 15
-                """)
-                
-                eficiencia_pt_df = pd.read_sql_query(eficiencia_pt_query, conn)
-                
-                # Top localidades por valor
-                top_localidades_query = text("""
-                    SELECT 
-                        UPPER(TRIM(localidade)) as localidade,
-                        COUNT(*) as total_registros,
-                        SUM(valor) as valor_total,
-                        AVG(valor) as valor_medio
-                    FROM bd
-                    WHERE localidade IS NOT NULL AND TRIM(localidade) != ''
-                    GROUP BY UPPER(TRIM(localidade))
-                    ORDER BY valor_total DESC
-                    LIMIT 15
-                """)
-                
-                top_localidades_df = pd.read_sql_query(top_localidades_query, conn)
-                
-                # Distribuição geográfica (com coordenadas)
-                geolocalizacao_query = text("""
-                    SELECT 
-                        lat,
-                        long,
-                        COUNT(*) as densidade,
-                        SUM(valor) as valor_total
-                    FROM bd
-                    WHERE lat IS NOT NULL AND long IS NOT NULL 
-                    AND lat != 0 AND long != 0
-                    GROUP BY lat, long
-                    HAVING COUNT(*) > 1
-                """)
-                
-                geolocalizacao_df = pd.read_sql_query(geolocalizacao_query, conn)
-                
-                return {
-                    'eficiencia_pt': eficiencia_pt_df.to_dict('records'),
-                    'top_localidades': top_localidades_df.to_dict('records'),
-                    'geolocalizacao': geolocalizacao_df.to_dict('records')
-                }
-                
+            snapshot = self._snapshot_analitico()
+            if snapshot is not None:
+                return snapshot.metricas_operacionais()
+            return self._obter_metricas_operacionais(self.obter_versao_dados())
         except Exception as e:
             logger.error(f"Erro ao obter métricas operacionais: {e}")
             return {}
 
-    @st.cache_data(ttl=1800, show_spinner=False)
-    def obter_dados_para_dashboard(_self, criterio, valor_filtro=None):
+    @cache.em_cache_local(ttl=CACHE_TTL_VERSIONADO)
+    @cache.em_cache_compartilhado
+    def _obter_metricas_operacionais(_self, versao_dados):
+        """Calcula as métricas operacionais; o cache é invalidado pela versão dos dados."""
+        consultas = {
+            # Eficiência por PT (resumo materializado)
+            'eficiencia_pt': ("""
+                SELECT 
+                    pt,
+                    total_registros,
+                    em_progresso,
+                    ROUND(em_progresso * 100.0 / total_registros, 2) as percentual_progresso,
+                    valor_total,
+                    valor_total / NULLIF(registros_com_valor, 0) as valor_medio
+                FROM resumo_pt
+                WHERE total_registros > 10
+                ORDER BY total_registros DESC
+                LIMIT 15
+            """, {}),
+            # Top localidades por valor (resumo materializado)
+            'top_localidades': ("""
+                SELECT 
+                    localidade,
+                    total_registros,
+                    valor_total,
+                    valor_total / NULLIF(registros_com_valor, 0) as valor_medio
+                FROM resumo_localidade
+                ORDER BY valor_total DESC
+                LIMIT 15
+            """, {})
+        }
+
+        resultados = _self.executar_consultas_concorrentes(consultas)
+        return {nome: df.to_dict('records') for nome, df in resultados.items()}
+
+    def obter_historico_metricas(self, dias=90, pts=None):
+        """Séries temporais dos instantâneos diários: {'global': [...], 'por_pt': [...]}.
+        
+        Lê apenas as tabelas de histórico; 'pts' restringe a série por PT.
+        """
+        try:
+            return self._obter_historico_metricas(
+                int(dias), tuple(sorted(pts or [])), datetime.date.today(), self.obter_versao_dados()
+            )
+        except Exception as e:
+            logger.error(f"Erro ao obter histórico de métricas: {e}")
+            return {}
+
+    @cache.em_cache_local(ttl=CACHE_TTL_VERSIONADO)
+    @cache.em_cache_compartilhado
+    def _obter_historico_metricas(_self, dias, pts, data_referencia, versao_dados):
+        """Consulta o histórico; o cache é invalidado pela versão dos dados e pela data."""
+        inicio = data_referencia - datetime.timedelta(days=dias)
+        consultas = {
+            'global': ("""
+                SELECT 
+                    data, total_registros, registros_em_progresso, percentual_progresso,
+                    nibs_unicos, total_valor, media_valor
+                FROM historico_metricas
+                WHERE data >= :inicio
+                ORDER BY data
+            """, {'inicio': inicio})
+        }
+        if pts:
+            consultas['por_pt'] = ("""
+                SELECT data, pt, total_registros, em_progresso, percentual_progresso, valor_total
+                FROM historico_pt
+                WHERE data >= :inicio AND pt = ANY(:pts)
+                ORDER BY data, pt
+            """, {'inicio': inicio, 'pts': list(pts)})
+
+        resultados = _self.executar_consultas_concorrentes(consultas)
+        return {nome: df.to_dict('records') for nome, df in resultados.items()}
+
+    def consultar_cubo(self, dimensoes=None, filtros=None):
+        """Fatia o cubo pré-agregado: agrupa pelas 'dimensoes' após aplicar 'filtros' {dimensao: valor}.
+        
+        Retorna um DataFrame com as dimensões e as medidas registros, em_progresso, soma_valor e soma_qtd.
+        """
+        dimensoes = [d for d in (dimensoes or []) if d in self.DIMENSOES_CUBO]
+        filtros = {d: v for d, v in (filtros or {}).items() if d in self.DIMENSOES_CUBO and v is not None}
+        try:
+            return self._consultar_cubo(tuple(dimensoes), tuple(sorted(filtros.items())), self.obter_versao_dados())
+        except Exception as e:
+            logger.error(f"Erro ao consultar cubo: {e}")
+            return pd.DataFrame()
+
+    @cache.em_cache_local(ttl=CACHE_TTL_VERSIONADO)
+    @cache.em_cache_compartilhado
+    def _consultar_cubo(_self, dimensoes, filtros, versao_dados):
+        """Agrega o cubo (nunca a tabela bd); o cache é invalidado pela versão dos dados."""
+        params = {}
+        condicoes = ["registros > 0"]
+        for i, (dimensao, valor) in enumerate(filtros):
+            condicoes.append(f"{dimensao} = :filtro_{i}")
+            params[f'filtro_{i}'] = valor.lower().strip() if dimensao == 'estado' else valor.upper().strip()
+        
+        selecao = "".join(f"{d}, " for d in dimensoes)
+        agrupamento = f"GROUP BY {', '.join(dimensoes)}" if dimensoes else ""
+        query = text(f"""
+            SELECT 
+                {selecao}
+                SUM(registros)::BIGINT AS registros,
+                COALESCE(SUM(registros) FILTER (WHERE estado = 'prog'), 0)::BIGINT AS em_progresso,
+                SUM(soma_valor) AS soma_valor,
+                SUM(soma_qtd) AS soma_qtd
+            FROM cubo_bd
+            WHERE {' AND '.join(condicoes)}
+            {agrupamento}
+            ORDER BY registros DESC
+        """)
+        with _self.engine.connect() as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    def pre_carregar_dashboard(self, criterio, valor_filtro=None):
+        """Aquece em paralelo os caches usados pelas seções do dashboard."""
+        self.obter_versao_dados()
+        self.executar_em_paralelo({
+            'estatisticas': self.obter_estatisticas_gerais,
+            'valores_criterio': functools.partial(self.obter_valores_unicos, criterio.lower()),
+            'dados_criterio': functools.partial(self.obter_dados_para_dashboard, criterio, valor_filtro)
+        })
+
+    def obter_densidade_geografica(self, resolucao=0.01, limite=None):
+        """Obtém a densidade de registros agregada numa grelha de 'resolucao' graus."""
+        limite = min(int(limite or self.LIMITE_PONTOS_MAPA), self.LIMITE_PONTOS_MAPA)
+        try:
+            snapshot = self._snapshot_analitico()
+            if snapshot is not None:
+                return snapshot.densidade_geografica(float(resolucao), limite)
+            return self._obter_densidade_geografica(float(resolucao), limite, self.obter_versao_dados())
+        except Exception as e:
+            logger.error(f"Erro ao obter densidade geográfica: {e}")
+            return []
+
+    @cache.em_cache_local(ttl=CACHE_TTL_VERSIONADO)
+    @cache.em_cache_compartilhado
+    def _obter_densidade_geografica(_self, resolucao, limite, versao_dados):
+        """Agrega as coordenadas por célula da grelha no SQL; devolve no máximo 'limite' células."""
+        with _self.engine.connect() as conn:
+            # Cada célula é representada pelo seu centro
+            geolocalizacao_query = text("""
+                SELECT 
+                    (FLOOR(lat / :resolucao) + 0.5) * :resolucao as lat,
+                    (FLOOR(long / :resolucao) + 0.5) * :resolucao as long,
+                    COUNT(*) as densidade,
+                    SUM(valor) as valor_total
+                FROM bd
+                WHERE lat IS NOT NULL AND long IS NOT NULL 
+                AND lat != 0 AND long != 0
+                GROUP BY FLOOR(lat / :resolucao), FLOOR(long / :resolucao)
+                ORDER BY densidade DESC
+                LIMIT :limite
+            """)
+
+            geolocalizacao_df = pd.read_sql_query(
+                geolocalizacao_query, conn, params={'resolucao': resolucao, 'limite': limite}
+            )
+            return geolocalizacao_df.to_dict('records')
+
+    def obter_dados_para_dashboard(self, criterio, valor_filtro=None):
         """Obtém dados específicos para o dashboard baseado no critério selecionado."""
         try:
-            with _self.engine.connect() as conn:
-                # Mapear o nome do critério para a coluna no banco
-                mapeamento_colunas = {
-                    'Criterio': 'criterio',
-                    'Anomalia': 'anomalia',
-                    'EST_CTR': 'est_contr'
-                }
-                
-                coluna_sql = mapeamento_colunas.get(criterio, criterio.lower())
-                
+            snapshot = self._snapshot_analitico()
+            if snapshot is not None:
+                coluna_sql = self.MAPEAMENTO_CRITERIOS.get(criterio, criterio.lower())
+                if coluna_sql in analitica.DIMENSOES:
+                    filtro = valor_filtro.upper().strip() if valor_filtro and valor_filtro != "Todos" else None
+                    return snapshot.distribuicao(coluna_sql, criterio.lower(), filtro)
+            return self._obter_dados_para_dashboard(criterio, valor_filtro, self.obter_versao_dados())
+        except Exception as e:
+            logger.error(f"Erro ao obter dados para dashboard ({criterio}): {e}")
+            return {}
+
+    @cache.em_cache_local(ttl=CACHE_TTL_VERSIONADO)
+    @cache.em_cache_compartilhado
+    def _obter_dados_para_dashboard(_self, criterio, valor_filtro, versao_dados):
+        """Agrega os dados do critério; o cache é invalidado pela versão dos dados."""
+        with _self.engine.connect() as conn:
+            # Mapear o nome do critério para a coluna no banco
+            mapeamento_colunas = {
+                'Criterio': 'criterio',
+                'Anomalia': 'anomalia',
+                'EST_CTR': 'est_contr'
+            }
+
+            coluna_sql = mapeamento_colunas.get(criterio, criterio.lower())
+
+            params = {}
+
+            if coluna_sql in _self.DIMENSOES_RESUMO:
+                # Dimensão com resumo materializado: evita a leitura completa de bd
+                query = f"""
+                    SELECT 
+                        {coluna_sql} as {criterio.lower()},
+                        total_registros as quantidade,
+                        valor_total as total_valor,
+                        valor_total / NULLIF(registros_com_valor, 0) as valor_medio
+                    FROM resumo_{coluna_sql}
+                    WHERE 1=1
+                """
+
+                if valor_filtro and valor_filtro != "Todos":
+                    query += f" AND {coluna_sql} = :valor_filtro"
+                    params['valor_filtro'] = valor_filtro.upper().strip()
+            else:
                 # Query base
                 query = f"""
                     SELECT 
@@ -835,67 +1926,201 @@ class PostgresDatabaseManager:
                     WHERE {coluna_sql} IS NOT NULL 
                     AND TRIM({coluna_sql}) != ''
                 """
-                
-                params = {}
-                
+
                 # Aplicar filtro se especificado
                 if valor_filtro and valor_filtro != "Todos":
                     query += f" AND UPPER(TRIM({coluna_sql})) = :valor_filtro"
                     params['valor_filtro'] = valor_filtro.upper().strip()
-                
+
                 query += f" GROUP BY UPPER(TRIM({coluna_sql}))"
-                
-                # Ordenar por quantidade (mais relevante para dashboard)
-                query += " ORDER BY quantidade DESC, total_valor DESC"
-                
-                df_resultado = pd.read_sql_query(text(query), conn, params=params)
-                
-                return {
-                    'distribuicao_criterio': df_resultado.to_dict('records')
-                }
-                
-        except Exception as e:
-            logger.error(f"Erro ao obter dados para dashboard ({criterio}): {e}")
-            return {}
+
+            # Ordenar por quantidade (mais relevante para dashboard)
+            query += " ORDER BY quantidade DESC, total_valor DESC"
+
+            df_resultado = pd.read_sql_query(text(query), conn, params=params)
+
+            return {
+                'distribuicao_criterio': df_resultado.to_dict('records')
+            }
     
-    def gerar_relatorio_detalhado(_self, filtros=None):
-        """Gera relatório detalhado com base em filtros."""
+    # --- Relatório Detalhado (Página no Ecrã e Exportação em Fluxo) ---
+    def _filtros_relatorio(self, filtros, marcador=":{}"):
+        """Condições SQL e parâmetros dos filtros do relatório ('marcador' define o estilo do parâmetro)."""
+        condicoes, params = [], {}
+        for coluna, funcao in (('criterio', 'UPPER'), ('pt', 'UPPER'), ('localidade', 'UPPER'), ('estado', 'LOWER')):
+            valor = (filtros or {}).get(coluna)
+            if valor:
+                condicoes.append(f"{funcao}(TRIM({coluna})) = {marcador.format(coluna)}")
+                params[coluna] = valor.upper().strip() if funcao == 'UPPER' else valor.lower().strip()
+        return condicoes, params
+
+    def _consulta_relatorio(self, filtros, marcador=":{}"):
+        """SELECT ordenado do relatório detalhado e respetivos parâmetros."""
+        condicoes, params = self._filtros_relatorio(filtros, marcador)
+        query = f"""
+            SELECT 
+                {", ".join(COLUNAS_RELATORIO)}
+            FROM bd 
+            WHERE {" AND ".join(condicoes) if condicoes else "TRUE"}
+            ORDER BY pt, localidade, criterio
+        """
+        return query, params
+
+    def gerar_relatorio_detalhado(self, filtros=None, limite=None):
+        """Gera relatório detalhado com base em filtros (limitado a 'limite' linhas, se indicado)."""
         try:
-            with _self.engine.connect() as conn:
-                base_query = """
-                    SELECT 
-                        cil, pt, localidade, criterio, anomalia, 
-                        situacao, qtd, valor, estado, nib,
-                        desc_tp_cli, est_contr, sit_div, est_inspec
-                    FROM bd 
-                    WHERE 1=1
-                """
-                
-                params = {}
-                
-                # Aplicar filtros
-                if filtros:
-                    if filtros.get('criterio'):
-                        base_query += " AND UPPER(TRIM(criterio)) = :criterio"
-                        params['criterio'] = filtros['criterio'].upper().strip()
-                    
-                    if filtros.get('pt'):
-                        base_query += " AND UPPER(TRIM(pt)) = :pt"
-                        params['pt'] = filtros['pt'].upper().strip()
-                    
-                    if filtros.get('localidade'):
-                        base_query += " AND UPPER(TRIM(localidade)) = :localidade"
-                        params['localidade'] = filtros['localidade'].upper().strip()
-                    
-                    if filtros.get('estado'):
-                        base_query += " AND LOWER(TRIM(estado)) = :estado"
-                        params['estado'] = filtros['estado'].lower().strip()
-                
-                base_query += " ORDER BY pt, localidade, criterio"
-                
-                df = pd.read_sql_query(text(base_query), conn, params=params)
-                return df
+            query, params = self._consulta_relatorio(filtros)
+            if limite:
+                query += " LIMIT :limite"
+                params['limite'] = int(limite)
+            with self.engine.connect() as conn:
+                return self.ler_dataframe(conn, query, params, via_copy=not limite or limite >= LIMIAR_LEITURA_COPY)
                 
         except Exception as e:
             logger.error(f"Erro ao gerar relatório detalhado: {e}")
             return pd.DataFrame()
+
+    def obter_pagina_relatorio(self, filtros=None, ordenacao='pt', tamanho_pagina=100, apos=None):
+        """Uma página do relatório por paginação keyset (uma leitura indexada por página).
+        
+        'apos' é a chave da última linha da página anterior. Retorna (DataFrame, chave da
+        última linha desta página), com chave None quando não há página seguinte.
+        """
+        try:
+            colunas_ordem, direcao = self.ORDENACOES_RELATORIO.get(ordenacao, self.ORDENACOES_RELATORIO['pt'])
+            if tamanho_pagina not in self.TAMANHOS_PAGINA_RELATORIO:
+                tamanho_pagina = self.TAMANHOS_PAGINA_RELATORIO[0]
+            # Chave sem nulos (as mesmas expressões dos índices idx_bd_pagina_*)
+            chave = [self._expressao_ordem(c) for c in colunas_ordem] + ['num_linha']
+            rotulos = [f"chave_{i}" for i in range(len(chave))]
+            
+            condicoes, params = self._filtros_relatorio(filtros)
+            if apos is not None:
+                # Comparação de tuplos: continua exatamente após a última linha vista
+                operador = '>' if direcao == 'ASC' else '<'
+                marcadores = ", ".join(f":apos_{i}" for i in range(len(chave)))
+                condicoes.append(f"({', '.join(chave)}) {operador} ({marcadores})")
+                params.update({f"apos_{i}": valor for i, valor in enumerate(apos)})
+            params['limite'] = tamanho_pagina + 1
+            
+            query = f"""
+                SELECT {", ".join(COLUNAS_RELATORIO)}, {", ".join(f"{e} AS {r}" for e, r in zip(chave, rotulos))}
+                FROM bd
+                WHERE {" AND ".join(condicoes) if condicoes else "TRUE"}
+                ORDER BY {", ".join(f"{e} {direcao}" for e in chave)}
+                LIMIT :limite
+            """
+            with self.engine.connect() as conn:
+                df = pd.read_sql_query(text(query), conn, params=params)
+            
+            proxima = None
+            if len(df) > tamanho_pagina:
+                df = df.head(tamanho_pagina)
+                proxima = tuple(df[rotulos].tail(1).to_dict('records')[0].values())
+            return df.drop(columns=rotulos), proxima
+        except Exception as e:
+            logger.error(f"Erro ao obter página do relatório: {e}")
+            return pd.DataFrame(), None
+
+    def resumir_relatorio(self, filtros=None):
+        """Totais do relatório (registros, total e média de valor, em progresso) calculados no SQL."""
+        try:
+            return self._resumir_relatorio(tuple(sorted((filtros or {}).items())), self.obter_versao_dados())
+        except Exception as e:
+            logger.error(f"Erro ao resumir relatório: {e}")
+            return {}
+
+    @cache.em_cache_local(ttl=CACHE_TTL_VERSIONADO)
+    @cache.em_cache_compartilhado
+    def _resumir_relatorio(_self, filtros, versao_dados):
+        """Agrega sobre o cubo quando os filtros o permitem; caso contrário, sobre bd."""
+        filtros = dict(filtros)
+        estado = (filtros.get('estado') or '').lower().strip()
+        if not estado or estado == 'prog':
+            # Os filtros de critério, PT, localidade e 'prog' são dimensões do cubo
+            condicoes, params = [], {}
+            for coluna in ('criterio', 'pt', 'localidade'):
+                if filtros.get(coluna):
+                    condicoes.append(f"{coluna} = :{coluna}")
+                    params[coluna] = filtros[coluna].upper().strip()
+            if estado:
+                condicoes.append("estado = 'prog'")
+            query = f"""
+                SELECT 
+                    COALESCE(SUM(registros), 0)::BIGINT AS total_registros,
+                    COALESCE(SUM(soma_valor), 0) AS total_valor,
+                    SUM(soma_valor) / NULLIF(SUM(registros), 0) AS media_valor,
+                    COALESCE(SUM(registros) FILTER (WHERE estado = 'prog'), 0)::BIGINT AS registros_prog
+                FROM cubo_bd
+                WHERE {" AND ".join(condicoes) if condicoes else "TRUE"}
+            """
+        else:
+            condicoes, params = _self._filtros_relatorio(filtros)
+            query = f"""
+                SELECT 
+                    COUNT(*) AS total_registros,
+                    COALESCE(SUM(valor), 0) AS total_valor,
+                    AVG(valor) AS media_valor,
+                    COUNT(*) FILTER (WHERE LOWER(TRIM(estado)) = 'prog') AS registros_prog
+                FROM bd
+                WHERE {" AND ".join(condicoes)}
+            """
+        with _self.engine.connect() as conn:
+            return dict(conn.execute(text(query), params).mappings().one())
+
+    def exportar_relatorio_detalhado(self, filtros, destino, comprimir=True):
+        """Exporta o relatório completo para 'destino' em CSV via COPY ... TO STDOUT.
+        
+        'destino' é um caminho ou um objeto binário com write() (ex.: a resposta da API).
+        O servidor envia o resultado em blocos que são escritos diretamente no destino
+        (opcionalmente gzip), pelo que a memória usada não depende do tamanho do relatório.
+        Retorna o número de registros exportados, ou None em caso de erro.
+        """
+        conn = None
+        try:
+            query, params = self._consulta_relatorio(filtros, marcador="%({})s")
+            conn = self.engine.raw_connection()
+            with conn.cursor() as cursor:
+                copia = cursor.mogrify(query, params).decode('utf-8')
+                instrucao = f"COPY ({copia}) TO STDOUT WITH (FORMAT csv, HEADER true, ENCODING 'UTF8')"
+                e_caminho = isinstance(destino, (str, os.PathLike))
+                if e_caminho:
+                    abrir = gzip.open(destino, 'wb') if comprimir else open(destino, 'wb')
+                elif comprimir:
+                    abrir = gzip.GzipFile(fileobj=destino, mode='wb')
+                else:
+                    # Fluxo do chamador: não é fechado aqui
+                    abrir = contextlib.nullcontext(destino)
+                inicio = time.perf_counter()
+                with abrir as arquivo:
+                    # BOM para compatibilidade com o Excel (equivalente ao antigo utf-8-sig)
+                    arquivo.write(codecs.BOM_UTF8)
+                    cursor.copy_expert(instrucao, arquivo, size=TAMANHO_BLOCO_EXPORTACAO)
+                exportados = cursor.rowcount
+                desempenho.registrar_instrucao(
+                    instrucao, time.perf_counter() - inicio, exportados,
+                    os.path.getsize(destino) if e_caminho else None
+                )
+            conn.rollback()
+            logger.info(f"Relatório exportado: {exportados} registros para {destino if e_caminho else 'fluxo'}")
+            return exportados
+        except Exception as e:
+            logger.error(f"Erro ao exportar relatório detalhado: {e}")
+            return None
+        finally:
+            if conn is not None:
+                conn.close()
+
+def obter_gestor_bd(database_url, notificador=None):
+    """Retorna o gestor do processo para 'database_url', criando-o na primeira chamada.
+    
+    Na criação, aquece o pool e inicia o keepalive em segundo plano. Falhas de conexão
+    não ficam em cache: a chamada seguinte tenta novamente.
+    """
+    with _lock_gestores:
+        db_manager = _gestores.get(database_url)
+        if db_manager is None:
+            db_manager = PostgresDatabaseManager(database_url, notificador=notificador)
+            db_manager.conexoes.iniciar()
+            _gestores[database_url] = db_manager
+    return db_manager
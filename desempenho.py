@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import json
+import time
+import random
+import bisect
+import inspect
+import contextlib
+import tracemalloc
+import datetime
+import functools
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from sqlalchemy import event
+
+import cache
+
+logger = logging.getLogger(__name__)
+
+# Limites dos baldes do histograma (segundos): progressão geométrica de 0,1 ms a ~3 min
+LIMITES_BALDES = [0.0001 * 1.25 ** i for i in range(65)]
+
+# Chamadas recentes mantidas para a lista das mais lentas
+MAX_CHAMADAS_RECENTES = 1000
+
+# Padrões do gravador de consultas lentas (secção opcional [desempenho] dos secrets)
+LIMIAR_LENTA_MS = 500
+AMOSTRAGEM_EXPLAIN = 0.0
+MAX_CONSULTAS_LENTAS = 500
+# Valores dos parâmetros gravados apenas com gravar_parametros = true; as chaves sensíveis são sempre mascaradas
+GRAVAR_PARAMETROS = False
+CHAVES_SENSIVEIS = re.compile(r'pass|senha|hash|nib|token', re.IGNORECASE)
+
+# Perfil das importações: medição de memória por fase ('rss', 'tracemalloc' ou 'desligado')
+MEMORIA_IMPORTACAO = 'rss'
+INTERVALO_AMOSTRAGEM_RSS = 0.05
+
+
+# --- Histograma de Latências ---
+class Histograma:
+    """Histograma de latências com baldes fixos (memória constante por operação)."""
+
+    def __init__(self):
+        self.contagens = [0] * (len(LIMITES_BALDES) + 1)
+        self.total = 0
+        self.soma = 0.0
+        self.maximo = 0.0
+
+    def registrar(self, duracao):
+        self.contagens[bisect.bisect_left(LIMITES_BALDES, duracao)] += 1
+        self.total += 1
+        self.soma += duracao
+        self.maximo = max(self.maximo, duracao)
+
+    def percentil(self, p):
+        """Limite superior do balde que contém o percentil p (0-100)."""
+        if self.total == 0:
+            return None
+        alvo = self.total * p / 100.0
+        acumulado = 0
+        for i, contagem in enumerate(self.contagens):
+            acumulado += contagem
+            if acumulado >= alvo:
+                return min(LIMITES_BALDES[i], self.maximo) if i < len(LIMITES_BALDES) else self.maximo
+        return self.maximo
+
+
+class EstatisticaOperacao:
+    """Métricas acumuladas de uma operação (método ou instrução SQL)."""
+
+    def __init__(self):
+        self.histograma = Histograma()
+        self.linhas = 0
+        self.bytes = 0
+        self.origens_cache = {}
+
+
+# --- Registo do Processo ---
+class RegistoDesempenho:
+    """Agrega as medições de todas as sessões do processo."""
+
+    def __init__(self, max_recentes=MAX_CHAMADAS_RECENTES):
+        self._operacoes = {}
+        self._recentes = deque(maxlen=max_recentes)
+        self._lock = threading.Lock()
+        self.iniciado_em = datetime.datetime.now()
+
+    def registrar(self, tipo, nome, duracao, linhas=None, bytes_=None, origem_cache=None):
+        with self._lock:
+            estatistica = self._operacoes.get((tipo, nome))
+            if estatistica is None:
+                estatistica = self._operacoes[(tipo, nome)] = EstatisticaOperacao()
+            estatistica.histograma.registrar(duracao)
+            estatistica.linhas += linhas or 0
+            estatistica.bytes += bytes_ or 0
+            if origem_cache:
+                estatistica.origens_cache[origem_cache] = estatistica.origens_cache.get(origem_cache, 0) + 1
+            self._recentes.append({
+                'quando': datetime.datetime.now(),
+                'tipo': tipo,
+                'operacao': nome,
+                'duracao_ms': duracao * 1000,
+                'linhas': linhas,
+                'bytes': bytes_,
+                'cache': origem_cache
+            })
+
+    def resumo(self):
+        """DataFrame com chamadas, p50/p95/p99/máximo (ms), linhas, bytes e acertos de cache por operação."""
+        with self._lock:
+            linhas = []
+            for (tipo, nome), estatistica in self._operacoes.items():
+                histograma = estatistica.histograma
+                origens = estatistica.origens_cache
+                linhas.append({
+                    'tipo': tipo,
+                    'operacao': nome,
+                    'chamadas': histograma.total,
+                    'p50_ms': histograma.percentil(50) * 1000,
+                    'p95_ms': histograma.percentil(95) * 1000,
+                    'p99_ms': histograma.percentil(99) * 1000,
+                    'max_ms': histograma.maximo * 1000,
+                    'total_s': histograma.soma,
+                    'linhas': estatistica.linhas,
+                    'bytes': estatistica.bytes,
+                    'cache_acertos': sum(n for o, n in origens.items() if o != 'calculado') if origens else None,
+                    'cache_falhas': origens.get('calculado', 0) if origens else None
+                })
+        df = pd.DataFrame(linhas)
+        return df.sort_values('total_s', ascending=False).reset_index(drop=True) if not df.empty else df
+
+    def mais_lentas(self, limite=20):
+        """As chamadas mais lentas entre as recentes."""
+        with self._lock:
+            recentes = list(self._recentes)
+        return pd.DataFrame(sorted(recentes, key=lambda c: c['duracao_ms'], reverse=True)[:limite])
+
+    def limpar(self):
+        with self._lock:
+            self._operacoes.clear()
+            self._recentes.clear()
+            self.iniciado_em = datetime.datetime.now()
+
+registo = RegistoDesempenho()
+
+
+# --- Medição de Métodos ---
+def _tamanho_resultado(resultado):
+    """(linhas, bytes) aproximados do resultado de um método."""
+    if isinstance(resultado, tuple) and resultado and isinstance(resultado[0], pd.DataFrame):
+        resultado = resultado[0]
+    if isinstance(resultado, pd.DataFrame):
+        return len(resultado), int(resultado.memory_usage(index=False).sum())
+    if isinstance(resultado, list):
+        return len(resultado), None
+    return None, None
+
+def medir_metodo(nome, metodo, em_cache=False):
+    """Envolve um método registando latência, tamanho do resultado e (se em cache) a origem."""
+    @functools.wraps(metodo)
+    def wrapper(self, *args, **kwargs):
+        if em_cache:
+            cache.limpar_origem()
+        resultado = None
+        inicio = time.perf_counter()
+        try:
+            resultado = metodo(self, *args, **kwargs)
+            return resultado
+        finally:
+            duracao = time.perf_counter() - inicio
+            linhas, bytes_ = _tamanho_resultado(resultado)
+            # Sem passagem pelo cache compartilhado, o valor veio do st.cache_data
+            origem = (cache.origem_resultado() or 'sessao') if em_cache else None
+            registo.registrar('metodo', nome, duracao, linhas, bytes_, origem)
+    return wrapper
+
+def instrumentar(classe):
+    """Decorador de classe: mede todos os métodos (exceto especiais e estáticos)."""
+    for nome, atributo in list(vars(classe).items()):
+        if nome.startswith('__') or isinstance(atributo, (staticmethod, classmethod)):
+            continue
+        if inspect.isfunction(atributo) and not getattr(atributo, 'em_cache_local', False):
+            setattr(classe, nome, medir_metodo(nome, atributo))
+        elif callable(atributo):
+            # Métodos com st.cache_data (objeto de cache em vez de função)
+            setattr(classe, nome, medir_metodo(nome, atributo, em_cache=True))
+    return classe
+
+
+# --- Medição de Instruções SQL ---
+def normalizar_sql(sql, tamanho=120):
+    """Texto curto e estável da instrução (espaços colapsados) usado como nome da operação."""
+    return re.sub(r'\s+', ' ', str(sql)).strip()[:tamanho]
+
+def instrumentar_engine(engine, gravador=None):
+    """Regista a latência e as linhas de cada instrução executada pelo engine.
+    
+    Com um GravadorConsultasLentas, as instruções acima do limiar são também gravadas.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('inicio_instrucao', []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _depois(conn, cursor, statement, parameters, context, executemany):
+        duracao = time.perf_counter() - conn.info['inicio_instrucao'].pop()
+        linhas = cursor.rowcount if cursor.rowcount and cursor.rowcount > 0 else None
+        registo.registrar('sql', normalizar_sql(statement), duracao, linhas)
+        if gravador is not None:
+            gravador.avaliar(statement, parameters, duracao, linhas, executemany)
+
+    @event.listens_for(engine, "handle_error")
+    def _erro(contexto):
+        # Instrução falhou: descartar o início pendente
+        inicios = contexto.connection.info.get('inicio_instrucao') if contexto.connection is not None else None
+        if inicios:
+            inicios.pop()
+
+    return engine
+
+def registrar_instrucao(sql, duracao, linhas=None, bytes_=None):
+    """Registo manual de instruções executadas fora do engine (ex.: COPY no cursor)."""
+    registo.registrar('sql', normalizar_sql(sql), duracao, linhas, bytes_)
+
+
+# --- Perfil por Fases ---
+def _rss_mb():
+    """Memória residente atual do processo (MB), ou None fora do Linux."""
+    try:
+        with open('/proc/self/statm') as arquivo:
+            return int(arquivo.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+class PerfilFases:
+    """Tempo de parede, CPU, linhas e pico de memória de cada fase de uma operação longa.
+    
+    Modos de memória: 'rss' (amostragem da memória residente do processo numa thread,
+    barata mas inclui as outras sessões), 'tracemalloc' (apenas as alocações da operação,
+    mas torna o código Python várias vezes mais lento) ou 'desligado'.
+    """
+
+    def __init__(self, memoria=MEMORIA_IMPORTACAO, intervalo=INTERVALO_AMOSTRAGEM_RSS, ao_iniciar_fase=None):
+        self.fases = []
+        self.ao_iniciar_fase = ao_iniciar_fase
+        self.memoria = memoria
+        self.intervalo = intervalo
+        self.inicio = time.perf_counter()
+        self._pico_rss = None
+        self._parar = threading.Event()
+        self._amostrador = None
+        self._iniciou_tracemalloc = False
+
+    def __enter__(self):
+        if self.memoria == 'tracemalloc' and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._iniciou_tracemalloc = True
+        elif self.memoria == 'rss' and _rss_mb() is not None:
+            self._amostrador = threading.Thread(target=self._amostrar_rss, daemon=True, name="perfil_rss")
+            self._amostrador.start()
+        return self
+
+    def __exit__(self, *excecao):
+        if self._iniciou_tracemalloc:
+            tracemalloc.stop()
+            self._iniciou_tracemalloc = False
+        if self._amostrador is not None:
+            self._parar.set()
+            self._amostrador.join()
+            self._amostrador = None
+        return False
+
+    def _amostrar_rss(self):
+        while not self._parar.wait(self.intervalo):
+            rss = _rss_mb()
+            if rss is not None and (self._pico_rss is None or rss > self._pico_rss):
+                self._pico_rss = rss
+
+    def _iniciar_memoria(self):
+        if self._amostrador is not None:
+            self._pico_rss = _rss_mb()
+        elif tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+    def _pico_memoria(self):
+        if self._amostrador is not None:
+            return max(self._pico_rss or 0.0, _rss_mb() or 0.0)
+        if self.memoria == 'tracemalloc' and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        return None
+
+    @contextlib.contextmanager
+    def fase(self, nome, linhas=None):
+        """Mede o bloco como uma fase; o bloco pode atualizar registro['linhas']."""
+        registro = {'fase': nome, 'linhas': linhas}
+        if self.ao_iniciar_fase is not None:
+            self.ao_iniciar_fase(nome)
+        self._iniciar_memoria()
+        inicio, inicio_cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield registro
+        finally:
+            registro['duracao_s'] = time.perf_counter() - inicio
+            registro['cpu_s'] = time.thread_time() - inicio_cpu
+            registro['pico_memoria_mb'] = self._pico_memoria()
+            self.fases.append(registro)
+            registo.registrar('fase', nome, registro['duracao_s'], registro['linhas'])
+
+    @property
+    def duracao_total(self):
+        return time.perf_counter() - self.inicio
+
+
+# --- Gravador de Consultas Lentas ---
+def _sensivel(parameters):
+    return isinstance(parameters, dict) and any(CHAVES_SENSIVEIS.search(str(chave)) for chave in parameters)
+
+def redigir_parametros(parameters, valores=GRAVAR_PARAMETROS):
+    """Parâmetros a gravar: só os tipos, ou os valores com as chaves sensíveis mascaradas.
+    
+    Parâmetros posicionais (sem nome) ficam sempre reduzidos aos tipos.
+    """
+    if isinstance(parameters, dict):
+        return {
+            chave: '***' if CHAVES_SENSIVEIS.search(str(chave)) else (valor if valores else type(valor).__name__)
+            for chave, valor in parameters.items()
+        }
+    if isinstance(parameters, (list, tuple)):
+        return [type(valor).__name__ for valor in parameters]
+    return type(parameters).__name__ if parameters is not None else None
+
+# Uma única thread grava (e, por amostragem, explica) fora do caminho do pedido
+_executor_gravacao = ThreadPoolExecutor(max_workers=1, thread_name_prefix="consultas_lentas")
+
+class GravadorConsultasLentas:
+    """Grava na tabela slow_queries as instruções que excedem o limiar.
+    
+    Para uma fração 'amostragem' dos SELECT lentos, guarda também o plano de
+    EXPLAIN (ANALYZE, BUFFERS), obtido ao reexecutar a consulta numa transação
+    só de leitura. A tabela é limitada às 'maximo' entradas mais recentes.
+    """
+
+    def __init__(self, engine, limiar_ms=LIMIAR_LENTA_MS, amostragem=AMOSTRAGEM_EXPLAIN, maximo=MAX_CONSULTAS_LENTAS,
+                 gravar_parametros=GRAVAR_PARAMETROS):
+        self.engine = engine
+        self.limiar = limiar_ms / 1000.0
+        self.amostragem = amostragem
+        self.maximo = maximo
+        self.gravar_parametros = gravar_parametros
+
+    def avaliar(self, statement, parameters, duracao, linhas, executemany=False):
+        if duracao < self.limiar or executemany:
+            return
+        # O plano mostra os valores literais: sem EXPLAIN para instruções com parâmetros sensíveis
+        explicar = (self.amostragem > 0 and random.random() < self.amostragem
+                    and self._somente_leitura(statement) and not _sensivel(parameters))
+        _executor_gravacao.submit(self._gravar, statement, parameters, duracao, linhas, explicar)
+
+    @staticmethod
+    def _somente_leitura(statement):
+        """Apenas SELECT (ou WITH sem escrita) pode ser reexecutado com ANALYZE."""
+        texto = statement.lstrip().upper()
+        if not (texto.startswith('SELECT') or texto.startswith('WITH')):
+            return False
+        return re.search(r'\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|CREATE|ALTER|DROP)\b', texto) is None
+
+    def _gravar(self, statement, parameters, duracao, linhas, explicar):
+        # Conexão DBAPI direta: as instruções do gravador não passam pelos eventos do engine
+        conn = self.engine.raw_connection()
+        try:
+            plano = None
+            if explicar:
+                with conn.cursor() as cursor:
+                    try:
+                        cursor.execute("SET TRANSACTION READ ONLY")
+                        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+                        plano = "\n".join(linha[0] for linha in cursor.fetchall())
+                    except Exception as e:
+                        plano = f"EXPLAIN indisponível: {e}"
+                conn.rollback()
+            
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO slow_queries (sql, parametros, duracao_ms, linhas, plano)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, (
+                    statement,
+                    json.dumps(redigir_parametros(parameters, self.gravar_parametros), default=str, ensure_ascii=False)[:10000],
+                    duracao * 1000,
+                    linhas,
+                    plano
+                ))
+                cursor.execute("DELETE FROM slow_queries WHERE id <= (SELECT MAX(id) FROM slow_queries) - %s", (self.maximo,))
+            conn.commit()
+        except Exception as e:
+            logger.warning(f"Não foi possível gravar consulta lenta: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+
+def criar_gravador(engine, config=None):
+    """Cria o gravador a partir da configuração (limiar_lenta_ms, amostragem_explain, max_consultas_lentas,
+    gravar_parametros).
+    
+    Retorna None se o limiar for 0 ou negativo.
+    """
+    config = dict(config or {})
+    limiar = float(config.get('limiar_lenta_ms', LIMIAR_LENTA_MS))
+    if limiar <= 0:
+        return None
+    return GravadorConsultasLentas(
+        engine,
+        limiar_ms=limiar,
+        amostragem=float(config.get('amostragem_explain', AMOSTRAGEM_EXPLAIN)),
+        maximo=int(config.get('max_consultas_lentas', MAX_CONSULTAS_LENTAS)),
+        gravar_parametros=bool(config.get('gravar_parametros', GRAVAR_PARAMETROS))
+    )
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Hash e verificação de senhas (bcrypt) fora da thread do script.
+
+- as verificações correm num pool limitado de threads (o bcrypt liberta o GIL), para que
+  um pico de logins no início do turno não ocupe todos os núcleos;
+- o custo alvo é configurável e os hashes com outro custo são refeitos no login;
+- as falhas recentes por utilizador bloqueiam novas tentativas antes de qualquer bcrypt
+  (só se registam falhas de utilizadores existentes; um bloqueio ativo nunca é descartado).
+"""
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Secção opcional [autenticacao] da configuração
+AUTENTICACAO_CONFIG = config.secao("autenticacao")
+# 12 é o padrão de bcrypt.gensalt(); cada unidade a mais duplica o tempo de cada verificação
+CUSTO_BCRYPT = int(AUTENTICACAO_CONFIG.get('custo_bcrypt', 12))
+VERIFICACOES_CONCORRENTES = int(AUTENTICACAO_CONFIG.get('verificacoes_concorrentes', min(4, os.cpu_count() or 1)))
+MAX_FALHAS = int(AUTENTICACAO_CONFIG.get('max_falhas', 5))
+JANELA_FALHAS_S = float(AUTENTICACAO_CONFIG.get('janela_falhas_s', 300))
+BLOQUEIO_S = float(AUTENTICACAO_CONFIG.get('bloqueio_s', 300))
+MAX_UTILIZADORES_FALHAS = 10000
+
+_executor_senhas = ThreadPoolExecutor(max_workers=VERIFICACOES_CONCORRENTES, thread_name_prefix="bcrypt")
+
+
+# --- Hash e Verificação ---
+def gerar_hash(password, custo=CUSTO_BCRYPT):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=custo)).decode('utf-8')
+
+def custo_do_hash(password_hash):
+    """Custo (log2 das rondas) gravado no hash, ex.: '$2b$12$...' -> 12; None se inválido."""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def precisa_rehash(password_hash, custo=CUSTO_BCRYPT):
+    return custo_do_hash(password_hash) != custo
+
+def verificar(password, password_hash):
+    """Executa bcrypt.checkpw no pool de verificação e espera pelo resultado."""
+    return _executor_senhas.submit(
+        bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8')
+    ).result()
+
+def em_segundo_plano(funcao, *args):
+    """Agenda trabalho de bcrypt (ex.: refazer um hash) no mesmo pool, sem esperar."""
+    return _executor_senhas.submit(funcao, *args)
+
+
+# --- Tentativas Falhadas ---
+class RegistoFalhas:
+    """Falhas de autenticação recentes por utilizador, com bloqueio temporário."""
+
+    def __init__(self, max_falhas=MAX_FALHAS, janela=JANELA_FALHAS_S, bloqueio=BLOQUEIO_S):
+        self.max_falhas = max_falhas
+        self.janela = janela
+        self.bloqueio = bloqueio
+        # username -> [falhas, primeira_falha, bloqueado_ate]
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bloqueado_por(self, username):
+        """Segundos de bloqueio restantes para o utilizador (0 se pode tentar)."""
+        with self._lock:
+            item = self._itens.get(username)
+            if item is None:
+                return 0
+            return max(0.0, item[2] - time.time())
+
+    def registrar_falha(self, username):
+        agora = time.time()
+        with self._lock:
+            item = self._itens.pop(username, None)
+            # Nova contagem fora da janela ou depois de um bloqueio já cumprido
+            if item is None or agora - item[1] > self.janela or 0 < item[2] <= agora:
+                item = [0, agora, 0.0]
+            item[0] += 1
+            if item[0] >= self.max_falhas:
+                item[2] = agora + self.bloqueio
+                logger.warning(f"Utilizador {username} bloqueado por {self.bloqueio:.0f}s após {item[0]} falhas")
+            self._itens[username] = item
+            # Limite de memória: descarta os utilizadores com falhas mais antigas, nunca um bloqueado
+            while len(self._itens) > MAX_UTILIZADORES_FALHAS:
+                livre = next((nome for nome, valores in self._itens.items() if valores[2] <= agora), None)
+                if livre is None:
+                    break
+                del self._itens[livre]
+
+    def limpar(self, username):
+        with self._lock:
+            self._itens.pop(username, None)
+
+registo_falhas = RegistoFalhas()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Configuração dos testes: os módulos da raiz do projeto são importados diretamente.
+
+Os testes da base de dados usam um PostgreSQL local (pgserver) e são ignorados sem ele.
+"""
+import io
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def gerar_csv(linhas=3000, semente=1):
+    """CSV de 31 colunas (';', sem cabeçalho) com valores sujos, nulos e registos em 'prog'."""
+    aleatorio = random.Random(semente)
+    registos = []
+    for i in range(linhas):
+        campos = [''] * 31
+        campos[0] = f"CIL{i % 2500}"
+        campos[6] = str(aleatorio.randint(1, 9))
+        campos[7] = f"{aleatorio.random() * 100:.2f}" if aleatorio.random() > .05 else ''
+        campos[10] = f"NIB{i // 3}"
+        campos[11] = f"S{aleatorio.randint(1, 50):03d}" if aleatorio.random() > .2 else ''
+        campos[12] = aleatorio.choice(['praia ', 'Mindelo', 'SAL', 'fogo', ''])
+        campos[13] = aleatorio.choice(['pt1', 'PT2', ' pt3', 'PT4', ''])
+        campos[17] = aleatorio.choice(['A', 'B', ''])
+        campos[18] = aleatorio.choice(['X', 'Y', 'NONE'])
+        campos[22] = aleatorio.choice(['susp', 'OUTRO'])
+        campos[23] = aleatorio.choice(['DOM', 'COM'])
+        campos[27] = f"{14.9 + aleatorio.random() * 0.1:.5f}" if aleatorio.random() > .3 else ''
+        campos[28] = f"{-23.5 + aleatorio.random() * 0.1:.5f}" if campos[27] else ''
+        campos[30] = 'prog' if aleatorio.random() < .1 else ''
+        registos.append(';'.join(campos))
+    return io.BytesIO('\n'.join(registos).encode('utf-8'))
+
+
+class Relogio:
+    """Substitui time.time() no módulo senhas, para testar janelas e bloqueios sem esperas."""
+
+    def __init__(self, inicio=1000.0):
+        self.agora = inicio
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    import senhas
+
+    relogio = Relogio()
+    monkeypatch.setattr(senhas.time, 'time', relogio)
+    return relogio
+
+
+# --- Base de dados ---
+@pytest.fixture(scope="session")
+def url_bd(tmp_path_factory):
+    """URL de um PostgreSQL temporário, parado no fim da sessão."""
+    pgserver = pytest.importorskip("pgserver")
+    pytest.importorskip("psycopg2")
+    servidor = pgserver.get_server(tmp_path_factory.mktemp("pgdata"), cleanup_mode="stop")
+    return servidor.get_uri().replace("postgresql://", "postgresql+psycopg2://", 1)
+
+
+@pytest.fixture
+def db_manager(url_bd):
+    """Gestor sobre um esquema vazio (tabelas criadas por init_db) e caches limpos."""
+    from sqlalchemy import create_engine, text
+    import database
+
+    engine = create_engine(url_bd)
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE"))
+        conn.execute(text("CREATE SCHEMA public"))
+    engine.dispose()
+
+    gestor = database.PostgresDatabaseManager(url_bd)
+    gestor.cache_consultas.limpar()
+    yield gestor
+    gestor.fechar()
+
+
+@pytest.fixture
+def db_importada(db_manager):
+    """Gestor com a tabela bd importada de gerar_csv()."""
+    assert db_manager.importar_csv(gerar_csv(), 'BD')
+    return db_manager
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+
+import pytest
+
+import cache
+
+
+class Relogio:
+    """Substitui time.time() no módulo cache, para testar expiração sem esperas."""
+
+    def __init__(self, inicio=1000.0):
+        self.agora = inicio
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(cache.time, 'time', relogio)
+    return relogio
+
+
+# --- Serialização ---
+def test_serializacao_ida_e_volta():
+    valor = {'pt': ['PT1', 'PT2'], 'total': 12.5, 'linhas': [(i, f"CIL{i}") for i in range(100)], 'vazio': None}
+    dados = cache.serializar(valor)
+    assert isinstance(dados, bytes)
+    assert cache.desserializar(dados) == valor
+
+
+def test_serializacao_comprime_dados_repetitivos():
+    valor = ["PT12"] * 10000
+    assert len(cache.serializar(valor)) < len(repr(valor)) // 10
+
+
+def test_serializacao_dataframe():
+    pd = pytest.importorskip("pandas")
+    df = pd.DataFrame({'pt': ['PT1', 'PT2'], 'valor': [1.5, None]})
+    pd.testing.assert_frame_equal(cache.desserializar(cache.serializar(df)), df)
+
+
+def test_montar_chave_estavel():
+    chave = cache.montar_chave('vf', 'contagens', ('PT', 3), {'a': 1, 'b': 2})
+    assert chave.startswith('vf:contagens:')
+    assert chave == cache.montar_chave('vf', 'contagens', ('PT', 3), {'b': 2, 'a': 1})
+    assert chave != cache.montar_chave('vf', 'contagens', ('PT', 4), {'a': 1, 'b': 2})
+
+
+# --- CacheLRU ---
+def test_lru_despeja_o_menos_usado_por_numero_de_itens():
+    lru = cache.CacheLRU(max_itens=2)
+    lru.gravar('a', b'1')
+    lru.gravar('b', b'2')
+    assert lru.obter('a') == b'1'  # 'a' passa a ser o mais recente
+    lru.gravar('c', b'3')
+    assert lru.obter('b') is None
+    assert lru.obter('a') == b'1'
+    assert lru.obter('c') == b'3'
+
+
+def test_lru_despeja_por_tamanho_em_bytes():
+    lru = cache.CacheLRU(max_itens=100, max_bytes=10)
+    lru.gravar('a', b'x' * 4)
+    lru.gravar('b', b'x' * 4)
+    lru.gravar('c', b'x' * 4)
+    assert lru.obter('a') is None
+    assert lru.obter('b') is not None and lru.obter('c') is not None
+    assert lru._bytes == 8
+
+
+def test_lru_regravar_nao_duplica_bytes():
+    lru = cache.CacheLRU()
+    lru.gravar('a', b'x' * 4)
+    lru.gravar('a', b'x' * 6)
+    assert lru.obter('a') == b'x' * 6
+    assert lru._bytes == 6
+
+
+def test_lru_expira_pelo_ttl(relogio):
+    lru = cache.CacheLRU()
+    lru.gravar('a', b'1', ttl=10)
+    relogio.agora += 9
+    assert lru.obter('a') == b'1'
+    relogio.agora += 2
+    assert lru.obter('a') is None
+    assert lru._bytes == 0
+
+
+def test_lru_limpar():
+    lru = cache.CacheLRU()
+    lru.gravar('a', b'1')
+    lru.limpar()
+    assert lru.obter('a') is None
+    assert lru._bytes == 0
+
+
+# --- CacheDisco ---
+def test_disco_ida_e_volta_e_expiracao(tmp_path, relogio):
+    disco = cache.CacheDisco(str(tmp_path / "cache.sqlite3"))
+    disco.gravar('vf:a', b'dados', ttl=10)
+    assert disco.obter('vf:a') == b'dados'
+    relogio.agora += 11
+    assert disco.obter('vf:a') is None
+
+
+def test_disco_despeja_os_menos_acessados(tmp_path, relogio):
+    disco = cache.CacheDisco(str(tmp_path / "cache.sqlite3"), max_bytes=25)
+    for chave in ('a', 'b', 'c'):
+        disco.gravar(chave, b'x' * 10)
+        relogio.agora += 1
+    # 30 bytes > 25: sai o acesso mais antigo até ficar abaixo de 90% do limite
+    assert disco.obter('a') is None
+    assert disco.obter('b') == b'x' * 10
+    assert disco.obter('c') == b'x' * 10
+
+
+def test_disco_bloqueio_exclusivo_e_expiravel(tmp_path, relogio):
+    disco = cache.CacheDisco(str(tmp_path / "cache.sqlite3"))
+    assert disco.adquirir_bloqueio('k', ttl=5)
+    assert not disco.adquirir_bloqueio('k', ttl=5)
+    relogio.agora += 6
+    assert disco.adquirir_bloqueio('k', ttl=5)
+    disco.liberar_bloqueio('k')
+    assert disco.adquirir_bloqueio('k', ttl=5)
+
+
+def test_disco_limpar_remove_apenas_o_prefixo(tmp_path):
+    disco = cache.CacheDisco(str(tmp_path / "cache.sqlite3"))
+    disco.gravar('vf:a', b'1')
+    disco.gravar('vf2:a', b'2')
+    disco.limpar('vf')
+    assert disco.obter('vf:a') is None
+    assert disco.obter('vf2:a') == b'2'
+
+
+# --- CacheEmCamadas ---
+def test_camadas_calcula_uma_vez_e_reaproveita():
+    camadas = cache.CacheEmCamadas(cache.CacheLRU())
+    chamadas = []
+    calcular = lambda: chamadas.append(1) or {'total': 3}
+    assert camadas.obter_ou_calcular('vf:k', calcular) == {'total': 3}
+    assert camadas.obter_ou_calcular('vf:k', calcular) == {'total': 3}
+    assert len(chamadas) == 1
+
+
+def test_camadas_limpar_esvazia_local_e_compartilhada(tmp_path):
+    disco = cache.CacheDisco(str(tmp_path / "cache.sqlite3"))
+    camadas = cache.CacheEmCamadas(cache.CacheLRU(), disco, prefixo='vf')
+    chamadas = []
+    calcular = lambda: chamadas.append(1) or len(chamadas)
+    assert camadas.obter_ou_calcular('vf:k', calcular) == 1
+    camadas.limpar()
+    assert disco.obter('vf:k') is None
+    assert camadas.obter_ou_calcular('vf:k', calcular) == 2
+
+
+def test_camadas_calculo_unico_entre_threads(tmp_path):
+    """Vários 'processos' (cada um com o seu LRU) partilham o disco: só um calcula."""
+    caminho = str(tmp_path / "cache.sqlite3")
+    chamadas = []
+    lock_chamadas = threading.Lock()
+
+    def calcular():
+        with lock_chamadas:
+            chamadas.append(threading.get_ident())
+        time.sleep(0.3)
+        return 'resultado'
+
+    participantes = 6
+    barreira = threading.Barrier(participantes)
+    resultados = [None] * participantes
+
+    def trabalhar(indice):
+        camadas = cache.CacheEmCamadas(cache.CacheLRU(), cache.CacheDisco(caminho), espera_max=10)
+        barreira.wait()
+        resultados[indice] = camadas.obter_ou_calcular('vf:agregado', calcular)
+
+    threads = [threading.Thread(target=trabalhar, args=(i,)) for i in range(participantes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(chamadas) == 1
+    assert resultados == ['resultado'] * participantes
+
+
+def test_camadas_sem_compartilhada_se_o_disco_falhar():
+    class Indisponivel:
+        def obter(self, chave):
+            raise OSError("indisponível")
+
+        def gravar(self, chave, dados, ttl):
+            raise OSError("indisponível")
+
+        def adquirir_bloqueio(self, chave, ttl):
+            raise OSError("indisponível")
+
+    # Espera padrão (15 s): com a camada em falha calcula-se logo, sem aguardar outro processo
+    camadas = cache.CacheEmCamadas(cache.CacheLRU(), Indisponivel())
+    inicio = time.monotonic()
+    assert camadas.obter_ou_calcular('vf:k', lambda: 7) == 7
+    assert time.monotonic() - inicio < 1
+    assert camadas.obter_ou_calcular('vf:k', lambda: 8) == 7
+
+
+def test_camadas_bloqueio_com_validade_propria(tmp_path, relogio):
+    """O bloqueio dura ttl_bloqueio (não espera_max): um cálculo lento não é repetido por outro processo."""
+    disco = cache.CacheDisco(str(tmp_path / "cache.sqlite3"))
+    camadas = cache.CacheEmCamadas(cache.CacheLRU(), disco, espera_max=15, ttl_bloqueio=300)
+    outro = cache.CacheEmCamadas(cache.CacheLRU(), disco, espera_max=15, ttl_bloqueio=300)
+
+    def calcular_lento():
+        relogio.agora += 60
+        assert outro._adquirir_bloqueio('vf:k') is False
+        return 1
+
+    assert camadas.obter_ou_calcular('vf:k', calcular_lento) == 1
+
+
+# --- Decorador ---
+def test_em_cache_compartilhado_por_versao():
+    class Gestor:
+        def __init__(self):
+            self.cache_consultas = cache.CacheEmCamadas(cache.CacheLRU())
+            self.chamadas = 0
+
+        @cache.em_cache_compartilhado
+        def contar(self, coluna, versao_dados):
+            self.chamadas += 1
+            return f"{coluna}@{versao_dados}"
+
+    gestor = Gestor()
+    cache.limpar_origem()
+    assert gestor.contar('pt', 1) == 'pt@1'
+    assert cache.origem_resultado() == 'calculado'
+    cache.limpar_origem()
+    assert gestor.contar('pt', 1) == 'pt@1'
+    assert cache.origem_resultado() == 'compartilhado'
+    assert gestor.contar('pt', 2) == 'pt@2'
+    assert gestor.chamadas == 2
+
+    gestor.cache_consultas = None
+    assert gestor.contar('pt', 1) == 'pt@1'
+    assert gestor.chamadas == 3
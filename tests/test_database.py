@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+import codecs
+import gzip
+import io
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+import database
+import senhas
+
+
+def consultar(gestor, sql, **params):
+    with gestor.engine.connect() as conn:
+        return pd.read_sql_query(text(sql), conn, params=params)
+
+
+def linhas(df):
+    """Linhas como listas, com nulos normalizados (None, NaN e pd.NA comparam como None)."""
+    return df.astype(object).where(df.notna(), None).values.tolist()
+
+
+def disponiveis_por_pt(gestor):
+    """Referência: registos fora de 'prog' por PT, calculados diretamente sobre bd."""
+    df = consultar(gestor, """
+        SELECT UPPER(TRIM(pt)) AS valor, COUNT(*) AS n FROM bd
+        WHERE pt IS NOT NULL AND TRIM(pt) != '' AND LOWER(TRIM(estado)) != 'prog'
+        GROUP BY 1
+    """)
+    return dict(zip(df.valor, df.n))
+
+
+# --- Versão dos dados (chave dos caches) ---
+def test_escrita_incrementa_versao_e_invalida_cache(db_importada, url_bd):
+    versao = db_importada.obter_versao_dados()
+    antes = db_importada.obter_valores_unicos_com_contagem('PT')
+    assert antes == disponiveis_por_pt(db_importada)
+
+    df, _ = db_importada.gerar_folhas_trabalho('PT', 'PT1', 2, 5, user_name='teste')
+    assert not df.empty
+
+    assert db_importada.obter_versao_dados() == versao + 1
+    depois = db_importada.obter_valores_unicos_com_contagem('PT')
+    assert depois == disponiveis_por_pt(db_importada)
+    assert depois['PT1'] == antes['PT1'] - len(df)
+
+    # Outro processo lê a mesma versão da BD e não reutiliza a entrada anterior
+    outro = database.PostgresDatabaseManager(url_bd)
+    try:
+        assert outro.obter_versao_dados() == versao + 1
+        assert outro.obter_valores_unicos_com_contagem('PT') == depois
+    finally:
+        outro.fechar()
+
+
+def test_reposicao_de_estado_incrementa_versao(db_importada):
+    versao = db_importada.obter_versao_dados()
+    ok, afetados = db_importada.resetar_estado('AVULSO', '')
+    assert ok and afetados > 0
+    assert db_importada.obter_versao_dados() == versao + 1
+    assert db_importada.obter_valores_unicos_com_contagem('PT') == disponiveis_por_pt(db_importada)
+
+
+# --- Resumos materializados (mudanças de estado incrementais) ---
+def mudar_estados(gestor):
+    """Gerações por PT e localidade seguidas de reposições parciais e total."""
+    yield gestor.gerar_folhas_trabalho('PT', 'PT2', 3, 10, user_name='teste')
+    yield gestor.gerar_folhas_trabalho('LOCALIDADE', 'SAL', 2, 5, None, 'Criterio', 'SUSP', user_name='teste')
+    yield gestor.gerar_folhas_trabalho('PT', 'PT4', 50, 50, None, 'Anomalia', 'X', user_name='teste')
+    yield gestor.resetar_estado('LOCALIDADE', 'praia')
+    yield gestor.resetar_estado('PT', 'PT2')
+    yield gestor.resetar_estado('AVULSO', '')
+
+
+def conferir_com_recalculo(gestor, tabelas, recalcular, onde=''):
+    """As tabelas mantidas incrementalmente coincidem com um recálculo completo a partir de bd."""
+    def ler(conn):
+        lidas = {}
+        for tabela in tabelas:
+            df = pd.read_sql_query(text(f"SELECT * FROM {tabela} {onde}"), conn).drop(columns='atualizado_em', errors='ignore')
+            lidas[tabela] = df.sort_values(list(df.columns)).reset_index(drop=True)
+        return lidas
+    with gestor.engine.connect() as conn:
+        mantidas = ler(conn)
+        recalcular(conn)
+        recalculadas = ler(conn)
+        conn.rollback()
+    for tabela in tabelas:
+        pd.testing.assert_frame_equal(mantidas[tabela], recalculadas[tabela], check_dtype=False, rtol=1e-9, obj=tabela)
+
+
+def test_resumos_acompanham_as_mudancas_de_estado(db_importada):
+    tabelas = ['resumo_global'] + [f"resumo_{d}" for d in db_importada.DIMENSOES_RESUMO]
+    for resultado in mudar_estados(db_importada):
+        assert resultado[0] is not None and resultado[0] is not False
+        conferir_com_recalculo(db_importada, tabelas, db_importada._atualizar_resumos)
+    assert consultar(db_importada, "SELECT registros_em_progresso FROM resumo_global").iloc[0, 0] == 0
+
+
+# --- Contadores de disponibilidade ---
+def test_contadores_acompanham_as_mudancas_de_estado(db_importada):
+    for resultado in mudar_estados(db_importada):
+        assert resultado[0] is not None and resultado[0] is not False
+        conferir_com_recalculo(db_importada, ['contadores_disponibilidade'], db_importada._atualizar_contadores)
+        assert db_importada.obter_valores_unicos_com_contagem('PT') == disponiveis_por_pt(db_importada)
+
+
+# --- Cubo pré-agregado ---
+def test_cubo_acompanha_as_mudancas_de_estado(db_importada):
+    for resultado in mudar_estados(db_importada):
+        assert resultado[0] is not None and resultado[0] is not False
+        # Células esvaziadas pela mudança de estado podem ficar com zero registros
+        conferir_com_recalculo(db_importada, ['cubo_bd'], db_importada._atualizar_cubo, onde="WHERE registros > 0")
+
+        fatia = db_importada.consultar_cubo(['pt'], {'estado': 'prog'})
+        referencia = consultar(db_importada, """
+            SELECT UPPER(TRIM(pt)) AS pt, COUNT(*) AS n FROM bd WHERE LOWER(TRIM(estado)) = 'prog' GROUP BY 1
+        """)
+        assert dict(zip(fatia.pt, fatia.registros)) == dict(zip(referencia.pt.fillna(''), referencia.n))
+
+
+# --- Relatório paginado (keyset) ---
+@pytest.mark.parametrize("ordenacao", list(database.PostgresDatabaseManager.ORDENACOES_RELATORIO))
+def test_paginas_cobrem_o_relatorio_sem_repetir_linhas(db_importada, ordenacao):
+    # Chaves de ordenação nulas (colunas de texto vazias ficam '' na importação)
+    with db_importada.engine.begin() as conn:
+        conn.execute(text("UPDATE bd SET pt = NULL WHERE num_linha % 7 = 0"))
+        conn.execute(text("UPDATE bd SET valor = NULL WHERE num_linha % 5 = 0"))
+        conn.execute(text("UPDATE bd SET cil = NULL WHERE num_linha % 11 = 0"))
+    colunas, direcao = db_importada.ORDENACOES_RELATORIO[ordenacao]
+    chave = ", ".join(f"{db_importada._expressao_ordem(c)} {direcao}" for c in colunas)
+
+    for filtros in (None, {'localidade': 'SAL'}, {'estado': 'prog'}):
+        condicoes, params = db_importada._filtros_relatorio(filtros)
+        referencia = consultar(db_importada, f"""
+            SELECT {", ".join(database.COLUNAS_RELATORIO)} FROM bd
+            WHERE {" AND ".join(condicoes) or "TRUE"}
+            ORDER BY {chave}, num_linha {direcao}
+        """, **params)
+
+        paginas, apos = [], None
+        while True:
+            pagina, apos = db_importada.obter_pagina_relatorio(filtros, ordenacao, 250, apos)
+            paginas.append(pagina)
+            if apos is None:
+                break
+        lidas = pd.concat(paginas, ignore_index=True)
+
+        assert len(paginas) == max(1, -(-len(referencia) // 250))
+        assert lidas[colunas[0]].isna().any()
+        assert list(lidas.columns) == list(referencia.columns)
+        assert linhas(lidas) == linhas(referencia)
+
+
+# --- Leitura via COPY ---
+@pytest.fixture(params=[True, False], ids=['pyarrow', 'pandas'])
+def parser_copy(request, monkeypatch):
+    """Executa o teste com cada parser do CSV do COPY (pyarrow, se instalado, e pandas)."""
+    if request.param:
+        pytest.importorskip("pyarrow")
+    monkeypatch.setattr(database, 'ARROW_AVAILABLE', request.param)
+
+
+def test_copy_le_o_mesmo_que_o_cursor(db_manager, parser_copy):
+    sql = """
+        SELECT * FROM (VALUES
+            (1::bigint, 2::integer, 1.5::float8, 'a;b'::text, ''::text),
+            (NULL, 3, NULL, 'aspas "duplas", vírgula', NULL),
+            (3, NULL, -0.25, E'duas\\nlinhas', '\\N')
+        ) AS t(grande, pequeno, decimal, texto, vazio)
+        WHERE grande IS DISTINCT FROM :excluir
+    """
+    with db_manager.engine.connect() as conn:
+        cursor = db_manager.ler_dataframe(conn, sql, {'excluir': 99})
+        copia = db_manager.ler_dataframe(conn, sql, {'excluir': 99}, via_copy=True)
+    assert list(copia.columns) == list(cursor.columns)
+    assert linhas(copia) == linhas(cursor)
+    assert copia['vazio'].tolist()[0] == '' and copia['vazio'].isna().tolist()[1]
+
+
+def test_relatorio_completo_via_copy(db_importada, parser_copy):
+    relatorio = db_importada.gerar_relatorio_detalhado({'localidade': 'SAL'})
+    consulta, params = db_importada._consulta_relatorio({'localidade': 'SAL'})
+    with db_importada.engine.connect() as conn:
+        referencia = db_importada.ler_dataframe(conn, consulta, params)
+    assert len(relatorio) == len(referencia) > 0
+    assert sorted(map(repr, linhas(relatorio))) == sorted(map(repr, linhas(referencia)))
+
+
+# --- Exportação via COPY ---
+@pytest.mark.parametrize("comprimir", [True, False], ids=['gzip', 'csv'])
+@pytest.mark.parametrize("para_fluxo", [False, True], ids=['caminho', 'fluxo'])
+def test_exportacao_escreve_o_relatorio_completo(db_importada, tmp_path, comprimir, para_fluxo):
+    filtros = {'pt': 'PT2'}
+    if para_fluxo:
+        destino = io.BytesIO()
+        exportados = db_importada.exportar_relatorio_detalhado(filtros, destino, comprimir=comprimir)
+        conteudo = destino.getvalue()
+    else:
+        destino = tmp_path / "relatorio.csv"
+        exportados = db_importada.exportar_relatorio_detalhado(filtros, str(destino), comprimir=comprimir)
+        conteudo = destino.read_bytes()
+    if comprimir:
+        conteudo = gzip.decompress(conteudo)
+
+    assert conteudo.startswith(codecs.BOM_UTF8)
+    exportado = pd.read_csv(io.BytesIO(conteudo), encoding='utf-8-sig', keep_default_na=False, dtype=str)
+    referencia = db_importada.gerar_relatorio_detalhado(filtros)
+    assert list(exportado.columns) == database.COLUNAS_RELATORIO
+    assert exportados == len(exportado) == len(referencia) > 0
+    assert sorted(exportado['nib']) == sorted(referencia['nib'].fillna(''))
+
+
+def test_exportacao_sem_resultados_so_tem_cabecalho(db_importada):
+    destino = io.BytesIO()
+    assert db_importada.exportar_relatorio_detalhado({'pt': 'INEXISTENTE'}, destino, comprimir=False) == 0
+    assert destino.getvalue().decode('utf-8-sig').strip() == ",".join(database.COLUNAS_RELATORIO)
+
+
+# --- Autenticação e bloqueio ---
+@pytest.fixture
+def registo(relogio, monkeypatch):
+    """Registo de falhas próprio do teste, no lugar do registo global do processo."""
+    registo = senhas.RegistoFalhas(max_falhas=3, janela=60, bloqueio=120)
+    monkeypatch.setattr(senhas, 'registo_falhas', registo)
+    return registo
+
+
+def test_autenticacao_valida(db_manager, registo):
+    usuario = db_manager.autenticar_usuario(' Admin ', 'admin123')
+    assert usuario['username'] == 'Admin' and usuario['role'] == 'Administrador'
+    assert db_manager.autenticar_usuario('Admin', 'errada') is None
+    assert db_manager.autenticar_usuario('Admin', '') is None
+
+
+def test_falhas_bloqueiam_sem_verificar_a_senha(db_manager, registo, relogio, monkeypatch):
+    for _ in range(3):
+        assert db_manager.autenticar_usuario('Admin', 'errada') is None
+    assert registo.bloqueado_por('Admin') == 120
+
+    def verificar(*args):
+        raise AssertionError("bcrypt chamado durante o bloqueio")
+    with monkeypatch.context() as m:
+        m.setattr(senhas, 'verificar', verificar)
+        assert db_manager.autenticar_usuario('Admin', 'admin123') is None
+
+    # Outros utilizadores não são afetados; o bloqueio expira
+    assert db_manager.autenticar_usuario('AssAdm', 'adm123') is not None
+    relogio.agora += 121
+    assert db_manager.autenticar_usuario('Admin', 'admin123') is not None
+    assert registo.bloqueado_por('Admin') == 0
+
+
+def test_hash_invalido_conta_como_falha(db_manager, registo):
+    with db_manager.engine.begin() as conn:
+        conn.execute(text("UPDATE usuarios SET password_hash = 'lixo' WHERE username = 'Admin'"))
+    for _ in range(3):
+        assert db_manager.autenticar_usuario('Admin', 'admin123') is None
+    assert registo.bloqueado_por('Admin') > 0
+
+
+def test_utilizador_inexistente_nao_e_registado(db_manager, registo):
+    for i in range(5):
+        assert db_manager.autenticar_usuario(f'fantasma{i % 2}', 'qualquer') is None
+    assert len(registo._itens) == 0
+    assert registo.bloqueado_por('fantasma0') == 0
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import senhas
+
+
+@pytest.fixture
+def registo(relogio):
+    return senhas.RegistoFalhas(max_falhas=3, janela=60, bloqueio=120)
+
+
+# --- RegistoFalhas ---
+def test_bloqueia_ao_atingir_o_limite(registo, relogio):
+    registo.registrar_falha('ana')
+    registo.registrar_falha('ana')
+    assert registo.bloqueado_por('ana') == 0
+    registo.registrar_falha('ana')
+    assert registo.bloqueado_por('ana') == 120
+    relogio.agora += 100
+    assert registo.bloqueado_por('ana') == pytest.approx(20)
+    assert registo.bloqueado_por('rui') == 0
+
+
+def test_bloqueio_termina_e_recomeca_a_contagem(registo, relogio):
+    for _ in range(3):
+        registo.registrar_falha('ana')
+    relogio.agora += 121
+    assert registo.bloqueado_por('ana') == 0
+    # Bloqueio cumprido: a falha seguinte é a primeira de uma nova contagem
+    registo.registrar_falha('ana')
+    assert registo.bloqueado_por('ana') == 0
+    registo.registrar_falha('ana')
+    registo.registrar_falha('ana')
+    assert registo.bloqueado_por('ana') == 120
+
+
+def test_falhas_fora_da_janela_nao_acumulam(registo, relogio):
+    registo.registrar_falha('ana')
+    registo.registrar_falha('ana')
+    relogio.agora += 61
+    registo.registrar_falha('ana')
+    registo.registrar_falha('ana')
+    assert registo.bloqueado_por('ana') == 0
+    registo.registrar_falha('ana')
+    assert registo.bloqueado_por('ana') == 120
+
+
+def test_limpar_apos_login_valido(registo):
+    registo.registrar_falha('ana')
+    registo.registrar_falha('ana')
+    registo.limpar('ana')
+    registo.registrar_falha('ana')
+    registo.registrar_falha('ana')
+    assert registo.bloqueado_por('ana') == 0
+
+
+def test_utilizadores_independentes(registo):
+    for _ in range(3):
+        registo.registrar_falha('ana')
+    registo.registrar_falha('rui')
+    assert registo.bloqueado_por('ana') > 0
+    assert registo.bloqueado_por('rui') == 0
+
+
+def test_limite_de_utilizadores_descarta_os_mais_antigos(registo, monkeypatch):
+    monkeypatch.setattr(senhas, 'MAX_UTILIZADORES_FALHAS', 2)
+    registo.registrar_falha('ana')
+    registo.registrar_falha('rui')
+    registo.registrar_falha('eva')
+    assert list(registo._itens) == ['rui', 'eva']
+
+
+def test_bloqueio_sobrevive_a_pressao_de_despejo(registo, monkeypatch):
+    monkeypatch.setattr(senhas, 'MAX_UTILIZADORES_FALHAS', 10)
+    for _ in range(3):
+        registo.registrar_falha('ana')
+    for i in range(1000):
+        registo.registrar_falha(f"lixo{i}")
+    assert registo.bloqueado_por('ana') == 120
+    assert len(registo._itens) == 10
+
+
+# --- Hash e Verificação ---
+def test_hash_verificacao_e_custo():
+    password_hash = senhas.gerar_hash('segredo', custo=4)
+    assert senhas.custo_do_hash(password_hash) == 4
+    assert senhas.verificar('segredo', password_hash)
+    assert not senhas.verificar('errada', password_hash)
+    assert senhas.precisa_rehash(password_hash, custo=5)
+    assert not senhas.precisa_rehash(password_hash, custo=4)
+
+
+def test_hash_invalido():
+    assert senhas.custo_do_hash('lixo') is None
+    assert senhas.custo_do_hash(None) is None
+    with pytest.raises(ValueError):
+        senhas.verificar('segredo', 'lixo')
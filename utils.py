@@ -1,15 +1,53 @@
 # -*- coding: utf-8 -*-
 import re
 import io
+import importlib
+import importlib.util
 from io import BytesIO
 from zipfile import ZipFile
 import pandas as pd
-import chardet
-import streamlit as st
 import logging
 
 logger = logging.getLogger(__name__)
 
+# O Streamlit é importado apenas pelas funções de interface: os módulos de serviço
+# (database, CLI, API) usam este módulo sem carregar o Streamlit.
+
+# --- Importação Preguiçosa de Dependências Pesadas ---
+def modulo_disponivel(nome):
+    """Verifica se o módulo está instalado sem o importar."""
+    try:
+        return importlib.util.find_spec(nome) is not None
+    except (ImportError, ValueError):
+        return False
+
+class ModuloPreguicoso:
+    """Substituto de um módulo que só o importa no primeiro acesso a um atributo (ex.: px.bar)."""
+
+    def __init__(self, nome):
+        self._nome = nome
+        self._modulo = None
+
+    def __getattr__(self, atributo):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nome)
+        return getattr(self._modulo, atributo)
+
+def fragmento(func):
+    """Fragmento reexecutável de forma independente (st.fragment a partir do Streamlit 1.37),
+    com fallback para versões anteriores em que a função é executada normalmente."""
+    import streamlit as st
+    decorador = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda f: f)
+    return decorador(func)
+
+def notificar_streamlit(nivel, mensagem):
+    """Notificador do PostgresDatabaseManager que mostra as mensagens na página."""
+    import streamlit as st
+    exibir = {'info': st.info, 'sucesso': st.success, 'aviso': st.warning, 'erro': st.error}.get(nivel)
+    # Eventos de progresso ficam a cargo do spinner da página
+    if exibir is not None:
+        exibir(mensagem)
+
 def sanitizar_nome_arquivo(nome):
     """Remove caracteres inválidos para nomes de arquivo."""
     if not nome:
@@ -22,7 +60,17 @@ def sanitizar_nome_arquivo(nome):
 
 def generate_csv_zip(df_completo, num_nibs_por_folha, criterio_tipo, criterio_valor):
     """Gera um arquivo ZIP contendo múltiplas folhas CSV com apenas as 10 primeiras colunas."""
+    # Cria um buffer de memória para o ZIP
+    zip_buffer = BytesIO()
     
+    with ZipFile(zip_buffer, 'w') as zip_file:
+        escrever_folhas_zip(zip_file, df_completo, criterio_tipo, criterio_valor)
+
+    zip_buffer.seek(0)
+    return zip_buffer.read()
+
+def escrever_folhas_zip(zip_file, df_completo, criterio_tipo, criterio_valor, pasta=""):
+    """Acrescenta ao ZipFile aberto um CSV por folha (também usado no ZIP em fluxo da API)."""
     max_folha = df_completo['FOLHA'].max()
     
     # Define as 10 primeiras colunas que serão exportadas
@@ -35,39 +83,33 @@ def generate_csv_zip(df_completo, num_nibs_por_folha, criterio_tipo, criterio_va
     colunas_disponiveis = [col for col in colunas_exportar if col in df_completo.columns]
     
     if len(colunas_disponiveis) < len(colunas_exportar):
-        st.warning(f"⚠️ Algumas colunas não encontradas. Exportando {len(colunas_disponiveis)} colunas.")
+        logger.warning(f"⚠️ Algumas colunas não encontradas. Exportando {len(colunas_disponiveis)} colunas.")
     
     # Sanitiza o nome do critério
     criterio_nome_seguro = sanitizar_nome_arquivo(criterio_valor)
     
-    # Cria um buffer de memória para o ZIP
-    zip_buffer = BytesIO()
-    
-    with ZipFile(zip_buffer, 'w') as zip_file:
-        for i in range(1, max_folha + 1):
-            folha_df = df_completo[df_completo['FOLHA'] == i]
-            
-            # Seleciona apenas as colunas desejadas
-            folha_df_export = folha_df[colunas_disponiveis].copy()
-            
-            # Cria um buffer de memória para o arquivo CSV
-            csv_buffer = BytesIO()
-            
-            # Exporta para CSV
-            folha_df_export.to_csv(csv_buffer, index=False, encoding='utf-8-sig', sep=';')
-            csv_buffer.seek(0)
-            
-            # Nome do arquivo personalizado com o critério
-            nome_arquivo = f'{criterio_tipo}_{criterio_nome_seguro}_Folha_{i}.csv'
-            
-            # Adiciona o arquivo CSV ao ZIP
-            zip_file.writestr(nome_arquivo, csv_buffer.getvalue())
-
-    zip_buffer.seek(0)
-    return zip_buffer.read()
+    for i in range(1, max_folha + 1):
+        folha_df = df_completo[df_completo['FOLHA'] == i]
+        
+        # Seleciona apenas as colunas desejadas
+        folha_df_export = folha_df[colunas_disponiveis].copy()
+        
+        # Cria um buffer de memória para o arquivo CSV
+        csv_buffer = BytesIO()
+        
+        # Exporta para CSV
+        folha_df_export.to_csv(csv_buffer, index=False, encoding='utf-8-sig', sep=';')
+        csv_buffer.seek(0)
+        
+        # Nome do arquivo personalizado com o critério
+        nome_arquivo = f'{pasta}{criterio_tipo}_{criterio_nome_seguro}_Folha_{i}.csv'
+        
+        # Adiciona o arquivo CSV ao ZIP
+        zip_file.writestr(nome_arquivo, csv_buffer.getvalue())
 
 def extrair_cils_do_xlsx(arquivo_xlsx):
     """Extrai a lista de CILs de um arquivo XLSX com diferentes formatos."""
+    import streamlit as st
     try:
         # Lê o arquivo XLSX
         df = pd.read_excel(arquivo_xlsx)
@@ -118,6 +160,7 @@ def extrair_cils_do_xlsx(arquivo_xlsx):
 
 def detectar_encoding(arquivo_csv):
     """Detecta o encoding do arquivo."""
+    import chardet
     raw_data = arquivo_csv.getvalue()
     result = chardet.detect(raw_data)
     encoding = result['encoding'] or 'utf-8'
@@ -160,6 +203,7 @@ def safe_streamlit_call(func):
 
 def clean_session_state():
     """Limpa estados temporários da sessão para prevenir conflitos"""
+    import streamlit as st
     keys_to_keep = ['authenticated', 'user', 'page_loaded', 'last_refresh']
     keys_to_remove = [key for key in st.session_state.keys() if key not in keys_to_keep]
     
@@ -6,6 +6,7 @@ import logging
 import utils
 from views.dashboard import mostrar_dashboard_geral
 from views.reports import mostrar_relatorio_operacional, mostrar_analise_eficiencia, mostrar_relatorio_usuarios
+from views.desempenho import mostrar_desempenho, mostrar_ultima_importacao
 
 logger = logging.getLogger(__name__)
 
@@ -91,7 +92,8 @@ def manager_page(db_manager):
             "Importação", 
             "Geração de Folhas", 
             "Gerenciamento de Usuários", 
-            "Reset de Estado"
+            "Reset de Estado",
+            "Desempenho"
         ]
         selected_tab = st.selectbox("Selecione a Ação:", tabs)
         
@@ -135,6 +137,12 @@ def manager_page(db_manager):
             return
         mostrar_relatorio_usuarios(db_manager)
         
+    elif selected_tab == "Desempenho":
+        if user['role'] != 'Administrador':
+            st.error("❌ Acesso negado. Apenas Administradores podem acessar métricas de desempenho.")
+            return
+        mostrar_desempenho(db_manager)
+        
     # =========================================================================
     # ABAS ORIGINAIS (MANTIDAS)
     # =========================================================================
@@ -157,6 +165,7 @@ def manager_page(db_manager):
                         st.info("O banco de dados foi atualizado.")
                     else:
                         st.error("Falha na importação. Verifique o formato do arquivo e o console para detalhes.")
+                mostrar_ultima_importacao(db_manager)
                         
     elif selected_tab == "Geração de Folhas":
         st.markdown("### 📝 Geração de Folhas de Trabalho")
@@ -2,17 +2,30 @@
 import streamlit as st
 import pandas as pd
 import datetime
+import utils
 
-# Tentar importar Plotly com fallback
-try:
-    import plotly.express as px
-    import plotly.graph_objects as go
-    PLOTLY_AVAILABLE = True
-except ImportError:
-    PLOTLY_AVAILABLE = False
+# Plotly com fallback, importado apenas quando o primeiro gráfico é desenhado
+PLOTLY_AVAILABLE = utils.modulo_disponivel("plotly")
+px = utils.ModuloPreguicoso("plotly.express")
+
+CRITERIOS_DASHBOARD = [
+    "Criterio", 
+    "Anomalia", 
+    "EST_CTR"
+]
+
+# Níveis de detalhe do mapa: (resolução da grelha em graus, zoom, raio)
+NIVEIS_MAPA = {
+    "Regional": (0.1, 8, 30),
+    "Municipal": (0.01, 11, 20),
+    "Bairro": (0.001, 14, 12)
+}
 
 def mostrar_dashboard_geral(db_manager):
-    """Dashboard geral com métricas e visualizações com seleção de critérios."""
+    """Dashboard geral com métricas e visualizações com seleção de critérios.
+    
+    Cada seção é um fragmento: interagir com uma seção reexecuta apenas essa seção.
+    """
     st.markdown("## 📊 Dashboard Geral - Métricas do Sistema")
     
     if not PLOTLY_AVAILABLE:
@@ -26,43 +39,27 @@ def mostrar_dashboard_geral(db_manager):
         """)
         return
     
-    # --- SELEÇÃO DE CRITÉRIOS PARA DASHBOARD ---
-    st.markdown("### 🔍 Seleção de Critérios para Análise")
-    
-    criterios_dashboard = [
-        "Criterio", 
-        "Anomalia", 
-        "EST_CTR"
-    ]
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        criterio_principal = st.selectbox(
-            "Critério Principal para Análise:",
-            criterios_dashboard,
-            index=0,
-            help="Selecione o critério principal para os gráficos e análises"
-        )
-    
-    with col2:
-        # Filtro opcional por valor específico do critério
-        valores_criterio = db_manager.obter_valores_unicos(criterio_principal.lower())
-        filtro_valor = st.selectbox(
-            f"Filtrar por valor específico de {criterio_principal}:",
-            ["Todos"] + (valores_criterio if valores_criterio else []),
-            help="Opcional: selecione um valor específico para filtrar os dados"
-        )
+    # Pré-carregamento concorrente dos dados das seções: só na primeira visita e quando os dados
+    # ou os critérios mudaram (nas restantes execuções completas cada seção lê o seu cache)
+    criterio_principal = st.session_state.get("dashboard_criterio_principal", CRITERIOS_DASHBOARD[0])
+    filtro_valor = st.session_state.get("dashboard_filtro_valor", "Todos")
+    chave_pre_carga = (db_manager.obter_versao_dados(), criterio_principal, filtro_valor)
+    if st.session_state.get("dashboard_pre_carga") != chave_pre_carga:
+        with st.spinner("Carregando dados do dashboard..."):
+            db_manager.pre_carregar_dashboard(criterio_principal, filtro_valor if filtro_valor != "Todos" else None)
+        st.session_state["dashboard_pre_carga"] = chave_pre_carga
     
+    _secao_metricas_principais(db_manager)
     st.markdown("---")
-    
-    # Obter dados com base nos critérios selecionados
+    _secao_criterio(db_manager)
+    _secao_tendencias(db_manager)
+    _secao_mapa(db_manager)
+
+@utils.fragmento
+def _secao_metricas_principais(db_manager):
+    """Métricas principais (independentes dos critérios selecionados)."""
     with st.spinner("Carregando dados do dashboard..."):
         estatisticas = db_manager.obter_estatisticas_gerais()
-        metricas = db_manager.obter_metricas_operacionais()
-        
-        # Obter dados específicos para o critério selecionado
-        dados_criterio_selecionado = db_manager.obter_dados_para_dashboard(criterio_principal, filtro_valor if filtro_valor != "Todos" else None)
     
     if not estatisticas:
         st.error("❌ Não foi possível carregar os dados do dashboard.")
@@ -101,8 +98,37 @@ def mostrar_dashboard_geral(db_manager):
             value=f"{stats.get('total_valor', 0):,.2f} ECV",
             delta=None
         )
+
+@utils.fragmento
+def _secao_criterio(db_manager):
+    """Seleção de critérios, gráficos de distribuição e estatísticas detalhadas."""
+    # --- SELEÇÃO DE CRITÉRIOS PARA DASHBOARD ---
+    st.markdown("### 🔍 Seleção de Critérios para Análise")
     
-    st.markdown("---")
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        criterio_principal = st.selectbox(
+            "Critério Principal para Análise:",
+            CRITERIOS_DASHBOARD,
+            index=0,
+            key="dashboard_criterio_principal",
+            help="Selecione o critério principal para os gráficos e análises"
+        )
+    
+    with col2:
+        # Filtro opcional por valor específico do critério
+        valores_criterio = db_manager.obter_valores_unicos(criterio_principal.lower())
+        filtro_valor = st.selectbox(
+            f"Filtrar por valor específico de {criterio_principal}:",
+            ["Todos"] + (valores_criterio if valores_criterio else []),
+            key="dashboard_filtro_valor",
+            help="Opcional: selecione um valor específico para filtrar os dados"
+        )
+    
+    # Obter dados específicos para o critério selecionado
+    with st.spinner("Carregando dados do critério..."):
+        dados_criterio_selecionado = db_manager.obter_dados_para_dashboard(criterio_principal, filtro_valor if filtro_valor != "Todos" else None)
     
     # Gráficos e Visualizações baseados no critério selecionado
     col_left, col_right = st.columns(2)
@@ -165,49 +191,17 @@ def mostrar_dashboard_geral(db_manager):
             else:
                 st.info(f"ℹ️ Sem dados de valor para {criterio_principal}")
     
-    # --- ANÁLISE COMPARATIVA ENTRE CRITÉRIOS ---
-    st.markdown("### 📈 Análise Comparativa")
-    
-    col_comp1, col_comp2 = st.columns(2)
-    
-    with col_comp1:
-        # Selecionar segundo critério para comparação
-        criterio_comparacao = st.selectbox(
-            "Critério para Comparação:",
-            [c for c in criterios_dashboard if c != criterio_principal],
-            help="Selecione um segundo critério para análise comparativa"
-        )
-    
-    with col_comp2:
-        if st.button("🔄 Gerar Análise Comparativa", type="secondary"):
-            with st.spinner("Gerando análise comparativa..."):
-                dados_comparacao = db_manager.obter_dados_para_dashboard(criterio_comparacao, None)
-                
-                if dados_comparacao and 'distribuicao_criterio' in dados_comparacao:
-                    df_comparacao = pd.DataFrame(dados_comparacao['distribuicao_criterio'])
-                    if not df_comparacao.empty:
-                        st.info(f"**Distribuição por {criterio_comparacao}**")
-                        
-                        # Gráfico de comparação
-                        try:
-                            df_comparacao_top = df_comparacao.nlargest(8, 'quantidade')
-                            
-                            fig_comparacao = px.bar(
-                                df_comparacao_top,
-                                x=criterio_comparacao.lower(),
-                                y=['quantidade', 'total_valor'],
-                                title=f'Comparação: {criterio_comparacao} (Quantidade vs Valor)',
-                                barmode='group'
-                            )
-                            fig_comparacao.update_layout(xaxis_tickangle=-45)
-                            st.plotly_chart(fig_comparacao, use_container_width=True)
-                        except Exception as e:
-                            st.error(f"Erro ao criar gráfico de comparação: {e}")
-                            st.dataframe(df_comparacao[['quantidade', 'total_valor']].head(10), use_container_width=True)
-    
     # --- ESTATÍSTICAS DETALHADAS DO CRITÉRIO SELECIONADO ---
-    st.markdown(f"### 📋 Estatísticas Detalhadas - {criterio_principal}")
+    # Como o mapa: métricas, tabela e CSV só são montados quando pedidos (um expander fechado executa o conteúdo)
+    st.markdown(f"#### 📋 Estatísticas Detalhadas - {criterio_principal}")
+    if st.toggle("Mostrar estatísticas detalhadas", value=False, key="dashboard_mostrar_detalhes"):
+        _detalhes_criterio(criterio_principal, dados_criterio_selecionado)
     
+    # No mesmo fragmento: as opções de comparação dependem do critério principal
+    _secao_comparativa(db_manager, criterio_principal)
+
+def _detalhes_criterio(criterio_principal, dados_criterio_selecionado):
+    """Métricas, tabela e download da distribuição do critério principal."""
     if dados_criterio_selecionado and 'distribuicao_criterio' in dados_criterio_selecionado:
         df_detalhes = pd.DataFrame(dados_criterio_selecionado['distribuicao_criterio'])
         
@@ -248,35 +242,150 @@ def mostrar_dashboard_geral(db_manager):
                 height=400
             )
             
-            # Opção de download
-            csv = df_detalhes.to_csv(index=False, encoding='utf-8-sig')
+            # Opção de download (CSV gerado apenas no clique)
             st.download_button(
                 label="📥 Download Dados Detalhados",
-                data=csv,
+                data=lambda: df_detalhes.to_csv(index=False, encoding='utf-8-sig'),
+                on_click="ignore",
                 file_name=f"dashboard_{criterio_principal}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
                 mime="text/csv"
             )
+
+def _secao_comparativa(db_manager, criterio_principal):
+    """Análise comparativa com um segundo critério (carregada sob pedido)."""
+    # --- ANÁLISE COMPARATIVA ENTRE CRITÉRIOS ---
+    st.markdown("### 📈 Análise Comparativa")
+    
+    col_comp1, col_comp2 = st.columns(2)
+    
+    with col_comp1:
+        # Selecionar segundo critério para comparação
+        criterio_comparacao = st.selectbox(
+            "Critério para Comparação:",
+            [c for c in CRITERIOS_DASHBOARD if c != criterio_principal],
+            help="Selecione um segundo critério para análise comparativa"
+        )
     
-    # Mapa de Calor Geográfico (mantido da versão anterior)
+    with col_comp2:
+        if st.button("🔄 Gerar Análise Comparativa", type="secondary"):
+            with st.spinner("Gerando análise comparativa..."):
+                dados_comparacao = db_manager.obter_dados_para_dashboard(criterio_comparacao, None)
+                
+                if dados_comparacao and 'distribuicao_criterio' in dados_comparacao:
+                    df_comparacao = pd.DataFrame(dados_comparacao['distribuicao_criterio'])
+                    if not df_comparacao.empty:
+                        st.info(f"**Distribuição por {criterio_comparacao}**")
+                        
+                        # Gráfico de comparação
+                        try:
+                            df_comparacao_top = df_comparacao.nlargest(8, 'quantidade')
+                            
+                            fig_comparacao = px.bar(
+                                df_comparacao_top,
+                                x=criterio_comparacao.lower(),
+                                y=['quantidade', 'total_valor'],
+                                title=f'Comparação: {criterio_comparacao} (Quantidade vs Valor)',
+                                barmode='group'
+                            )
+                            fig_comparacao.update_layout(xaxis_tickangle=-45)
+                            st.plotly_chart(fig_comparacao, use_container_width=True)
+                        except Exception as e:
+                            st.error(f"Erro ao criar gráfico de comparação: {e}")
+                            st.dataframe(df_comparacao[['quantidade', 'total_valor']].head(10), use_container_width=True)
+
+@utils.fragmento
+def _secao_tendencias(db_manager):
+    """Evolução diária das métricas (lida apenas das tabelas de histórico)."""
+    st.markdown("### 📅 Tendências")
+    
+    col_t1, col_t2 = st.columns([1, 2])
+    with col_t1:
+        dias = st.selectbox("Período:", [30, 90, 365], format_func=lambda d: f"Últimos {d} dias", key="dashboard_tendencia_dias")
+    with col_t2:
+        pts = db_manager.obter_valores_unicos('pt')
+        pts_selecionados = st.multiselect("Comparar PTs:", pts if pts else [], max_selections=8, key="dashboard_tendencia_pts")
+    
+    historico = db_manager.obter_historico_metricas(dias, pts_selecionados)
+    df_global = pd.DataFrame(historico.get('global', []))
+    if df_global.empty:
+        st.info("ℹ️ Ainda não há histórico de métricas (é registado diariamente e após cada importação)")
+        return
+    
+    try:
+        col_g1, col_g2 = st.columns(2)
+        with col_g1:
+            fig_progresso = px.line(
+                df_global,
+                x='data',
+                y='percentual_progresso',
+                markers=True,
+                title='% de Registros em Progresso',
+                labels={'data': 'Data', 'percentual_progresso': '% em Progresso'}
+            )
+            st.plotly_chart(fig_progresso, use_container_width=True)
+        with col_g2:
+            fig_valor = px.line(
+                df_global,
+                x='data',
+                y='total_valor',
+                markers=True,
+                title='Valor Total',
+                labels={'data': 'Data', 'total_valor': 'Valor Total'}
+            )
+            st.plotly_chart(fig_valor, use_container_width=True)
+        
+        df_pt = pd.DataFrame(historico.get('por_pt', []))
+        if not df_pt.empty:
+            fig_pt = px.line(
+                df_pt,
+                x='data',
+                y='percentual_progresso',
+                color='pt',
+                markers=True,
+                title='% em Progresso por PT',
+                labels={'data': 'Data', 'percentual_progresso': '% em Progresso', 'pt': 'PT'}
+            )
+            st.plotly_chart(fig_pt, use_container_width=True)
+    except Exception as e:
+        st.error(f"Erro ao criar gráficos de tendência: {e}")
+        st.dataframe(df_global, use_container_width=True)
+
+@utils.fragmento
+def _secao_mapa(db_manager):
+    """Mapa de densidade geográfica (carregado apenas quando ativado)."""
+    # Mapa de Calor Geográfico (agregado em grelha no servidor)
     st.markdown("### 🗺️ Densidade Geográfica")
-    if metricas.get('geolocalizacao'):
-        df_geo = pd.DataFrame(metricas['geolocalizacao'])
+    if not st.toggle("Carregar mapa de densidade", value=False, key="dashboard_mostrar_mapa"):
+        st.caption("ℹ️ O mapa é carregado apenas quando ativado.")
+        return
+    
+    nivel_mapa = st.select_slider(
+        "Nível de detalhe do mapa:",
+        options=list(NIVEIS_MAPA.keys()),
+        value="Municipal",
+        help="Níveis mais finos mostram células menores (limitado às células mais densas)"
+    )
+    resolucao, zoom, raio = NIVEIS_MAPA[nivel_mapa]
+    dados_geo = db_manager.obter_densidade_geografica(resolucao)
+    
+    if dados_geo:
+        df_geo = pd.DataFrame(dados_geo)
         if not df_geo.empty and len(df_geo) > 1:
             try:
-                # Usar coordenadas médias como centro do mapa
-                lat_center = df_geo['lat'].mean()
-                lon_center = df_geo['long'].mean()
+                # Centro do mapa ponderado pela densidade das células
+                lat_center = (df_geo['lat'] * df_geo['densidade']).sum() / df_geo['densidade'].sum()
+                lon_center = (df_geo['long'] * df_geo['densidade']).sum() / df_geo['densidade'].sum()
                 
                 fig_mapa = px.density_mapbox(
                     df_geo,
                     lat='lat',
                     lon='long',
                     z='densidade',
-                    radius=20,
+                    radius=raio,
                     center=dict(lat=lat_center, lon=lon_center),
-                    zoom=10,
+                    zoom=zoom,
                     mapbox_style="open-street-map",
-                    title="Densidade de Registros por Localização"
+                    title=f"Densidade de Registros por Localização ({len(df_geo):,} células)"
                 )
                 st.plotly_chart(fig_mapa, use_container_width=True)
             except Exception as e:
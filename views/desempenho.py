@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import streamlit as st
+import pandas as pd
+import desempenho
+import utils
+
+# Plotly com fallback, importado apenas quando o primeiro gráfico é desenhado
+PLOTLY_AVAILABLE = utils.modulo_disponivel("plotly")
+px = utils.ModuloPreguicoso("plotly.express")
+
+TIPOS_OPERACAO = {
+    "Métodos": "metodo",
+    "Instruções SQL": "sql",
+    "Fases de Importação": "fase",
+    "Conexões": "conexao"
+}
+
+def _mostrar_medicoes(registo, df_resumo):
+    """Percentis por operação e chamadas mais lentas (medições em memória)."""
+    rotulo_tipo = st.radio("Operações:", list(TIPOS_OPERACAO.keys()), horizontal=True)
+    df_tipo = df_resumo[df_resumo['tipo'] == TIPOS_OPERACAO[rotulo_tipo]].drop(columns=['tipo'])
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Operações", len(df_tipo))
+    col2.metric("Chamadas", f"{int(df_tipo['chamadas'].sum()):,}")
+    col3.metric("Tempo Total", f"{df_tipo['total_s'].sum():,.2f} s")
+
+    # Operações com maior p95
+    if PLOTLY_AVAILABLE and not df_tipo.empty:
+        try:
+            df_top = df_tipo.nlargest(15, 'p95_ms')
+            fig_p95 = px.bar(
+                df_top,
+                x='p95_ms',
+                y='operacao',
+                orientation='h',
+                title='Top 15 Operações por Latência p95',
+                labels={'p95_ms': 'p95 (ms)', 'operacao': 'Operação'}
+            )
+            fig_p95.update_layout(yaxis={'categoryorder': 'total ascending'})
+            st.plotly_chart(fig_p95, use_container_width=True)
+        except Exception as e:
+            st.error(f"Erro ao criar gráfico de latências: {e}")
+
+    st.markdown("### 📋 Percentis por Operação")
+    st.dataframe(
+        df_tipo.style.format({
+            'p50_ms': '{:.1f}', 'p95_ms': '{:.1f}', 'p99_ms': '{:.1f}', 'max_ms': '{:.1f}', 'total_s': '{:.2f}'
+        }),
+        use_container_width=True
+    )
+
+    st.markdown("### 🐢 Chamadas Mais Lentas (recentes)")
+    df_lentas = registo.mais_lentas(20)
+    if not df_lentas.empty:
+        st.dataframe(df_lentas, use_container_width=True)
+
+def mostrar_fases_importacao(execucao):
+    """Decomposição por fase de uma execução de import_runs."""
+    df_fases = pd.DataFrame(execucao['fases'])
+    if df_fases.empty:
+        return
+    df_fases['percentual'] = df_fases['duracao_s'] / df_fases['duracao_s'].sum() * 100
+    df_fases['linhas_por_s'] = df_fases['linhas'] / df_fases['duracao_s']
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Duração Total", f"{execucao['duracao_s']:,.1f} s")
+    col2.metric("Linhas", f"{int(execucao['linhas'] or 0):,}")
+    col3.metric("Fase Mais Lenta", df_fases.loc[df_fases['duracao_s'].idxmax(), 'fase'])
+
+    if PLOTLY_AVAILABLE:
+        try:
+            fig_fases = px.bar(
+                df_fases,
+                x='duracao_s',
+                y='fase',
+                orientation='h',
+                title='Tempo por Fase da Importação',
+                labels={'duracao_s': 'Tempo (s)', 'fase': 'Fase'}
+            )
+            fig_fases.update_layout(yaxis={'categoryorder': 'array', 'categoryarray': df_fases['fase'].tolist()[::-1]})
+            st.plotly_chart(fig_fases, use_container_width=True)
+        except Exception as e:
+            st.error(f"Erro ao criar gráfico de fases: {e}")
+
+    st.dataframe(
+        df_fases[['fase', 'duracao_s', 'percentual', 'cpu_s', 'linhas', 'linhas_por_s', 'pico_memoria_mb']].style.format({
+            'duracao_s': '{:.2f}', 'percentual': '{:.1f}%', 'cpu_s': '{:.2f}',
+            'linhas_por_s': '{:,.0f}', 'pico_memoria_mb': '{:.1f}'
+        }, na_rep='-'),
+        use_container_width=True
+    )
+
+def mostrar_ultima_importacao(db_manager):
+    """Perfil da importação mais recente (mostrado logo após importar)."""
+    df_execucoes = db_manager.obter_execucoes_importacao(1)
+    if df_execucoes.empty:
+        return
+    st.markdown("#### ⏱️ Perfil da Importação")
+    mostrar_fases_importacao(df_execucoes.iloc[0])
+
+def mostrar_desempenho(db_manager):
+    """Latências medidas neste processo e consultas lentas gravadas na BD."""
+    st.markdown("## ⏱️ Desempenho")
+
+    registo = desempenho.registo
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        st.caption(f"Medições em memória deste processo desde {registo.iniciado_em.strftime('%d/%m/%Y %H:%M:%S')}")
+    with col2:
+        if st.button("🗑️ Limpar Medições", use_container_width=True):
+            registo.limpar()
+            st.rerun()
+
+    df_resumo = registo.resumo()
+    if df_resumo.empty:
+        st.info("ℹ️ Ainda não há medições registadas")
+    else:
+        _mostrar_medicoes(registo, df_resumo)
+
+    # Perfis das importações mais recentes
+    st.markdown("### 📥 Importações Recentes")
+    df_execucoes = db_manager.obter_execucoes_importacao(20)
+    if df_execucoes.empty:
+        st.info("ℹ️ Nenhuma importação registada")
+    else:
+        st.dataframe(
+            df_execucoes[['id', 'iniciado_em', 'arquivo', 'linhas', 'sucesso', 'duracao_s', 'erro']],
+            use_container_width=True
+        )
+        id_execucao = st.selectbox("Ver fases da importação:", df_execucoes['id'].tolist())
+        mostrar_fases_importacao(df_execucoes[df_execucoes['id'] == id_execucao].iloc[0])
+
+    # Conexões abertas por este processo (arranque a frio do compute, tentativas)
+    st.markdown("### 🔌 Conexões Recentes")
+    df_conexoes = db_manager.conexoes.conexoes_recentes()
+    if df_conexoes.empty:
+        st.info("ℹ️ Nenhuma conexão aberta desde o arranque")
+    else:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Conexões abertas", len(df_conexoes))
+        with col2:
+            st.metric("Latência p95", f"{df_conexoes['duracao_ms'].quantile(0.95):,.0f} ms")
+        with col3:
+            st.metric("Com nova tentativa", int((df_conexoes['tentativas'] > 1).sum()))
+        st.dataframe(df_conexoes.sort_values('quando', ascending=False), use_container_width=True)
+
+    # Consultas acima do limiar gravadas na BD (persistem entre reinícios e réplicas)
+    st.markdown("### 🔎 Consultas Lentas Gravadas")
+    df_consultas = db_manager.obter_consultas_lentas(100)
+    if df_consultas.empty:
+        st.info("ℹ️ Nenhuma consulta lenta gravada")
+        return
+
+    st.dataframe(
+        df_consultas[['id', 'registado_em', 'duracao_ms', 'linhas', 'sql']],
+        use_container_width=True
+    )
+    id_consulta = st.selectbox("Ver detalhes da consulta:", df_consultas['id'].tolist())
+    consulta = df_consultas[df_consultas['id'] == id_consulta].iloc[0]
+    st.code(consulta['sql'], language='sql')
+    st.caption(f"Parâmetros: {consulta['parametros']}")
+    if consulta['plano']:
+        st.code(consulta['plano'], language='text')
+    else:
+        st.caption("Sem plano EXPLAIN (amostragem desativada ou não selecionada)")
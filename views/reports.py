@@ -1,15 +1,36 @@
 # -*- coding: utf-8 -*-
 import streamlit as st
 import pandas as pd
+import os
 import datetime
+import tempfile
+import utils
 
-# Tentar importar Plotly com fallback
-try:
-    import plotly.express as px
-    import plotly.graph_objects as go
-    PLOTLY_AVAILABLE = True
-except ImportError:
-    PLOTLY_AVAILABLE = False
+# Plotly com fallback, importado apenas quando o primeiro gráfico é desenhado
+PLOTLY_AVAILABLE = utils.modulo_disponivel("plotly")
+px = utils.ModuloPreguicoso("plotly.express")
+
+# Ordenações do relatório paginado (todas servidas por índice no servidor)
+ORDENACOES_RELATORIO = {
+    "PT / Localidade / Critério": "pt",
+    "Maior Valor": "valor_desc",
+    "Menor Valor": "valor_asc",
+    "CIL": "cil"
+}
+
+# Registros acima dos quais a exportação completa não é servida pela app (ver _indicar_exportacao_externa)
+LIMITE_EXPORTACAO_APP = 200000
+
+# Dimensões do cubo oferecidas para fatiamento: (rótulo, coluna)
+DIMENSOES_EXPLORADOR = {
+    "PT": "pt",
+    "Localidade": "localidade",
+    "Critério": "criterio",
+    "Anomalia": "anomalia",
+    "Tipo de Cliente": "desc_tp_cli",
+    "Estado Contrato": "est_contr",
+    "Estado": "estado"
+}
 
 def mostrar_relatorio_operacional(db_manager):
     """Relatório operacional detalhado."""
@@ -46,35 +67,114 @@ def mostrar_relatorio_operacional(db_manager):
         filtros['estado'] = filtro_estado
     
     if st.button("🔄 Gerar Relatório", type="primary"):
-        with st.spinner("Gerando relatório..."):
-            df_relatorio = db_manager.gerar_relatorio_detalhado(filtros)
-            
-        if not df_relatorio.empty:
-            st.success(f"✅ Relatório gerado com {len(df_relatorio)} registros")
-            
-            # Métricas do relatório
-            total_valor = df_relatorio['valor'].sum()
-            media_valor = df_relatorio['valor'].mean()
-            registros_prog = len(df_relatorio[df_relatorio['estado'] == 'prog'])
-            
-            col1, col2, col3 = st.columns(3)
-            col1.metric("Total do Relatório", f"{total_valor:,.2f} ECV")
-            col2.metric("Valor Médio", f"{media_valor:,.2f} ECV")
-            col3.metric("Em Progresso", registros_prog)
-            
-            # Tabela de dados
-            st.dataframe(df_relatorio, use_container_width=True)
-            
-            # Opção de download
-            csv = df_relatorio.to_csv(index=False, encoding='utf-8-sig')
-            st.download_button(
-                label="📥 Download CSV",
-                data=csv,
-                file_name=f"relatorio_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                mime="text/csv"
-            )
-        else:
-            st.warning("⚠️ Nenhum dado encontrado com os filtros aplicados")
+        st.session_state["relatorio_ativo"] = True
+    
+    if st.session_state.get("relatorio_ativo"):
+        _visualizador_relatorio(db_manager, filtros)
+    
+    # Exportação completa: pela app só até LIMITE_EXPORTACAO_APP (o download passa pela memória do servidor)
+    st.markdown("### 📦 Exportação Completa")
+    comprimir = st.checkbox("Comprimir (gzip)", value=True, key="relatorio_comprimir")
+    exportacao = (tuple(sorted(filtros.items())), comprimir)
+    if st.button("📦 Preparar Exportação", type="secondary"):
+        st.session_state["relatorio_exportacao"] = exportacao
+    # Só depois do pedido (e enquanto filtros e compressão não mudam) se conta e oferece o download
+    if st.session_state.get("relatorio_exportacao") == exportacao:
+        _oferecer_exportacao(db_manager, filtros, comprimir)
+
+def _oferecer_exportacao(db_manager, filtros, comprimir):
+    total = int(db_manager.resumir_relatorio(filtros).get('total_registros') or 0)
+    if total == 0:
+        st.warning("⚠️ Nenhum dado encontrado com os filtros aplicados")
+        return
+    if total > LIMITE_EXPORTACAO_APP:
+        _indicar_exportacao_externa(db_manager, filtros, comprimir, total)
+        return
+    sufixo = ".csv.gz" if comprimir else ".csv"
+    # O COPY só corre quando o utilizador clica (download diferido): nada fica em memória entre execuções
+    st.download_button(
+        label=f"📥 Download CSV ({total:,} registros)",
+        data=lambda: _exportar_para_arquivo(db_manager, filtros, comprimir),
+        file_name=f"relatorio_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{sufixo}",
+        mime="application/gzip" if comprimir else "text/csv",
+        on_click="ignore"
+    )
+
+def _exportar_para_arquivo(db_manager, filtros, comprimir):
+    """Exporta para um ficheiro temporário e devolve-o aberto para leitura (já removido do disco)."""
+    with tempfile.NamedTemporaryFile(suffix=".csv.gz" if comprimir else ".csv", delete=False) as temporario:
+        caminho = temporario.name
+    try:
+        if db_manager.exportar_relatorio_detalhado(filtros, caminho, comprimir=comprimir) is None:
+            raise RuntimeError("Erro ao exportar relatório")
+        return open(caminho, 'rb')
+    finally:
+        os.remove(caminho)
+
+def _indicar_exportacao_externa(db_manager, filtros, comprimir, total):
+    """Relatórios acima do limite: exportação em fluxo pela API (memória constante) ou pela linha de comandos."""
+    import api
+    st.info(
+        f"ℹ️ O relatório tem {total:,} registros, acima do limite de {LIMITE_EXPORTACAO_APP:,} "
+        "para download pela app. Use a exportação em fluxo (memória constante, mesmas credenciais da app):"
+    )
+    if not api.URL_PUBLICA:
+        api.iniciar_servidor_local(db_manager)
+    st.link_button("📥 Download pela API", api.url_relatorio(filtros, comprimir))
+    opcoes = "".join(f" --{coluna} '{valor}'" for coluna, valor in filtros.items())
+    st.code(f"python cli.py exportar --saida relatorio.csv{'.gz' if comprimir else ''}{opcoes}"
+            f"{'' if comprimir else ' --sem-compressao'}", language="bash")
+
+def _avancar_pagina(proxima):
+    st.session_state["relatorio_cursores"].append(proxima)
+
+def _recuar_pagina():
+    st.session_state["relatorio_cursores"].pop()
+
+@utils.fragmento
+def _visualizador_relatorio(db_manager, filtros):
+    """Relatório paginado no servidor: cada mudança de página é uma leitura indexada."""
+    col_ord, col_tam = st.columns(2)
+    with col_ord:
+        rotulo_ordem = st.selectbox("Ordenar por:", list(ORDENACOES_RELATORIO.keys()), key="relatorio_ordenacao")
+    with col_tam:
+        tamanho = st.selectbox("Registros por página:", db_manager.TAMANHOS_PAGINA_RELATORIO, index=1, key="relatorio_tamanho")
+    ordenacao = ORDENACOES_RELATORIO[rotulo_ordem]
+    
+    # Recomeçar da primeira página quando a consulta muda
+    consulta = (tuple(sorted(filtros.items())), ordenacao, tamanho)
+    if st.session_state.get("relatorio_consulta") != consulta:
+        st.session_state["relatorio_consulta"] = consulta
+        st.session_state["relatorio_cursores"] = [None]
+    cursores = st.session_state["relatorio_cursores"]
+    
+    resumo = db_manager.resumir_relatorio(filtros)
+    total = int(resumo.get('total_registros') or 0)
+    if total == 0:
+        st.warning("⚠️ Nenhum dado encontrado com os filtros aplicados")
+        return
+    
+    st.success(f"✅ Relatório gerado com {total:,} registros")
+    
+    # Métricas do relatório (agregadas no SQL)
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Total do Relatório", f"{resumo.get('total_valor') or 0:,.2f} ECV")
+    col2.metric("Valor Médio", f"{resumo.get('media_valor') or 0:,.2f} ECV")
+    col3.metric("Em Progresso", f"{int(resumo.get('registros_prog') or 0):,}")
+    
+    with st.spinner("Carregando página..."):
+        df_pagina, proxima = db_manager.obter_pagina_relatorio(filtros, ordenacao, tamanho, cursores[-1])
+    
+    st.dataframe(df_pagina, use_container_width=True)
+    
+    total_paginas = (total + tamanho - 1) // tamanho
+    col_ant, col_pag, col_prox = st.columns([1, 2, 1])
+    with col_ant:
+        st.button("◀ Anterior", disabled=len(cursores) == 1, on_click=_recuar_pagina, key="relatorio_anterior")
+    with col_pag:
+        st.caption(f"Página {len(cursores)} de {total_paginas}")
+    with col_prox:
+        st.button("Próxima ▶", disabled=proxima is None, on_click=_avancar_pagina, args=(proxima,), key="relatorio_proxima")
 
 def mostrar_analise_eficiencia(db_manager):
     """Análise de eficiência por PT e Localidade."""
@@ -138,6 +238,71 @@ def mostrar_analise_eficiencia(db_manager):
         except Exception as e:
             st.error(f"Erro ao criar treemap: {e}")
             st.dataframe(df_localidades, use_container_width=True)
+    
+    _explorador_cubo(db_manager)
+
+@utils.fragmento
+def _explorador_cubo(db_manager):
+    """Fatiamento livre do cubo pré-agregado (drill-down sem consultar a tabela bd)."""
+    st.markdown("### 🧊 Explorador Multidimensional")
+    
+    rotulos = st.multiselect(
+        "Agrupar por:",
+        list(DIMENSOES_EXPLORADOR.keys()),
+        default=["PT"],
+        key="cubo_dimensoes"
+    )
+    dimensoes = [DIMENSOES_EXPLORADOR[r] for r in rotulos]
+    
+    # Filtros de drill-down (cada um fixa uma fatia do cubo)
+    filtros = {}
+    colunas = st.columns(3)
+    for i, (rotulo, coluna) in enumerate([("PT", "pt"), ("Localidade", "localidade"), ("Critério", "criterio")]):
+        with colunas[i]:
+            valores = db_manager.obter_valores_unicos(coluna)
+            escolhido = st.selectbox(f"{rotulo}:", [""] + (valores if valores else []), key=f"cubo_filtro_{coluna}")
+            if escolhido:
+                filtros[coluna] = escolhido
+    
+    estado = st.radio("Estado:", ["Todos", "Em progresso", "Disponíveis"], horizontal=True, key="cubo_filtro_estado")
+    if estado == "Em progresso":
+        filtros['estado'] = 'prog'
+    elif estado == "Disponíveis":
+        filtros['estado'] = ''
+    
+    df_cubo = db_manager.consultar_cubo(dimensoes, filtros)
+    if df_cubo.empty:
+        st.info("ℹ️ Nenhum registro para a combinação selecionada")
+        return
+    
+    df_cubo['percentual_progresso'] = (df_cubo['em_progresso'] * 100.0 / df_cubo['registros']).round(2)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("📋 Registros", f"{int(df_cubo['registros'].sum()):,}")
+    with col2:
+        st.metric("🔄 Em Progresso", f"{int(df_cubo['em_progresso'].sum()):,}")
+    with col3:
+        st.metric("💰 Valor Total", f"{df_cubo['soma_valor'].sum():,.2f}")
+    
+    if dimensoes and PLOTLY_AVAILABLE:
+        try:
+            df_grafico = df_cubo.head(20).copy()
+            df_grafico['fatia'] = df_grafico[dimensoes].astype(str).agg(" / ".join, axis=1)
+            fig_cubo = px.bar(
+                df_grafico,
+                x='fatia',
+                y='registros',
+                color='percentual_progresso',
+                title=f"Top 20 por {' × '.join(rotulos)}",
+                labels={'fatia': ' / '.join(rotulos), 'registros': 'Registros', 'percentual_progresso': '% em Progresso'}
+            )
+            fig_cubo.update_layout(xaxis_tickangle=-45)
+            st.plotly_chart(fig_cubo, use_container_width=True)
+        except Exception as e:
+            st.error(f"Erro ao criar gráfico do explorador: {e}")
+    
+    st.dataframe(df_cubo, use_container_width=True)
 
 def mostrar_relatorio_usuarios(db_manager):
     """Relatório de atividade de usuários."""